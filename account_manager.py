@@ -154,15 +154,17 @@ class AccountManager:
             return True
         return False
     
-    def create_credentials_file(self, account: Dict, output_file: str = 'credentials.json'):
+    def get_client_config(self, account: Dict) -> Dict:
         """
-        Crea un file credentials.json per un account specifico
+        Crea la configurazione OAuth (formato credentials.json) in memoria
         
         Args:
             account: Dizionario con i dati dell'account
-            output_file: Nome del file di output
+        
+        Returns:
+            Dizionario con la configurazione del client OAuth
         """
-        credentials = {
+        return {
             "installed": {
                 "client_id": account['client_id'],
                 "project_id": "gmail-extractor",
@@ -173,6 +175,16 @@ class AccountManager:
                 "redirect_uris": ["http://localhost:8080/", "http://localhost:8080"]
             }
         }
+    
+    def create_credentials_file(self, account: Dict, output_file: str = 'credentials.json'):
+        """
+        Crea un file credentials.json per un account specifico
+        
+        Args:
+            account: Dizionario con i dati dell'account
+            output_file: Nome del file di output
+        """
+        credentials = self.get_client_config(account)
         
         with open(output_file, 'w') as f:
             json.dump(credentials, f, indent=2)
@@ -0,0 +1,178 @@
+"""
+Cache persistente delle analisi AI, indicizzata per contenuto dell'email
+Lo stesso template inviato più volte viene analizzato una sola volta
+"""
+
+import os
+import re
+import json
+import sqlite3
+import hashlib
+import unicodedata
+from email.utils import parseaddr
+from typing import Dict, Optional
+from dotenv import load_dotenv
+
+# Carica variabili d'ambiente
+load_dotenv()
+
+
+# Database SQLite della cache (vuoto = cache disattivata)
+ANALYSIS_CACHE_DB = os.getenv('ANALYSIS_CACHE_DB', 'analysis_cache.db')
+
+URL_PATTERN = re.compile(r'https?://[^\s<>"\']+')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalizza un testo per il confronto tra invii dello stesso template
+    
+    Unicode NFKC, minuscole, spazi compattati; dagli URL vengono rimossi
+    query string e frammenti (parametri di tracking diversi a ogni invio).
+    
+    Args:
+        text: Testo da normalizzare
+    
+    Returns:
+        Testo normalizzato
+    """
+    text = unicodedata.normalize('NFKC', text or '').lower()
+    text = URL_PATTERN.sub(lambda match: re.split(r'[?#]', match.group(0), maxsplit=1)[0], text)
+    return WHITESPACE_PATTERN.sub(' ', text).strip()
+
+
+def normalize_sender(sender: str) -> str:
+    """
+    Riduce il mittente al solo indirizzo email (il nome visualizzato può cambiare)
+    """
+    address = parseaddr(sender or '')[1]
+    return address.lower() if address else normalize_text(sender)
+
+
+def content_key(email: Dict, model: str, prompt_version: str) -> str:
+    """
+    Chiave della cache: hash di mittente, oggetto e corpo normalizzati, modello e versione del prompt
+    
+    Args:
+        email: Email nel formato di GmailExtractor (from, subject, body)
+        model: Modello usato per l'analisi
+        prompt_version: Versione del prompt di analisi
+    
+    Returns:
+        Hash sha256 esadecimale
+    """
+    parts = [
+        prompt_version,
+        model,
+        normalize_sender(email.get('from', '')),
+        normalize_text(email.get('subject', '')),
+        normalize_text(email.get('body', ''))
+    ]
+    return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+
+class AnalysisCache:
+    """
+    Analisi del modello salvate in SQLite, con contatori di hit e miss
+    """
+    
+    def __init__(self, db_path: str = ANALYSIS_CACHE_DB):
+        """
+        Inizializza la cache
+        
+        Args:
+            db_path: Path del database SQLite della cache
+        """
+        self.db_path = db_path
+        self.hits = 0
+        self.misses = 0
+        self._create_tables()
+    
+    def _create_tables(self):
+        """
+        Crea la tabella della cache se non esiste
+        """
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS analysis_cache (
+                cache_key TEXT PRIMARY KEY,
+                model TEXT,
+                prompt_version TEXT,
+                analysis TEXT NOT NULL,
+                hit_count INTEGER DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                last_hit_at TIMESTAMP
+            )
+        ''')
+        conn.commit()
+        conn.close()
+    
+    def get(self, cache_key: str) -> Optional[Dict]:
+        """
+        Recupera un'analisi dalla cache
+        
+        Args:
+            cache_key: Chiave calcolata con content_key
+        
+        Returns:
+            Campi dell'analisi, None se non presenti
+        """
+        try:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            cursor = conn.cursor()
+            cursor.execute('SELECT analysis FROM analysis_cache WHERE cache_key = ?', (cache_key,))
+            row = cursor.fetchone()
+            if row:
+                cursor.execute('''
+                    UPDATE analysis_cache SET hit_count = hit_count + 1, last_hit_at = CURRENT_TIMESTAMP
+                    WHERE cache_key = ?
+                ''', (cache_key,))
+                conn.commit()
+            conn.close()
+        except Exception as e:
+            print(f"⚠️  Errore nella lettura della cache delle analisi: {e}")
+            row = None
+        
+        if row:
+            self.hits += 1
+            return json.loads(row[0])
+        self.misses += 1
+        return None
+    
+    def put(self, cache_key: str, analysis: Dict, model: str = '', prompt_version: str = ''):
+        """
+        Salva un'analisi nella cache
+        
+        Args:
+            cache_key: Chiave calcolata con content_key
+            analysis: Campi JSON restituiti dal modello
+            model: Modello usato
+            prompt_version: Versione del prompt
+        """
+        try:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT OR REPLACE INTO analysis_cache (cache_key, model, prompt_version, analysis)
+                VALUES (?, ?, ?, ?)
+            ''', (cache_key, model, prompt_version, json.dumps(analysis)))
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            print(f"⚠️  Errore nel salvataggio della cache delle analisi: {e}")
+    
+    def get_stats(self) -> Dict:
+        """
+        Statistiche di utilizzo della cache in questa esecuzione
+        
+        Returns:
+            Dizionario con hit, miss e hit rate percentuale
+        """
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups * 100, 1) if lookups else 0.0
+        }
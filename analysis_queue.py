@@ -0,0 +1,489 @@
+"""
+Coda persistente delle email in attesa di analisi, ordinata per priorità
+Monitor e backfill condividono lo stesso budget OpenAI: le email appena arrivate (live)
+passano davanti a quelle recenti, che passano davanti allo storico (backfill)
+
+Uso: python analysis_queue.py stats [emails.db]
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import sqlite3
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Optional
+from dotenv import load_dotenv
+
+# Carica variabili d'ambiente
+load_dotenv()
+
+# Database della coda (vuoto = disattivata: ogni processo analizza subito le proprie email)
+ANALYSIS_QUEUE_DB = os.getenv('ANALYSIS_QUEUE_DB', 'emails.db')
+
+# Email prese in carico da un worker per volta: limita l'attesa di un'email live dietro il backfill
+ANALYSIS_QUEUE_LEASE_SIZE = int(os.getenv('ANALYSIS_QUEUE_LEASE_SIZE', 50))
+
+# Secondi dopo i quali le email di un worker interrotto tornano disponibili
+ANALYSIS_QUEUE_LEASE_SECONDS = int(os.getenv('ANALYSIS_QUEUE_LEASE_SECONDS', 600))
+
+# Secondi di attesa del backfill mentre altri worker analizzano email più prioritarie
+ANALYSIS_QUEUE_YIELD_SECONDS = float(os.getenv('ANALYSIS_QUEUE_YIELD_SECONDS', 1))
+
+# Email del backfill più recenti di questi giorni hanno priorità 'recent'
+ANALYSIS_RECENT_DAYS = int(os.getenv('ANALYSIS_RECENT_DAYS', 7))
+
+# Priorità (valore più basso = prima)
+PRIORITIES = {
+    'live': 0,
+    'recent': 1,
+    'backfill': 2
+}
+
+
+def priority_for(email: Dict) -> str:
+    """
+    Priorità di un'email del backfill in base alla data (header Date)
+    
+    Args:
+        email: Email nel formato di GmailExtractor
+    
+    Returns:
+        'recent' se più recente di ANALYSIS_RECENT_DAYS giorni, altrimenti 'backfill'
+    """
+    try:
+        date = parsedate_to_datetime(email.get('date', ''))
+    except (TypeError, ValueError):
+        return 'backfill'
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    if datetime.now(timezone.utc) - date <= timedelta(days=ANALYSIS_RECENT_DAYS):
+        return 'recent'
+    return 'backfill'
+
+
+class AnalysisQueue:
+    """
+    Coda SQLite delle email da analizzare, presa in carico dai worker per priorità ed età
+    """
+    
+    def __init__(self, db_path: str = ANALYSIS_QUEUE_DB, lease_seconds: int = ANALYSIS_QUEUE_LEASE_SECONDS):
+        """
+        Inizializza la coda
+        
+        Args:
+            db_path: Database della coda (default: accanto alla tabella emails)
+            lease_seconds: Durata della presa in carico di un worker
+        """
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self._create_tables()
+    
+    def _connect(self) -> sqlite3.Connection:
+        # Transazioni esplicite: la presa in carico deve essere atomica tra processi diversi
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+    
+    def _create_tables(self):
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS analysis_queue (
+                email_id TEXT PRIMARY KEY,
+                email_json TEXT NOT NULL,
+                priority INTEGER NOT NULL,
+                enqueued_at REAL NOT NULL,
+                leased_until REAL DEFAULT 0,
+                worker TEXT
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_analysis_queue_priority
+            ON analysis_queue(priority, enqueued_at)
+        ''')
+        conn.commit()
+        conn.close()
+    
+    def enqueue(self, emails: List[Dict], priority: Optional[str] = None, worker: Optional[str] = None) -> int:
+        """
+        Accoda le email da analizzare
+        
+        Un'email già in coda mantiene la priorità più alta tra la vecchia e la nuova.
+        
+        Args:
+            emails: Email nel formato di GmailExtractor (serve l'ID)
+            priority: live, recent o backfill (None = in base alla data con priority_for)
+            worker: Se indicato, le email sono già prese in carico da questo worker
+                    (tranne quelle che un altro worker sta analizzando)
+        
+        Returns:
+            Numero di email accodate
+        """
+        now = time.time()
+        leased_until = now + self.lease_seconds if worker else 0
+        rows = [
+            (email['id'], json.dumps(email, default=str), PRIORITIES[priority or priority_for(email)],
+             now, leased_until, worker)
+            for email in emails if email.get('id')
+        ]
+        if not rows:
+            return 0
+        conn = self._connect()
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.executemany('''
+            INSERT INTO analysis_queue (email_id, email_json, priority, enqueued_at, leased_until, worker)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(email_id) DO UPDATE SET
+                email_json = excluded.email_json,
+                priority = MIN(analysis_queue.priority, excluded.priority),
+                worker = CASE WHEN analysis_queue.leased_until <= ?
+                              THEN excluded.worker ELSE analysis_queue.worker END,
+                leased_until = CASE WHEN analysis_queue.leased_until <= ?
+                                    THEN excluded.leased_until ELSE analysis_queue.leased_until END
+        ''', [row + (now, now) for row in rows])
+        cursor.execute('COMMIT')
+        conn.close()
+        return len(rows)
+    
+    def leased_ids(self, worker: str, email_ids: List[str]) -> set:
+        """
+        Tra gli ID indicati, quelli presi in carico dal worker
+        """
+        if not email_ids:
+            return set()
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        now = time.time()
+        email_ids = list(email_ids)
+        leased = set()
+        # SQLite limita il numero di parametri per query
+        for start in range(0, len(email_ids), 500):
+            chunk = email_ids[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            cursor.execute(f'''
+                SELECT email_id FROM analysis_queue
+                WHERE worker = ? AND leased_until > ? AND email_id IN ({placeholders})
+            ''', [worker, now] + chunk)
+            leased.update(row[0] for row in cursor.fetchall())
+        conn.close()
+        return leased
+    
+    def queued_ids(self, email_ids: List[str]) -> set:
+        """
+        Tra gli ID indicati, quelli ancora in coda (in attesa o in analisi)
+        """
+        if not email_ids:
+            return set()
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        email_ids = list(email_ids)
+        queued = set()
+        # SQLite limita il numero di parametri per query
+        for start in range(0, len(email_ids), 500):
+            chunk = email_ids[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            cursor.execute(f'SELECT email_id FROM analysis_queue WHERE email_id IN ({placeholders})', chunk)
+            queued.update(row[0] for row in cursor.fetchall())
+        conn.close()
+        return queued
+    
+    def lease(self, worker: str, limit: int = ANALYSIS_QUEUE_LEASE_SIZE,
+              max_priority: Optional[str] = None) -> List[Dict]:
+        """
+        Prende in carico le prossime email: priorità più alta prima, a parità le più vecchie in coda
+        
+        Args:
+            worker: Identificativo del worker
+            limit: Numero massimo di email
+            max_priority: Priorità più bassa da prendere in carico (None = tutte)
+        
+        Returns:
+            Email nel formato di GmailExtractor
+        """
+        now = time.time()
+        conn = self._connect()
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('''
+            SELECT email_id, email_json FROM analysis_queue
+            WHERE leased_until <= ? AND priority <= ?
+            ORDER BY priority, enqueued_at
+            LIMIT ?
+        ''', (now, PRIORITIES[max_priority or 'backfill'], limit))
+        rows = cursor.fetchall()
+        cursor.executemany('UPDATE analysis_queue SET leased_until = ?, worker = ? WHERE email_id = ?',
+                           [(now + self.lease_seconds, worker, email_id) for email_id, _ in rows])
+        cursor.execute('COMMIT')
+        conn.close()
+        return [json.loads(email_json) for _, email_json in rows]
+    
+    def should_yield(self, worker: str, max_priority: Optional[str] = None) -> bool:
+        """
+        True se altri worker stanno analizzando email più prioritarie della prossima disponibile:
+        il worker aspetta per lasciare loro il budget di richieste
+        
+        Args:
+            worker: Identificativo del worker
+            max_priority: Priorità più bassa che il worker prende in carico (None = tutte)
+        """
+        now = time.time()
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT
+                (SELECT MIN(priority) FROM analysis_queue WHERE leased_until <= ? AND priority <= ?),
+                (SELECT MIN(priority) FROM analysis_queue WHERE leased_until > ? AND worker != ?)
+        ''', (now, PRIORITIES[max_priority or 'backfill'], now, worker))
+        next_priority, running_priority = cursor.fetchone()
+        conn.close()
+        return next_priority is not None and running_priority is not None and running_priority < next_priority
+    
+    def complete(self, email_ids: List[str]):
+        """
+        Rimuove dalla coda le email analizzate e salvate
+        """
+        if not email_ids:
+            return
+        conn = self._connect()
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.executemany('DELETE FROM analysis_queue WHERE email_id = ?', [(email_id,) for email_id in email_ids])
+        cursor.execute('COMMIT')
+        conn.close()
+    
+    def release(self, email_ids: List[str]):
+        """
+        Rimette a disposizione degli altri worker le email prese in carico e non analizzate
+        """
+        if not email_ids:
+            return
+        conn = self._connect()
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.executemany('UPDATE analysis_queue SET leased_until = 0, worker = NULL WHERE email_id = ?',
+                           [(email_id,) for email_id in email_ids])
+        cursor.execute('COMMIT')
+        conn.close()
+    
+    def release_worker(self, worker: str) -> int:
+        """
+        Rimette a disposizione degli altri worker tutte le email prese in carico da un worker
+        (all'avvio, quelle rimaste da un'esecuzione interrotta; alla chiusura, quelle non analizzate)
+        
+        Returns:
+            Numero di email rilasciate
+        """
+        conn = self._connect()
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('UPDATE analysis_queue SET leased_until = 0, worker = NULL WHERE worker = ?', (worker,))
+        released = cursor.rowcount
+        cursor.execute('COMMIT')
+        conn.close()
+        return released
+    
+    def get_stats(self) -> Dict:
+        """
+        Statistiche della coda per priorità
+        
+        Returns:
+            Dizionario priorità -> email in attesa, in analisi e secondi di attesa della più vecchia
+        """
+        now = time.time()
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT
+                priority,
+                COALESCE(SUM(leased_until <= ?), 0),
+                COALESCE(SUM(leased_until > ?), 0),
+                MIN(CASE WHEN leased_until <= ? THEN enqueued_at END)
+            FROM analysis_queue
+            GROUP BY priority
+        ''', (now, now, now))
+        rows = {row[0]: row[1:] for row in cursor.fetchall()}
+        conn.close()
+        
+        stats = {}
+        for name, priority in PRIORITIES.items():
+            pending, leased, oldest = rows.get(priority, (0, 0, None))
+            stats[name] = {
+                'pending': pending,
+                'leased': leased,
+                'oldest_wait_seconds': now - oldest if oldest is not None else 0.0
+            }
+        return stats
+
+
+class AnalysisWorker:
+    """
+    Analizza e salva le email passando dalla coda (o direttamente, se la coda è disattivata)
+    """
+    
+    def __init__(self, analyzer, db, queue: Optional[AnalysisQueue] = None, use_queue: bool = True,
+                 lease_size: int = ANALYSIS_QUEUE_LEASE_SIZE, role: Optional[str] = None):
+        """
+        Inizializza il worker
+        
+        Args:
+            analyzer: EmailAnalyzer usato per le analisi
+            db: EmailDatabase in cui salvare le email analizzate
+            queue: Coda condivisa (default: AnalysisQueue su ANALYSIS_QUEUE_DB)
+            use_queue: False = analisi diretta senza coda
+            lease_size: Email prese in carico per volta da run()
+            role: Ruolo del worker (es. email_monitor): l'identificativo resta lo stesso dopo un riavvio,
+                così il worker ritrova le email che aveva preso in carico (None = identificativo per processo)
+        """
+        self.analyzer = analyzer
+        self.db = db
+        if queue is None and use_queue and ANALYSIS_QUEUE_DB:
+            queue = AnalysisQueue()
+        self.queue = queue if use_queue else None
+        self.lease_size = lease_size
+        self.worker_id = f"{socket.gethostname()}:{role or os.getpid()}"
+        self.saved_count = 0
+    
+    def _process(self, emails: List[Dict]) -> List[Dict]:
+        """
+        Analizza e salva le email, poi le toglie dalla coda
+        """
+        email_ids = [email['id'] for email in emails if email.get('id')]
+        try:
+            analyzed_emails = self.analyzer.analyze_batch(emails)
+            saved_count = self.db.save_batch(analyzed_emails)
+        except BaseException:
+            if self.queue is not None:
+                self.queue.release(email_ids)
+            raise
+        self.saved_count += saved_count
+        print(f"💾 Salvate {saved_count}/{len(emails)} email analizzate")
+        if self.queue is not None:
+            # Le email non salvate restano in coda: tornano disponibili alla scadenza della presa in carico
+            self.queue.complete(list(self.db.get_existing_email_ids(email_ids)))
+        return analyzed_emails
+    
+    def analyze_now(self, emails: List[Dict], priority: str = 'live') -> List[Dict]:
+        """
+        Analizza subito le email ricevute ora (monitor): sono accodate già prese in carico,
+        così un riavvio non le perde e il backfill aspetta che siano analizzate
+        
+        Args:
+            emails: Email nel formato di GmailExtractor
+            priority: Priorità in coda
+        
+        Returns:
+            Email analizzate da questo worker (esclude quelle già in analisi presso un altro worker)
+        """
+        if not emails:
+            return []
+        if self.queue is None:
+            return self._process(emails)
+        
+        self.queue.enqueue(emails, priority, worker=self.worker_id)
+        leased = self.queue.leased_ids(self.worker_id, [email['id'] for email in emails if email.get('id')])
+        owned = [email for email in emails if not email.get('id') or email['id'] in leased]
+        if len(owned) < len(emails):
+            print(f"ℹ️  {len(emails) - len(owned)} email già in analisi presso un altro worker")
+        return self._process(owned) if owned else []
+    
+    def submit(self, emails: List[Dict], priority: Optional[str] = None) -> List[Dict]:
+        """
+        Accoda le email (backfill) e analizza la coda per priorità finché non è vuota
+        
+        Args:
+            emails: Email nel formato di GmailExtractor
+            priority: Priorità in coda (None = recent o backfill in base alla data)
+        
+        Returns:
+            Email analizzate da questo worker
+        """
+        if self.queue is None:
+            return self._process(emails) if emails else []
+        self.queue.enqueue(emails, priority)
+        return self.run()
+    
+    def run(self, max_emails: Optional[int] = None, max_priority: Optional[str] = None) -> List[Dict]:
+        """
+        Prende in carico e analizza le email in coda, più prioritarie e più vecchie prima
+        
+        Mentre altri worker analizzano email più prioritarie della prossima in coda
+        (es. il monitor con le email live) aspetta, lasciando loro il budget di richieste.
+        
+        Args:
+            max_emails: Numero massimo di email (None = finché la coda non è vuota)
+            max_priority: Priorità più bassa da prendere in carico (es. 'live' per i monitor; None = tutte)
+        
+        Returns:
+            Email analizzate da questo worker
+        """
+        if self.queue is None:
+            return []
+        analyzed_emails = []
+        while max_emails is None or len(analyzed_emails) < max_emails:
+            if self.queue.should_yield(self.worker_id, max_priority):
+                time.sleep(ANALYSIS_QUEUE_YIELD_SECONDS)
+                continue
+            limit = self.lease_size if max_emails is None else min(self.lease_size, max_emails - len(analyzed_emails))
+            emails = self.queue.lease(self.worker_id, limit, max_priority)
+            if not emails:
+                break
+            analyzed_emails.extend(self._process(emails))
+        return analyzed_emails
+    
+    def recover(self) -> List[Dict]:
+        """
+        All'avvio di un monitor: rilascia le email rimaste prese in carico da un'esecuzione
+        interrotta con lo stesso ruolo e analizza le email live in attesa
+        
+        Returns:
+            Email analizzate
+        """
+        if self.queue is None:
+            return []
+        released = self.queue.release_worker(self.worker_id)
+        if released:
+            print(f"♻️  {released} email rimaste in analisi da un'esecuzione precedente")
+        return self.run(max_priority='live')
+    
+    def unsaved(self, email_ids: List[str], resolved=()) -> List[str]:
+        """
+        ID né salvati nel database né in coda: un checkpoint che li superasse li perderebbe
+        
+        Args:
+            email_ids: ID da controllare
+            resolved: ID da non attendere (es. GmailExtractor.unavailable_ids: messaggi eliminati)
+        """
+        email_ids = [email_id for email_id in email_ids if email_id not in resolved]
+        saved = self.db.get_existing_email_ids(email_ids)
+        queued = self.queue.queued_ids(email_ids) if self.queue is not None else set()
+        return [email_id for email_id in email_ids if email_id not in saved and email_id not in queued]
+    
+    def close(self):
+        """
+        Rilascia le email prese in carico e non ancora analizzate (chiusura del monitor)
+        """
+        if self.queue is not None:
+            self.queue.release_worker(self.worker_id)
+
+
+def main():
+    """
+    Uso: python analysis_queue.py stats [emails.db]
+    """
+    if len(sys.argv) < 2 or sys.argv[1] != 'stats':
+        print(main.__doc__.strip())
+        return
+    
+    queue = AnalysisQueue(sys.argv[2] if len(sys.argv) > 2 else ANALYSIS_QUEUE_DB)
+    print("="*60)
+    print("📬 CODA DELLE ANALISI")
+    print("="*60)
+    print(f"{'Priorità':<10} {'In attesa':>10} {'In analisi':>11} {'Attesa max':>12}")
+    for name, stats in queue.get_stats().items():
+        print(f"{name:<10} {stats['pending']:>10} {stats['leased']:>11} {stats['oldest_wait_seconds']:>11.0f}s")
+
+
+if __name__ == '__main__':
+    main()
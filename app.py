@@ -8,6 +8,7 @@ from database import EmailDatabase
 from products_manager import ProductsManager
 from document_processor import DocumentProcessor
 from swipe_generator import SwipeGenerator
+from llm_resilience import RetryPolicy, OPENAI_INTERACTIVE_MAX_RETRIES, OPENAI_INTERACTIVE_MAX_DELAY
 from supabase_sync import SupabaseSync
 from werkzeug.utils import secure_filename
 from datetime import datetime
@@ -46,7 +47,10 @@ except Exception as e:
 # Inizializza il generatore di swipe con OpenAI
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 if OPENAI_API_KEY:
-    swipe_gen = SwipeGenerator(api_key=OPENAI_API_KEY, use_ai=True)
+    # Lo swipe gira dentro la richiesta HTTP: pochi retry brevi e nessuna attesa del circuit breaker
+    swipe_retry_policy = RetryPolicy(max_retries=OPENAI_INTERACTIVE_MAX_RETRIES,
+                                     max_delay=OPENAI_INTERACTIVE_MAX_DELAY, wait_when_open=False)
+    swipe_gen = SwipeGenerator(api_key=OPENAI_API_KEY, use_ai=True, retry_policy=swipe_retry_policy)
 else:
     print("⚠️ OPENAI_API_KEY non trovata - Swipe in modalità simulata")
     swipe_gen = SwipeGenerator(use_ai=False)
@@ -498,6 +502,8 @@ def swipe_api_v1():
             'swiped': swiped_text,
             'usedAI': result.get('method') == 'ai',
             'aiProvider': result.get('ai_provider', 'Simulated'),
+            'fallback': result.get('fallback', False),
+            'fallbackReason': result.get('fallback_reason', ''),
             'timestamp': datetime.utcnow().isoformat() + 'Z',
             'metadata': {
                 'subject': result.get('swiped_subject'),
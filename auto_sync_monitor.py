@@ -11,6 +11,9 @@ from email_analyzer import EmailAnalyzer
 from database import EmailDatabase
 from supabase_sync import SupabaseSync
 from account_manager import AccountManager
+from history_sync import HistorySync
+from llm_resilience import ANALYSIS_RETRY_DRAIN_MINUTES
+from analysis_queue import AnalysisWorker
 import os
 from dotenv import load_dotenv
 
@@ -20,6 +23,7 @@ load_dotenv()
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 CHECK_INTERVAL_MINUTES = int(os.getenv('CHECK_INTERVAL_MINUTES', 15))
 ENABLE_SUPABASE = os.getenv('ENABLE_SUPABASE', 'true').lower() == 'true'
+SYNC_MODE = os.getenv('SYNC_MODE', 'history').lower()
 
 
 class AutoSyncMonitor:
@@ -34,7 +38,9 @@ class AutoSyncMonitor:
         self.check_interval = check_interval
         self.local_db = EmailDatabase()
         self.analyzer = EmailAnalyzer(api_key=OPENAI_API_KEY)
+        self.worker = AnalysisWorker(self.analyzer, self.local_db, role='auto_sync_monitor')
         self.extractor = None
+        self.history_sync = None
         self.supabase = None
         self.running = False
         
@@ -66,13 +72,15 @@ class AutoSyncMonitor:
                 print(f"\n📧 Account attivo: {active['name']}")
             
             self.extractor = GmailExtractor(account_manager=account_mgr)
+            if SYNC_MODE == 'history':
+                self.history_sync = HistorySync(self.extractor, self.local_db)
             
             profile = self.extractor.get_profile()
             if profile:
                 print(f"✅ Connesso a Gmail: {profile['emailAddress']}")
                 return True
             return False
-                
+        
         except Exception as e:
             print(f"❌ Errore inizializzazione Gmail: {e}")
             return False
@@ -81,8 +89,23 @@ class AutoSyncMonitor:
         """
         Recupera gli ID delle email già nel database locale
         """
-        emails = self.local_db.get_all_emails()
-        return {email['email_id'] for email in emails if email.get('email_id')}
+        return self.local_db.get_existing_email_ids()
+    
+    def get_new_message_ids(self) -> list:
+        """
+        Recupera gli ID delle nuove email (History API o ultimi 50 messaggi)
+        """
+        if self.history_sync:
+            print("📥 Sync incrementale da Gmail (History API)...")
+            return self.history_sync.get_new_message_ids()
+        
+        existing_ids = self.get_existing_email_ids()
+        print(f"📊 Email in database locale: {len(existing_ids)}")
+        
+        print("📥 Recupero email recenti da Gmail...")
+        messages = self.extractor.get_messages(max_results=50)
+        
+        return [msg['id'] for msg in messages if msg['id'] not in existing_ids]
     
     def check_and_sync(self):
         """
@@ -93,40 +116,31 @@ class AutoSyncMonitor:
         print(f"🔍 Controllo + Sync - {timestamp}")
         print(f"{'='*80}")
         
+        # Email live rimaste in coda (es. presa in carico scaduta di un worker interrotto)
+        self.process_queued_live()
+        
         try:
             # 1. Identifica nuove email
-            existing_ids = self.get_existing_email_ids()
-            print(f"📊 Email in database locale: {len(existing_ids)}")
-            
-            print("📥 Recupero email recenti da Gmail...")
-            messages = self.extractor.get_messages(max_results=50)
-            
-            new_messages = [msg for msg in messages if msg['id'] not in existing_ids]
+            new_messages = self.get_new_message_ids()
+            if new_messages is None:
+                print("❌ Impossibile recuperare le nuove email da Gmail")
+                return
             
             if not new_messages:
                 print("✅ Nessuna nuova email")
+                if self.history_sync:
+                    self.history_sync.commit()
                 return
             
             print(f"🆕 Trovate {len(new_messages)} nuove email!")
             
-            # 2. Estrai dettagli
-            new_emails_data = []
-            for idx, message in enumerate(new_messages, 1):
-                print(f"📧 Email {idx}/{len(new_messages)}...", end='\r')
-                email_detail = self.extractor.get_message_detail(message['id'])
-                if email_detail:
-                    new_emails_data.append(email_detail)
-            
-            print()
+            # 2. Estrai dettagli (in parallelo)
+            print(f"📧 Estrazione dettagli di {len(new_messages)} email...")
+            new_emails_data = self.extractor.get_messages_details(new_messages)
             
-            # 3. Analizza con AI
+            # 3-4. Analizza con AI e salva in locale (SQLite), con priorità live sul backfill in corso
             print(f"🤖 Analisi AI per {len(new_emails_data)} email...")
-            analyzed_emails = self.analyzer.analyze_batch(new_emails_data)
-            
-            # 4. Salva in locale (SQLite)
-            print(f"💾 Salvataggio locale (SQLite)...")
-            saved_local = self.local_db.save_batch(analyzed_emails)
-            print(f"✅ Salvate localmente: {saved_local} email")
+            analyzed_emails = self.worker.analyze_now(new_emails_data)
             
             # 5. Sincronizza con Supabase
             if self.supabase:
@@ -136,14 +150,51 @@ class AutoSyncMonitor:
             else:
                 print("ℹ️  Supabase disabilitato - Skip sync cloud")
             
+            # Il checkpoint avanza solo se ogni nuova email è salvata, ancora in coda o non più su Gmail
+            unsaved = self.worker.unsaved(new_messages, resolved=self.extractor.unavailable_ids)
+            if unsaved:
+                print(f"⚠️  {len(unsaved)} email non salvate: verranno riprese al prossimo controllo")
+            elif self.history_sync:
+                self.history_sync.commit()
+            
             # 6. Riepilogo
             self.show_summary(analyzed_emails)
-            
+        
         except Exception as e:
             print(f"\n❌ Errore durante controllo: {e}")
             import traceback
             traceback.print_exc()
     
+    def process_queued_live(self, recover: bool = False):
+        """
+        Analizza le email live rimaste in coda e le sincronizza con Supabase
+        
+        Args:
+            recover: True all'avvio, per riprendere anche quelle di un'esecuzione interrotta
+        """
+        try:
+            analyzed_emails = self.worker.recover() if recover else self.worker.run(max_priority='live')
+            if analyzed_emails and self.supabase:
+                supabase_stats = self.supabase.sync_batch(analyzed_emails)
+                print(f"✅ Sincronizzate su Supabase: {supabase_stats['success']} email riprese dalla coda")
+        except Exception as e:
+            print(f"\n❌ Errore durante l'analisi delle email in coda: {e}")
+    
+    def drain_retry_queue(self):
+        """
+        Rianalizza le email la cui analisi era fallita e aggiorna il database locale
+        
+        Su Supabase le email sono già state inserite al primo controllo
+        (senza i campi dell'analisi): non vanno sincronizzate di nuovo.
+        """
+        try:
+            recovered = self.analyzer.retry_failed_analyses()
+            if recovered:
+                saved_local = self.local_db.save_batch(recovered)
+                print(f"💾 Aggiornate localmente: {saved_local} email")
+        except Exception as e:
+            print(f"\n❌ Errore durante i nuovi tentativi di analisi: {e}")
+    
     def show_summary(self, emails: list):
         """
         Mostra riepilogo delle email processate
@@ -191,10 +242,13 @@ class AutoSyncMonitor:
         
         # Primo controllo
         print("📍 Primo controllo...")
+        self.process_queued_live(recover=True)
         self.check_and_sync()
+        self.drain_retry_queue()
         
-        # Schedula controlli
+        # Schedula controlli e nuovi tentativi delle analisi fallite
         schedule.every(self.check_interval).minutes.do(self.check_and_sync)
+        schedule.every(ANALYSIS_RETRY_DRAIN_MINUTES).minutes.do(self.drain_retry_queue)
         
         self.running = True
         
@@ -212,6 +266,7 @@ class AutoSyncMonitor:
         Ferma il monitor
         """
         self.running = False
+        self.worker.close()
         print("\n✅ Monitor fermato")
 
 
@@ -0,0 +1,107 @@
+"""
+Benchmark offline della pipeline di analisi sul backend mock
+Misura throughput, latenza delle chiamate (p50/p95/p99), retry ed errori
+con diverse distribuzioni di latenza e quote di errori 429/5xx
+
+Uso: python benchmark_backend.py [numero_email]
+"""
+
+import os
+import sys
+import time
+import sqlite3
+import tempfile
+from typing import Dict, List
+from benchmark_packing import sample_emails
+from email_analyzer import EmailAnalyzer
+from llm_backend import MockBackend
+from llm_ledger import LLMLedger
+from llm_resilience import RetryPolicy
+from mock_openai_server import MockOpenAIState
+
+
+# Scenari confrontati: nome -> parametri di MockOpenAIState
+SCENARIOS = {
+    'fissa 200ms': {'chat_latency': 0.2},
+    'lognormal σ=0.5': {'chat_latency': 0.2, 'latency_distribution': 'lognormal', 'latency_sigma': 0.5},
+    'lognormal σ=1.0': {'chat_latency': 0.2, 'latency_distribution': 'lognormal', 'latency_sigma': 1.0},
+    '5xx 5%': {'chat_latency': 0.2, 'latency_distribution': 'lognormal', 'chat_error_rate': 0.05},
+    '429 10%': {'chat_latency': 0.2, 'latency_distribution': 'lognormal', 'rate_limit_rate': 0.10,
+                'retry_after': 0.5}
+}
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """
+    Percentile (nearest rank) di una lista di valori
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def benchmark(emails: list, state_params: Dict, ledger_path: str) -> Dict:
+    """
+    Analizza le email sul backend mock configurato e raccoglie le misure
+    
+    Args:
+        emails: Email da analizzare
+        state_params: Parametri di MockOpenAIState (latenza, errori)
+        ledger_path: Database del registro delle chiamate dello scenario
+    
+    Returns:
+        Dizionario con le misure
+    """
+    ledger = LLMLedger(ledger_path)
+    backend = MockBackend(ledger, RetryPolicy(base_delay=0.2), MockOpenAIState(**state_params))
+    analyzer = EmailAnalyzer('sk-mock', backend=backend, use_cache=False, use_near_duplicates=False,
+                             use_pre_classifier=False, use_retry_queue=False)
+    
+    start = time.perf_counter()
+    results = analyzer.analyze_batch(emails, progress_callback=lambda done, total: None)
+    seconds = time.perf_counter() - start
+    backend.close()
+    
+    conn = sqlite3.connect(ledger_path)
+    cursor = conn.cursor()
+    cursor.execute("SELECT latency_ms FROM llm_calls WHERE status = 'ok'")
+    latencies = [row[0] for row in cursor.fetchall()]
+    cursor.execute("SELECT COUNT(*), COALESCE(SUM(attempt > 1), 0) FROM llm_calls")
+    calls, retried = cursor.fetchone()
+    conn.close()
+    
+    return {
+        'emails_per_second': len(emails) / seconds,
+        'calls': calls,
+        'retried': retried,
+        'p50': percentile(latencies, 0.50),
+        'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99),
+        'errors': sum(1 for result in results if 'error' in result)
+    }
+
+
+def main():
+    """
+    Esegue tutti gli scenari e stampa la tabella di confronto
+    """
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    emails = sample_emails(count)
+    workdir = tempfile.mkdtemp(prefix='benchmark_backend_')
+    
+    print("\n" + "="*96)
+    print(f"{'Scenario':<18} {'Email':>6} {'Email/s':>8} {'Chiamate':>9} {'Retry':>6} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'Errori':>7}")
+    print("="*96)
+    
+    for name, state_params in SCENARIOS.items():
+        ledger_path = os.path.join(workdir, f"ledger_{len(os.listdir(workdir))}.db")
+        result = benchmark(emails, state_params, ledger_path)
+        print(f"{name:<18} {len(emails):>6} {result['emails_per_second']:>8.1f} {result['calls']:>9} "
+              f"{result['retried']:>6} {result['p50']:>8.0f} {result['p95']:>8.0f} {result['p99']:>8.0f} "
+              f"{result['errors']:>7}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Confronta il recupero delle email in formato 'full' e 'raw'
+Misura dimensione del payload, tempo di download e tempo di decodifica
+"""
+
+import sys
+import json
+import time
+from gmail_extractor import GmailExtractor
+
+
+def benchmark(extractor: GmailExtractor, message_ids: list, fetch_format: str) -> dict:
+    """
+    Scarica e parsa gli stessi messaggi in un formato
+    
+    Args:
+        extractor: GmailExtractor autenticato
+        message_ids: ID dei messaggi da scaricare
+        fetch_format: 'full' oppure 'raw'
+    
+    Returns:
+        Dizionario con le misure
+    """
+    extractor.fetch_format = fetch_format
+    
+    start = time.perf_counter()
+    messages = extractor._fetch_messages_batch(message_ids, 100, 4)
+    fetch_seconds = time.perf_counter() - start
+    
+    messages = [message for message in messages if message]
+    payload_bytes = sum(len(json.dumps(message)) for message in messages)
+    
+    start = time.perf_counter()
+    parsed = [extractor._parse_message(message) for message in messages]
+    decode_seconds = time.perf_counter() - start
+    
+    return {
+        'format': fetch_format,
+        'messages': len(messages),
+        'payload_kb': payload_bytes / 1024,
+        'fetch_seconds': fetch_seconds,
+        'decode_ms_per_email': decode_seconds * 1000 / max(len(messages), 1),
+        'empty_bodies': sum(1 for email in parsed if not email['body'])
+    }
+
+
+def main():
+    """
+    Esegue il confronto sugli ultimi N messaggi (default 200)
+    """
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    
+    extractor = GmailExtractor()
+    message_ids = [message['id'] for message in extractor.get_messages(max_results=count)]
+    
+    print("\n" + "="*80)
+    print(f"{'Formato':<8} {'Email':>6} {'Payload KB':>12} {'Download s':>11} {'Decode ms/email':>16} {'Body vuoti':>11}")
+    print("="*80)
+    
+    for fetch_format in ('full', 'raw'):
+        result = benchmark(extractor, message_ids, fetch_format)
+        print(f"{result['format']:<8} {result['messages']:>6} {result['payload_kb']:>12.1f} "
+              f"{result['fetch_seconds']:>11.2f} {result['decode_ms_per_email']:>16.3f} {result['empty_bodies']:>11}")
+    
+    extractor.print_quota_stats()
+
+
+if __name__ == '__main__':
+    main()
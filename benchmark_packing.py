@@ -0,0 +1,126 @@
+"""
+Confronta l'analisi con una email per richiesta e l'analisi impacchettata
+Misura richieste, token per email e tempo per email
+
+Senza OPENAI_BASE_URL usa il server locale mock_openai_server (nessun costo)
+"""
+
+import os
+import sys
+import time
+import random
+from dotenv import load_dotenv
+from email_analyzer import EmailAnalyzer, OPENAI_BASE_URL
+from database import EmailDatabase
+
+
+# Budget dei pacchetti confrontati (0 = una email per richiesta)
+PACK_BUDGETS = (0, 4000, 8000)
+
+SAMPLE_PRODUCTS = ('running shoes', 'protein powder', 'project management app', 'skincare kit', 'online course')
+SAMPLE_OFFERS = ('20% off', 'free shipping', '$50 credit', 'buy one get one', '')
+
+
+def sample_emails(count: int) -> list:
+    """
+    Email sintetiche brevi (newsletter e promozioni)
+    """
+    rng = random.Random(42)
+    emails = []
+    for i in range(count):
+        product = rng.choice(SAMPLE_PRODUCTS)
+        offer = rng.choice(SAMPLE_OFFERS)
+        emails.append({
+            'id': f'bench{i:05d}',
+            'from': f'Brand {i % 17} <news@brand{i % 17}.com>',
+            'subject': f'{offer or "New"}: our {product} {i}',
+            'body': (f"Hi there, discover our new {product}. {offer and 'Today only: ' + offer + '.'} "
+                     f"Thousands of customers already use it every day. Shop now at https://brand{i % 17}.com/{i}"),
+            'snippet': f'Discover our new {product}'
+        })
+    return emails
+
+
+def database_emails(db_path: str, count: int) -> list:
+    """
+    Email già salvate nel database, nel formato di GmailExtractor
+    """
+    return [
+        {
+            'id': email['email_id'],
+            'from': email['sender'],
+            'subject': email['subject'],
+            'body': email['email_body'] or '',
+            'snippet': email['snippet'] or ''
+        }
+        for email in EmailDatabase(db_path).get_all_emails(limit=count)
+    ]
+
+
+def benchmark(api_key: str, base_url: str, emails: list, pack_token_budget: int) -> dict:
+    """
+    Analizza le email con un budget di pacchetto e raccoglie le misure
+    
+    Args:
+        api_key: Chiave API
+        base_url: Endpoint compatibile OpenAI
+        emails: Email da analizzare
+        pack_token_budget: Budget dei pacchetti (0 = una email per richiesta)
+    
+    Returns:
+        Dizionario con le misure
+    """
+    analyzer = EmailAnalyzer(api_key, base_url=base_url, use_cache=False, use_near_duplicates=False,
+                             pack_token_budget=pack_token_budget)
+    
+    start = time.perf_counter()
+    results = analyzer.analyze_batch(emails, progress_callback=lambda done, total: None)
+    seconds = time.perf_counter() - start
+    
+    usage = analyzer.usage_totals
+    count = max(len(emails), 1)
+    return {
+        'budget': pack_token_budget,
+        'requests': usage['requests'],
+        'prompt_per_email': usage['prompt_tokens'] / count,
+        'completion_per_email': usage['completion_tokens'] / count,
+        'ms_per_email': seconds * 1000 / count,
+        'errors': sum(1 for result in results if 'error' in result)
+    }
+
+
+def main():
+    """
+    Uso: python benchmark_packing.py [numero_email] [emails.db]
+    """
+    load_dotenv()
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    emails = database_emails(sys.argv[2], count) if len(sys.argv) > 2 else sample_emails(count)
+    
+    server = None
+    base_url = OPENAI_BASE_URL
+    api_key = os.getenv('OPENAI_API_KEY', '')
+    if base_url is None:
+        from mock_openai_server import start_server
+        server = start_server()
+        base_url = f"http://127.0.0.1:{server.server_port}/v1"
+        api_key = 'sk-mock'
+        print(f"🧪 Server mock su {base_url}")
+    
+    print("\n" + "="*80)
+    print(f"{'Budget':<8} {'Email':>6} {'Richieste':>10} {'Prompt tok/email':>17} "
+          f"{'Output tok/email':>17} {'ms/email':>9} {'Errori':>7}")
+    print("="*80)
+    
+    for budget in PACK_BUDGETS:
+        result = benchmark(api_key, base_url, emails, budget)
+        label = str(budget) if budget else 'singola'
+        print(f"{label:<8} {len(emails):>6} {result['requests']:>10} {result['prompt_per_email']:>17.1f} "
+              f"{result['completion_per_email']:>17.1f} {result['ms_per_email']:>9.1f} {result['errors']:>7}")
+    
+    if server:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
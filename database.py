@@ -6,6 +6,7 @@ import sqlite3
 import json
 from typing import List, Dict, Optional
 from datetime import datetime
+from text_normalizer import email_body_text, normalize_body
 
 
 class EmailDatabase:
@@ -57,13 +58,45 @@ class EmailDatabase:
             )
         ''')
         
+        # Migrazione: colonne aggiunte dopo la creazione iniziale della tabella
+        self._add_missing_columns(cursor, 'emails', {
+            'account': 'TEXT',
+            'email_body_text': 'TEXT',
+            'analysis_version': 'TEXT',
+            'analysis_fields': 'TEXT',
+            'analysis_model': 'TEXT'
+        })
+        
         # Indici per query veloci
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_sender ON emails(sender)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_account ON emails(account)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_email_type ON emails(email_type)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_campaign_type ON emails(campaign_type)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_funnel_stage ON emails(funnel_stage)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_date ON emails(date)')
         
+        # Checkpoint di sincronizzazione incrementale (History API) per account
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sync_state (
+                account TEXT PRIMARY KEY,
+                history_id TEXT,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Checkpoint del backfill completo (riprende dall'ultima pagina processata)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS backfill_checkpoints (
+                job_key TEXT PRIMARY KEY,
+                page_token TEXT,
+                processed_count INTEGER DEFAULT 0,
+                last_message_id TEXT,
+                status TEXT DEFAULT 'running',
+                started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
         # Tabella per i prodotti dell'utente
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS my_products (
@@ -105,6 +138,21 @@ class EmailDatabase:
         conn.commit()
         conn.close()
     
+    def _add_missing_columns(self, cursor, table: str, columns: Dict[str, str]):
+        """
+        Aggiunge a una tabella esistente le colonne mancanti
+        
+        Args:
+            cursor: Cursore SQLite
+            table: Nome della tabella
+            columns: Dizionario nome colonna -> tipo SQL
+        """
+        cursor.execute(f'PRAGMA table_info({table})')
+        existing = {row[1] for row in cursor.fetchall()}
+        for name, sql_type in columns.items():
+            if name not in existing:
+                cursor.execute(f'ALTER TABLE {table} ADD COLUMN {name} {sql_type}')
+    
     def save_email(self, email: Dict) -> bool:
         """
         Salva un'email nel database
@@ -125,17 +173,19 @@ class EmailDatabase:
             
             cursor.execute('''
                 INSERT OR REPLACE INTO emails (
-                    email_id, thread_id, sender, subject, email_body, snippet,
+                    email_id, thread_id, sender, subject, email_body, email_body_text, snippet,
                     date, time_usa, notes, email_type, campaign_type,
                     pricing_extract, target_audience, product_mentioned,
-                    retention, funnel_stage, urls, labels, updated_at
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                    retention, funnel_stage, urls, labels, account,
+                    analysis_version, analysis_fields, analysis_model, updated_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
             ''', (
                 email.get('email_id', ''),
                 email.get('thread_id', ''),
                 email.get('sender', ''),
                 email.get('subject', ''),
                 email.get('email_body', ''),
+                email_body_text(email),
                 email.get('snippet', ''),
                 email.get('date', ''),
                 email.get('time_usa', ''),
@@ -148,7 +198,11 @@ class EmailDatabase:
                 email.get('retention', ''),
                 email.get('funnel_stage', ''),
                 urls_json,
-                labels_json
+                labels_json,
+                email.get('account', ''),
+                email.get('analysis_version'),
+                json.dumps(email['analysis_fields']) if email.get('analysis_fields') else None,
+                email.get('analysis_model')
             ))
             
             conn.commit()
@@ -175,6 +229,245 @@ class EmailDatabase:
                 saved_count += 1
         return saved_count
     
+    def update_email_bodies(self, bodies: Dict[str, str]) -> int:
+        """
+        Aggiorna il corpo delle email già salvate (es. dopo un nuovo parsing)
+        
+        Args:
+            bodies: Dizionario email_id -> nuovo corpo
+        
+        Returns:
+            Numero di email aggiornate
+        """
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            cursor.executemany('''
+                UPDATE emails SET email_body = ?, email_body_text = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE email_id = ?
+            ''', [(body, normalize_body(body), email_id) for email_id, body in bodies.items()])
+            updated = cursor.rowcount
+            conn.commit()
+            conn.close()
+            return updated
+        
+        except Exception as e:
+            print(f"Errore durante l'aggiornamento delle email: {e}")
+            return 0
+    
+    def get_stale_analyses(self, field_versions: Dict[str, int], fields: Optional[List[str]] = None,
+                           sender: Optional[str] = None, model: Optional[str] = None,
+                           limit: Optional[int] = None) -> List[Dict]:
+        """
+        Recupera le email la cui analisi ha campi di una versione diversa da quella corrente
+        
+        Args:
+            field_versions: Versione corrente di ogni campo
+            fields: Campi da considerare (default: tutti); se indicati esplicitamente,
+                restano in lista anche se già aggiornati
+            sender: Filtra per mittente (sottostringa)
+            model: Filtra per modello che ha prodotto l'analisi
+            limit: Numero massimo di email
+        
+        Returns:
+            Lista di email (dizionari con le colonne della tabella), con 'stale_fields'
+            = campi da rianalizzare
+        """
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        
+        conditions = []
+        params = []
+        if not fields:
+            # Analisi senza versione (precedenti o fallite) o con almeno un campo obsoleto
+            checks = ['analysis_fields IS NULL']
+            for field, version in field_versions.items():
+                checks.append(f"json_extract(analysis_fields, '$.{field}') IS NOT ?")
+                params.append(version)
+            conditions.append(f"({' OR '.join(checks)})")
+        if sender:
+            conditions.append('sender LIKE ?')
+            params.append(f'%{sender}%')
+        if model:
+            conditions.append('analysis_model = ?')
+            params.append(model)
+        
+        query = 'SELECT * FROM emails'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY date DESC'
+        if limit:
+            query += f' LIMIT {int(limit)}'
+        cursor.execute(query, params)
+        
+        emails = []
+        for row in cursor.fetchall():
+            email = dict(row)
+            stored = json.loads(email['analysis_fields']) if email['analysis_fields'] else {}
+            email['analysis_fields'] = stored
+            email['stale_fields'] = fields or [field for field, version in field_versions.items()
+                                               if stored.get(field) != version]
+            emails.append(email)
+        
+        conn.close()
+        return emails
+    
+    def update_analysis_fields(self, email_id: str, values: Dict[str, str], field_versions: Dict[str, int],
+                               analysis_version: str, model: str) -> bool:
+        """
+        Aggiorna solo alcuni campi dell'analisi di un'email e le loro versioni
+        
+        Args:
+            email_id: ID dell'email
+            values: Nuovi valori dei campi
+            field_versions: Versioni di tutti i campi dopo l'aggiornamento
+            analysis_version: Versione del prompt usato
+            model: Modello che ha prodotto i nuovi valori
+        
+        Returns:
+            True se aggiornata con successo
+        """
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            assignments = ', '.join(f'{field} = ?' for field in values)
+            cursor.execute(f'''
+                UPDATE emails SET {assignments}, analysis_fields = ?, analysis_version = ?,
+                    analysis_model = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE email_id = ?
+            ''', (*values.values(), json.dumps(field_versions), analysis_version, model, email_id))
+            updated = cursor.rowcount > 0
+            conn.commit()
+            conn.close()
+            return updated
+        
+        except Exception as e:
+            print(f"Errore durante l'aggiornamento dell'analisi: {e}")
+            return False
+    
+    def get_existing_email_ids(self, email_ids: Optional[List[str]] = None) -> set:
+        """
+        Recupera gli ID delle email già presenti nel database
+        
+        Args:
+            email_ids: Se specificata, controlla solo questi ID
+        
+        Returns:
+            Set di email_id presenti
+        """
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        existing = set()
+        if email_ids is None:
+            cursor.execute("SELECT email_id FROM emails WHERE email_id IS NOT NULL AND email_id != ''")
+            existing = {row[0] for row in cursor.fetchall()}
+        else:
+            # SQLite limita il numero di parametri per query
+            for start in range(0, len(email_ids), 500):
+                chunk = email_ids[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                cursor.execute(f'SELECT email_id FROM emails WHERE email_id IN ({placeholders})', chunk)
+                existing.update(row[0] for row in cursor.fetchall())
+        
+        conn.close()
+        return existing
+    
+    def get_history_id(self, account: str) -> Optional[str]:
+        """
+        Recupera l'ultimo historyId sincronizzato per un account
+        
+        Args:
+            account: Indirizzo email dell'account Gmail
+        
+        Returns:
+            historyId salvato o None se non esiste un checkpoint
+        """
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('SELECT history_id FROM sync_state WHERE account = ?', (account,))
+        row = cursor.fetchone()
+        conn.close()
+        return row[0] if row else None
+    
+    def save_history_id(self, account: str, history_id: str):
+        """
+        Salva il checkpoint historyId per un account
+        
+        Args:
+            account: Indirizzo email dell'account Gmail
+            history_id: historyId della mailbox
+        """
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT OR REPLACE INTO sync_state (account, history_id, updated_at)
+            VALUES (?, ?, CURRENT_TIMESTAMP)
+        ''', (account, str(history_id)))
+        conn.commit()
+        conn.close()
+    
+    def get_backfill_checkpoint(self, job_key: str) -> Optional[Dict]:
+        """
+        Recupera il checkpoint di un backfill
+        
+        Args:
+            job_key: Chiave del backfill (account + query)
+        
+        Returns:
+            Dizionario con page_token, processed_count, last_message_id e status,
+            None se il backfill non è mai stato avviato
+        """
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM backfill_checkpoints WHERE job_key = ?', (job_key,))
+        row = cursor.fetchone()
+        conn.close()
+        return dict(row) if row else None
+    
+    def save_backfill_checkpoint(self, job_key: str, page_token: Optional[str],
+                                 processed_count: int, last_message_id: str = '',
+                                 status: str = 'running'):
+        """
+        Salva il checkpoint di un backfill dopo ogni pagina processata
+        
+        Args:
+            job_key: Chiave del backfill (account + query)
+            page_token: Token della prossima pagina da processare
+            processed_count: Numero di messaggi processati finora
+            last_message_id: ID dell'ultimo messaggio processato
+            status: 'running' oppure 'completed'
+        """
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO backfill_checkpoints (job_key, page_token, processed_count, last_message_id, status)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(job_key) DO UPDATE SET
+                page_token = excluded.page_token,
+                processed_count = excluded.processed_count,
+                last_message_id = excluded.last_message_id,
+                status = excluded.status,
+                updated_at = CURRENT_TIMESTAMP
+        ''', (job_key, page_token, processed_count, last_message_id, status))
+        conn.commit()
+        conn.close()
+    
+    def delete_backfill_checkpoint(self, job_key: str):
+        """
+        Elimina il checkpoint di un backfill per ripartire dalla prima pagina
+        
+        Args:
+            job_key: Chiave del backfill (account + query)
+        """
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM backfill_checkpoints WHERE job_key = ?', (job_key,))
+        conn.commit()
+        conn.close()
+    
     def get_all_senders(self) -> List[Dict]:
         """
         Recupera tutti i sender unici con il conteggio delle email
@@ -315,6 +608,7 @@ class EmailDatabase:
         Args:
             query: Termine di ricerca
             field: Campo in cui cercare ('all', 'sender', 'subject', 'body')
+                (il corpo è cercato nel testo normalizzato, senza markup HTML)
         
         Returns:
             Lista di email che corrispondono
@@ -326,13 +620,14 @@ class EmailDatabase:
         if field == 'all':
             sql = '''
                 SELECT * FROM emails
-                WHERE sender LIKE ? OR subject LIKE ? OR email_body LIKE ? OR snippet LIKE ?
+                WHERE sender LIKE ? OR subject LIKE ? OR COALESCE(email_body_text, email_body) LIKE ? OR snippet LIKE ?
                 ORDER BY date DESC
             '''
             search_term = f'%{query}%'
             cursor.execute(sql, (search_term, search_term, search_term, search_term))
         else:
-            sql = f'SELECT * FROM emails WHERE {field} LIKE ? ORDER BY date DESC'
+            column = 'COALESCE(email_body_text, email_body)' if field in ('body', 'email_body') else field
+            sql = f'SELECT * FROM emails WHERE {column} LIKE ? ORDER BY date DESC'
             cursor.execute(sql, (f'%{query}%',))
         
         emails = []
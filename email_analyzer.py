@@ -2,11 +2,106 @@
 Modulo per analizzare email con OpenAI API
 """
 
+import os
 import json
 import re
-from typing import Dict, List, Optional
-from openai import OpenAI
+import time
+import asyncio
+from typing import Dict, List, Optional, Tuple
+from openai import AsyncOpenAI
 from datetime import datetime
+from rate_limiter import AsyncRateBudget
+from analysis_cache import AnalysisCache, ANALYSIS_CACHE_DB, content_key
+from near_duplicate_index import NearDuplicateIndex, NEAR_DUPLICATE_DB, STRUCTURAL_FIELDS
+from pre_classifier import PreClassifier, PRE_CLASSIFY, RULES_MODEL
+from text_normalizer import ANALYSIS_BODY_TOKENS, count_tokens, email_body_text, prompt_body
+from llm_ledger import LLMLedger, LLM_LEDGER_DB
+from llm_resilience import RetryPolicy, AnalysisRetryQueue, ANALYSIS_RETRY_DB
+from llm_backend import LLMBackend, create_backend, model_for, OPENAI_BASE_URL
+from dotenv import load_dotenv
+
+# Carica variabili d'ambiente
+load_dotenv()
+
+
+# Modello usato per l'analisi (LLM_MODEL_ANALYSIS)
+ANALYSIS_MODEL = model_for('analysis')
+
+# Versione del prompt di analisi: va incrementata a ogni modifica di SYSTEM_PROMPT
+# o di _create_analysis_prompt, così la cache non restituisce analisi obsolete
+PROMPT_VERSION = '2'
+
+SYSTEM_PROMPT = "You are an expert email marketing analyst. Analyze emails and extract structured information in JSON format. Be precise and consistent with your categorization."
+
+# Campi JSON di ogni analisi, con le istruzioni per il modello
+ANALYSIS_FIELD_DESCRIPTIONS = {
+    'notes': "Brief summary or key insights about the email (1-2 sentences)",
+    'email_type': "One of: marketing, transactional, promotion, personal, recruiting, product education, onboarding, retention",
+    'campaign_type': "One of: marketing, promo, seasonal, abandoned checkout, win-back, recruitment, retention, transactional, personal, product education, onboarding, or more specific",
+    'pricing_extract': "Any pricing info, discounts, or offers mentioned (e.g., '20% off', '$50 credit', 'Free shipping'). Leave empty if none.",
+    'target_audience': "Who is this email targeting? (e.g., 'prospective customers', 'existing subscribers', 'cart abandoners', 'women 25-45 interested in weight loss')",
+    'product_mentioned': "Main product or service mentioned in the email. Be specific.",
+    'retention': "Is this a retention/re-engagement email? Leave empty if no, or describe the retention strategy",
+    'funnel_stage': "One of: awareness, consideration, conversion, onboarding, retention"
+}
+
+ANALYSIS_FIELDS = tuple(ANALYSIS_FIELD_DESCRIPTIONS)
+
+# Versione di ogni campo, salvata con l'analisi: va incrementata (insieme a PROMPT_VERSION)
+# quando cambiano la descrizione o le categorie del campo, così reanalyze.py
+# richiede al modello solo i campi cambiati
+FIELD_VERSIONS = {
+    'notes': 1,
+    'email_type': 1,
+    'campaign_type': 1,
+    'pricing_extract': 1,
+    'target_audience': 1,
+    'product_mentioned': 1,
+    'retention': 1,
+    'funnel_stage': 1
+}
+
+
+def field_spec(fields) -> str:
+    """
+    Righe dello schema JSON richiesto al modello per i campi indicati
+    """
+    return ',\n'.join(f'  "{field}": "{ANALYSIS_FIELD_DESCRIPTIONS[field]}"' for field in fields)
+
+
+ANALYSIS_FIELD_SPEC = field_spec(ANALYSIS_FIELDS)
+
+# Campi richiesti al modello per una variante di un template già classificato
+SPECIFIC_FIELDS = tuple(field for field in ANALYSIS_FIELDS if field not in STRUCTURAL_FIELDS)
+
+# Analisi impacchettata: più email brevi in una sola richiesta entro un budget di token
+# (prompt + risposte stimate, 0 = disattivata)
+PACK_TOKEN_BUDGET = int(os.getenv('OPENAI_PACK_TOKEN_BUDGET', 0))
+PACK_MAX_EMAILS = int(os.getenv('OPENAI_PACK_MAX_EMAILS', 20))
+
+# Email con un corpo (testo normalizzato) più lungo vengono sempre analizzate con una richiesta dedicata
+PACK_MAX_BODY_TOKENS = 400
+
+# Richieste OpenAI contemporanee durante l'analisi di un batch
+ANALYSIS_CONCURRENCY = int(os.getenv('OPENAI_ANALYSIS_CONCURRENCY', 16))
+
+# Budget dell'account OpenAI per il modello (richieste e token al minuto)
+OPENAI_RPM_LIMIT = float(os.getenv('OPENAI_RPM_LIMIT', 500))
+OPENAI_TPM_LIMIT = float(os.getenv('OPENAI_TPM_LIMIT', 200000))
+
+# Token stimati per la risposta JSON (usati per prenotare il budget TPM)
+ESTIMATED_COMPLETION_TOKENS = 300
+
+# Batch API: cartella dei file JSONL, intervallo di polling e richieste massime per batch
+BATCH_DIR = os.getenv('OPENAI_BATCH_DIR', 'batch_jobs')
+BATCH_POLL_SECONDS = float(os.getenv('OPENAI_BATCH_POLL_SECONDS', 60))
+BATCH_MAX_REQUESTS = 50000
+
+# Stati finali di un batch
+BATCH_FINAL_STATUSES = ('completed', 'failed', 'expired', 'cancelled')
+
+# Suffisso dei file con ID ed email dei batch inviati e non ancora raccolti
+BATCH_PENDING_SUFFIX = '.pending.json'
 
 
 class EmailAnalyzer:
@@ -14,14 +109,65 @@ class EmailAnalyzer:
     Analizza email usando OpenAI per estrarre informazioni strutturate
     """
     
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, max_concurrency: int = ANALYSIS_CONCURRENCY,
+                 requests_per_minute: float = OPENAI_RPM_LIMIT, tokens_per_minute: float = OPENAI_TPM_LIMIT,
+                 base_url: Optional[str] = OPENAI_BASE_URL, cache: Optional[AnalysisCache] = None,
+                 use_cache: bool = True, near_duplicates: Optional[NearDuplicateIndex] = None,
+                 use_near_duplicates: bool = True, pack_token_budget: int = PACK_TOKEN_BUDGET,
+                 pre_classifier: Optional[PreClassifier] = None, use_pre_classifier: bool = PRE_CLASSIFY,
+                 ledger: Optional[LLMLedger] = None, use_ledger: bool = True,
+                 retry_policy: Optional[RetryPolicy] = None, retry_queue: Optional[AnalysisRetryQueue] = None,
+                 use_retry_queue: bool = True, backend: Optional[LLMBackend] = None):
         """
         Inizializza l'analizzatore email
         
         Args:
-            api_key: Chiave API di OpenAI
+            api_key: Chiave API di OpenAI (ignorata dal backend mock)
+            max_concurrency: Richieste contemporanee durante analyze_batch
+            requests_per_minute: Richieste al minuto consentite (RPM)
+            tokens_per_minute: Token al minuto consentiti (TPM)
+            base_url: Endpoint compatibile OpenAI (default: API OpenAI)
+            cache: Cache delle analisi (default: ANALYSIS_CACHE_DB)
+            use_cache: False per analizzare sempre con il modello
+            near_duplicates: Indice MinHash delle email analizzate (default: NEAR_DUPLICATE_DB)
+            use_near_duplicates: False per non riutilizzare i campi strutturali di email simili
+            pack_token_budget: Token massimi di una richiesta con più email brevi (0 = una email per richiesta)
+            pre_classifier: Regole per ricevute, reset password, inviti e posta personale
+            use_pre_classifier: False per inviare al modello anche i casi riconoscibili con le regole
+            ledger: Registro di token, costo e latenza delle chiamate (default: LLM_LEDGER_DB)
+            use_ledger: False per non registrare le chiamate
+            retry_policy: Retry con backoff e circuit breaker delle chiamate (default: RetryPolicy())
+            retry_queue: Coda delle analisi fallite (default: ANALYSIS_RETRY_DB)
+            use_retry_queue: False per non accodare le analisi fallite
+            backend: Backend dei modelli, con il suo ledger e la sua retry_policy
+                (default: LLM_BACKEND con ledger e retry_policy)
         """
-        self.client = OpenAI(api_key=api_key)
+        self.backend = backend
+        if self.backend is None:
+            if ledger is None and use_ledger and LLM_LEDGER_DB:
+                ledger = LLMLedger(LLM_LEDGER_DB)
+            self.backend = create_backend(api_key, base_url=base_url, ledger=ledger, retry_policy=retry_policy)
+        self.ledger = self.backend.ledger
+        self.retry_policy = self.backend.retry_policy
+        # Client sincrono per la Batch API (files e batches)
+        self.client = self.backend.client
+        self.retry_queue = retry_queue
+        if self.retry_queue is None and use_retry_queue and ANALYSIS_RETRY_DB:
+            self.retry_queue = AnalysisRetryQueue(ANALYSIS_RETRY_DB)
+        self.max_concurrency = max_concurrency
+        self.budget = AsyncRateBudget(requests_per_minute, tokens_per_minute)
+        self.cache = cache
+        if self.cache is None and use_cache and ANALYSIS_CACHE_DB:
+            self.cache = AnalysisCache(ANALYSIS_CACHE_DB)
+        self.pack_token_budget = pack_token_budget
+        self.pre_classifier = pre_classifier
+        if self.pre_classifier is None and use_pre_classifier:
+            self.pre_classifier = PreClassifier()
+        # Richieste e token consumati da questa istanza
+        self.usage_totals = {'requests': 0, 'prompt_tokens': 0, 'completion_tokens': 0}
+        self.near_duplicates = near_duplicates
+        if self.near_duplicates is None and use_near_duplicates and NEAR_DUPLICATE_DB:
+            self.near_duplicates = NearDuplicateIndex(NEAR_DUPLICATE_DB)
     
     def extract_urls(self, email_body: str) -> List[str]:
         """
@@ -49,80 +195,304 @@ class EmailAnalyzer:
             Dizionario con i dati analizzati
         """
         try:
-            # Estrai URL dal body
-            urls = self.extract_urls(email.get('body', ''))
-            
-            # Prepara il prompt per OpenAI
-            prompt = self._create_analysis_prompt(email)
-            
-            # Chiama OpenAI API
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are an expert email marketing analyst. Analyze emails and extract structured information in JSON format. Be precise and consistent with your categorization."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                temperature=0.3,
-                response_format={"type": "json_object"}
-            )
-            
-            # Parse la risposta
-            analysis = json.loads(response.choices[0].message.content)
+            # Casi certi (regole) ed email già analizzate con lo stesso contenuto non richiedono una chiamata
+            analysis = self._known_analysis(email)
+            if analysis is None:
+                # Varianti dello stesso template riusano la classificazione già fatta
+                signature, structural = self._find_near_duplicate(email)
+                
+                # Chiama OpenAI API
+                response = self._create_completion(self._completion_params(email, structural), 'analysis', email)
+                self._count_usage(response)
+                
+                # Parse la risposta
+                analysis = self._merge_structural(json.loads(response.choices[0].message.content), structural)
+                self._store_analysis(email, analysis)
+                self._index_analysis(email, analysis, signature)
             
             # Combina i dati originali con l'analisi
-            result = {
-                'sender': email.get('from', ''),
-                'subject': email.get('subject', ''),
-                'email_body': email.get('body', ''),
-                'snippet': email.get('snippet', ''),
-                'date': email.get('date', ''),
-                'time_usa': self._extract_time_usa(email.get('date', '')),
-                'notes': analysis.get('notes', ''),
-                'email_type': analysis.get('email_type', ''),
-                'campaign_type': analysis.get('campaign_type', ''),
-                'pricing_extract': analysis.get('pricing_extract', ''),
-                'target_audience': analysis.get('target_audience', ''),
-                'product_mentioned': analysis.get('product_mentioned', ''),
-                'retention': analysis.get('retention', ''),
-                'funnel_stage': analysis.get('funnel_stage', ''),
-                'urls': urls,
-                'labels': email.get('labels', []),
-                'thread_id': email.get('thread_id', ''),
-                'email_id': email.get('id', '')
-            }
-            
-            return result
+            return self._build_result(email, analysis)
         
         except Exception as e:
             print(f"Errore durante l'analisi dell'email: {e}")
             # Ritorna dati base senza analisi
-            return {
-                'sender': email.get('from', ''),
-                'subject': email.get('subject', ''),
-                'email_body': email.get('body', ''),
-                'snippet': email.get('snippet', ''),
-                'date': email.get('date', ''),
-                'time_usa': self._extract_time_usa(email.get('date', '')),
-                'notes': '',
-                'email_type': 'unknown',
-                'campaign_type': 'unknown',
-                'pricing_extract': '',
-                'target_audience': '',
-                'product_mentioned': '',
-                'retention': '',
-                'funnel_stage': '',
-                'urls': self.extract_urls(email.get('body', '')),
-                'labels': email.get('labels', []),
-                'thread_id': email.get('thread_id', ''),
-                'email_id': email.get('id', ''),
-                'error': str(e)
-            }
+            return self._build_error_result(email, e)
+    
+    async def analyze_email_async(self, client: AsyncOpenAI, email: Dict) -> Dict:
+        """
+        Analizza un'email con il client asincrono, rispettando il budget RPM/TPM
+        
+        Args:
+            client: Client AsyncOpenAI
+            email: Dizionario con i dati dell'email
+        
+        Returns:
+            Dizionario con i dati analizzati
+        """
+        try:
+            analysis = self._known_analysis(email)
+            if analysis is None:
+                signature, structural = self._find_near_duplicate(email)
+                params = self._completion_params(email, structural)
+                estimated_tokens = self._estimate_tokens(params)
+                queued_since = time.perf_counter()
+                await self.budget.acquire(estimated_tokens)
+                
+                response = await self._acreate_completion(client, params, 'analysis', email,
+                                                          queued=time.perf_counter() - queued_since)
+                self._count_usage(response)
+                if response.usage:
+                    self.budget.record_usage(estimated_tokens, response.usage.total_tokens)
+                
+                analysis = self._merge_structural(json.loads(response.choices[0].message.content), structural)
+                self._store_analysis(email, analysis)
+                self._index_analysis(email, analysis, signature)
+            return self._build_result(email, analysis)
+        
+        except Exception as e:
+            print(f"Errore durante l'analisi dell'email: {e}")
+            return self._build_error_result(email, e)
+    
+    def _pre_classified(self, email: Dict) -> Optional[Dict]:
+        """
+        Analisi ottenuta con le regole deterministiche (None se il caso è ambiguo)
+        """
+        if self.pre_classifier is None:
+            return None
+        analysis = self.pre_classifier.classify(email)
+        if analysis is not None:
+            analysis['analysis_model'] = RULES_MODEL
+        return analysis
+    
+    def _known_analysis(self, email: Dict) -> Optional[Dict]:
+        """
+        Analisi disponibile senza chiamare il modello: regole, poi cache
+        """
+        analysis = self._pre_classified(email)
+        if analysis is None:
+            analysis = self._cached_analysis(email)
+        return analysis
+    
+    def _pre_classifier_counter(self) -> int:
+        """
+        Chiamate risparmiate dalla pre-classificazione (totale dell'esecuzione)
+        """
+        return self.pre_classifier.saved_calls if self.pre_classifier is not None else 0
+    
+    def _print_pre_classifier_summary(self, saved: int):
+        """
+        Mostra quante chiamate al modello ha evitato la pre-classificazione
+        """
+        if self.pre_classifier is not None and saved:
+            rules = ', '.join(f"{rule} {count}" for rule, count in self.pre_classifier.rule_counts.most_common())
+            print(f"🧮 Pre-classificazione: {saved} chiamate risparmiate (totale per regola: {rules})")
+    
+    def _cache_key(self, email: Dict) -> Optional[str]:
+        """
+        Chiave di cache dell'email (None se la cache è disattivata)
+        """
+        if self.cache is None:
+            return None
+        return content_key(email, ANALYSIS_MODEL, PROMPT_VERSION)
+    
+    def _cached_analysis(self, email: Dict) -> Optional[Dict]:
+        """
+        Analisi già calcolata per un'email con lo stesso contenuto
+        """
+        if self.cache is None:
+            return None
+        return self.cache.get(self._cache_key(email))
+    
+    def _store_analysis(self, email: Dict, analysis: Dict):
+        """
+        Salva in cache l'analisi restituita dal modello
+        """
+        if self.cache is not None:
+            self.cache.put(self._cache_key(email), analysis, ANALYSIS_MODEL, PROMPT_VERSION)
+    
+    def _find_near_duplicate(self, email: Dict) -> Tuple[Optional[List[int]], Optional[Dict]]:
+        """
+        Cerca nell'indice MinHash un'email già analizzata dello stesso template
+        
+        Args:
+            email: Dizionario con i dati dell'email
+        
+        Returns:
+            Tuple (firma MinHash, campi strutturali del vicino più simile o None)
+        """
+        if self.near_duplicates is None:
+            return None, None
+        signature = self.near_duplicates.signature(email_body_text(email))
+        if signature is None:
+            return None, None
+        match = self.near_duplicates.query(signature)
+        if match is None or not all(match[2].get(field) for field in STRUCTURAL_FIELDS):
+            return signature, None
+        return signature, match[2]
+    
+    @staticmethod
+    def _merge_structural(analysis: Dict, structural: Optional[Dict]) -> Dict:
+        """
+        Completa l'analisi parziale con i campi strutturali del vicino
+        """
+        if structural is None:
+            return analysis
+        return {**analysis, **structural}
+    
+    def _index_analysis(self, email: Dict, analysis: Dict, signature: Optional[List[int]] = None):
+        """
+        Aggiunge l'email analizzata all'indice MinHash
+        """
+        if self.near_duplicates is None:
+            return
+        if signature is None:
+            signature = self.near_duplicates.signature(email_body_text(email))
+        if signature is not None and email.get('id'):
+            self.near_duplicates.add(email['id'], signature, analysis)
+    
+    def _near_duplicate_matches(self) -> int:
+        """
+        Email che hanno riutilizzato la classificazione di un vicino (totale dell'esecuzione)
+        """
+        return self.near_duplicates.matches if self.near_duplicates is not None else 0
+    
+    def _cache_counters(self) -> Tuple[int, int]:
+        """
+        Hit e lookup totali della cache (per calcolare l'hit rate di un batch)
+        """
+        if self.cache is None:
+            return 0, 0
+        return self.cache.hits, self.cache.hits + self.cache.misses
+    
+    def _print_cache_summary(self, hits: int, lookups: int):
+        """
+        Mostra l'hit rate della cache per il batch appena analizzato
+        """
+        if self.cache is not None and lookups:
+            print(f"♻️  Cache analisi: {hits}/{lookups} hit ({hits / lookups * 100:.1f}%), "
+                  f"{lookups - hits} chiamate al modello")
+    
+    def _completion_params(self, email: Dict, structural: Optional[Dict] = None) -> Dict:
+        """
+        Parametri della chiamata chat.completions per un'email
+        
+        Args:
+            email: Dizionario con i dati dell'email
+            structural: Campi strutturali già noti (il modello estrae solo quelli specifici)
+        """
+        prompt = (self._create_specific_prompt(email, structural) if structural
+                  else self._create_analysis_prompt(email))
+        return {
+            'model': ANALYSIS_MODEL,
+            'messages': [
+                {
+                    "role": "system",
+                    "content": SYSTEM_PROMPT
+                },
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ],
+            'temperature': 0.3,
+            'response_format': {"type": "json_object"}
+        }
+    
+    def _create_completion(self, params: Dict, task: str, email: Optional[Dict] = None):
+        """
+        Chiamata chat.completions sincrona tramite il backend (retry e ledger)
+        """
+        return self.backend.complete(params, task, email)
+    
+    async def _acreate_completion(self, client: AsyncOpenAI, params: Dict, task: str, email: Optional[Dict] = None,
+                                  emails_count: int = 1, queued: float = 0.0, emails: Optional[List[Dict]] = None):
+        """
+        Chiamata chat.completions asincrona tramite il backend (retry e ledger)
+        
+        Args:
+            queued: Secondi attesi per il budget RPM/TPM (distingue i nostri limiti da quelli di OpenAI)
+            emails: Email di una richiesta impacchettata
+        """
+        return await self.backend.acomplete(client, params, task, email, emails_count, queued, emails)
+    
+    def _count_usage(self, response):
+        """
+        Aggiorna usage_totals con i token riportati da una risposta
+        """
+        self.usage_totals['requests'] += 1
+        if response.usage:
+            self.usage_totals['prompt_tokens'] += response.usage.prompt_tokens
+            self.usage_totals['completion_tokens'] += response.usage.completion_tokens
+    
+    @staticmethod
+    def _estimate_tokens(params: Dict) -> int:
+        """
+        Stima i token di una richiesta (circa 4 caratteri per token) più la risposta
+        """
+        prompt_chars = sum(len(message['content']) for message in params['messages'])
+        return prompt_chars // 4 + ESTIMATED_COMPLETION_TOKENS
+    
+    def _build_result(self, email: Dict, analysis: Dict) -> Dict:
+        """
+        Combina i dati originali dell'email con l'analisi del modello
+        
+        Args:
+            email: Dizionario con i dati dell'email
+            analysis: Campi JSON restituiti dal modello (analysis_model se non è ANALYSIS_MODEL)
+        
+        Returns:
+            Dizionario con i dati analizzati, con versione dello schema e modello dell'analisi
+        """
+        return {
+            'sender': email.get('from', ''),
+            'subject': email.get('subject', ''),
+            'email_body': email.get('body', ''),
+            'email_body_text': email_body_text(email),
+            'snippet': email.get('snippet', ''),
+            'date': email.get('date', ''),
+            'time_usa': self._extract_time_usa(email.get('date', '')),
+            'notes': analysis.get('notes', ''),
+            'email_type': analysis.get('email_type', ''),
+            'campaign_type': analysis.get('campaign_type', ''),
+            'pricing_extract': analysis.get('pricing_extract', ''),
+            'target_audience': analysis.get('target_audience', ''),
+            'product_mentioned': analysis.get('product_mentioned', ''),
+            'retention': analysis.get('retention', ''),
+            'funnel_stage': analysis.get('funnel_stage', ''),
+            'urls': self.extract_urls(email.get('body', '')),
+            'labels': email.get('labels', []),
+            'thread_id': email.get('thread_id', ''),
+            'email_id': email.get('id', ''),
+            'account': email.get('account', ''),
+            'analysis_version': PROMPT_VERSION,
+            'analysis_fields': dict(FIELD_VERSIONS),
+            'analysis_model': analysis.get('analysis_model', ANALYSIS_MODEL)
+        }
+    
+    def _build_error_result(self, email: Dict, error: Exception) -> Dict:
+        """
+        Dati base dell'email quando l'analisi non è riuscita
+        
+        Args:
+            email: Dizionario con i dati dell'email
+            error: Errore dell'analisi
+        
+        Returns:
+            Dizionario con i campi dell'analisi vuoti e il messaggio di errore
+        """
+        # L'email resta salvata come 'unknown' finché un nuovo tentativo dalla coda non riesce
+        if self.retry_queue is not None:
+            self.retry_queue.enqueue(email, str(error))
+        result = self._build_result(email, {
+            'email_type': 'unknown',
+            'campaign_type': 'unknown'
+        })
+        result['error'] = str(error)
+        # Nessuna versione: reanalyze.py considera tutti i campi da rianalizzare
+        result['analysis_version'] = None
+        result['analysis_fields'] = None
+        result['analysis_model'] = None
+        return result
     
     def _create_analysis_prompt(self, email: Dict) -> str:
         """
@@ -130,11 +500,10 @@ class EmailAnalyzer:
         """
         sender = email.get('from', '')
         subject = email.get('subject', '')
-        body = email.get('body', '')
         snippet = email.get('snippet', '')
         
-        # Limita il body a 4000 caratteri per non superare i token
-        body_preview = body[:4000] if len(body) > 4000 else body
+        # Testo visibile dell'email (senza markup e URL di tracking), limitato in token
+        body_preview = prompt_body(email, ANALYSIS_BODY_TOKENS, ANALYSIS_MODEL)
         
         prompt = f"""Analyze this email and extract the following information in JSON format:
 
@@ -147,14 +516,7 @@ Snippet: {snippet}
 Please provide a JSON response with these fields:
 
 {{
-  "notes": "Brief summary or key insights about the email (1-2 sentences)",
-  "email_type": "One of: marketing, transactional, promotion, personal, recruiting, product education, onboarding, retention",
-  "campaign_type": "One of: marketing, promo, seasonal, abandoned checkout, win-back, recruitment, retention, transactional, personal, product education, onboarding, or more specific",
-  "pricing_extract": "Any pricing info, discounts, or offers mentioned (e.g., '20% off', '$50 credit', 'Free shipping'). Leave empty if none.",
-  "target_audience": "Who is this email targeting? (e.g., 'prospective customers', 'existing subscribers', 'cart abandoners', 'women 25-45 interested in weight loss')",
-  "product_mentioned": "Main product or service mentioned in the email. Be specific.",
-  "retention": "Is this a retention/re-engagement email? Leave empty if no, or describe the retention strategy",
-  "funnel_stage": "One of: awareness, consideration, conversion, onboarding, retention"
+{ANALYSIS_FIELD_SPEC}
 }}
 
 IMPORTANT GUIDELINES:
@@ -164,6 +526,36 @@ IMPORTANT GUIDELINES:
 - Identify the primary funnel stage
 - For email_type and campaign_type, stick to the provided options when possible
 - Return valid JSON only
+"""
+        return prompt
+    
+    def _create_specific_prompt(self, email: Dict, structural: Dict) -> str:
+        """
+        Crea il prompt ridotto per una variante di un template già classificato
+        
+        Args:
+            email: Dizionario con i dati dell'email
+            structural: email_type, campaign_type, funnel_stage e target_audience del template
+        """
+        body_preview = prompt_body(email, ANALYSIS_BODY_TOKENS, ANALYSIS_MODEL)
+        known = '\n'.join(f"{field}: {structural.get(field, '')}" for field in STRUCTURAL_FIELDS)
+        
+        prompt = f"""This email is a variant of an already classified template:
+{known}
+
+EMAIL DATA:
+Sender: {email.get('from', '')}
+Subject: {email.get('subject', '')}
+Body Preview: {body_preview}
+Snippet: {email.get('snippet', '')}
+
+Extract only the fields specific to this email, as JSON:
+
+{{
+{field_spec(SPECIFIC_FIELDS)}
+}}
+
+Return valid JSON only.
 """
         return prompt
     
@@ -196,14 +588,474 @@ IMPORTANT GUIDELINES:
     
     def analyze_batch(self, emails: List[Dict], progress_callback=None) -> List[Dict]:
         """
-        Analizza un batch di email
+        Analizza un batch di email con richieste concorrenti
+        
+        Args:
+            emails: Lista di email da analizzare
+            progress_callback: Funzione callback per il progresso (opzionale)
+        
+        Returns:
+            Lista di email analizzate, nello stesso ordine di emails
+        """
+        cache_counters = self._cache_counters()
+        near_duplicate_matches = self._near_duplicate_matches()
+        pre_classified = self._pre_classifier_counter()
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            analyzed_emails = asyncio.run(self.analyze_batch_async(emails, progress_callback))
+        else:
+            # Dentro un event loop già attivo asyncio.run non è utilizzabile
+            analyzed_emails = self._analyze_sequential(emails, progress_callback)
+        
+        print(f"\n✅ Analizzate {len(analyzed_emails)} email!")
+        self._print_pre_classifier_summary(self._pre_classifier_counter() - pre_classified)
+        hits, lookups = self._cache_counters()
+        self._print_cache_summary(hits - cache_counters[0], lookups - cache_counters[1])
+        reused = self._near_duplicate_matches() - near_duplicate_matches
+        if reused:
+            print(f"🧬 Near-duplicate: {reused} email con classificazione riutilizzata (prompt ridotto)")
+        failed = sum(1 for analyzed in analyzed_emails if 'error' in analyzed)
+        if failed and self.retry_queue is not None:
+            print(f"🔁 {failed} analisi fallite accodate per un nuovo tentativo")
+        return analyzed_emails
+    
+    def retry_failed_analyses(self, limit: int = 100) -> List[Dict]:
+        """
+        Rianalizza le email della coda dei retry il cui tentativo è scaduto
+        
+        Le email che falliscono di nuovo restano in coda con un'attesa più lunga;
+        nessun tentativo parte mentre il circuit breaker è aperto.
+        
+        Args:
+            limit: Numero massimo di email da rianalizzare
+        
+        Returns:
+            Email analizzate con successo, da salvare al posto dei risultati 'unknown'
+        """
+        if self.retry_queue is None:
+            return []
+        if self.retry_policy.breaker.is_open:
+            print(f"⏸️  OpenAI degradato: coda dei retry in pausa per {self.retry_policy.breaker.remaining():.0f}s")
+            return []
+        
+        emails = self.retry_queue.due(limit)
+        if not emails:
+            return []
+        
+        print(f"\n🔁 Nuovo tentativo di analisi per {len(emails)} email fallite...")
+        recovered = [analyzed for analyzed in self.analyze_batch(emails) if 'error' not in analyzed]
+        self.retry_queue.remove([analyzed['email_id'] for analyzed in recovered])
+        print(f"✅ Recuperate {len(recovered)}/{len(emails)} analisi")
+        return recovered
+    
+    async def analyze_batch_async(self, emails: List[Dict], progress_callback=None) -> List[Dict]:
+        """
+        Analizza un batch di email con al massimo max_concurrency richieste in corso
         
         Args:
             emails: Lista di email da analizzare
+            progress_callback: Funzione callback per il progresso (opzionale),
+                chiamata con (email completate, totale)
+        
+        Returns:
+            Lista di email analizzate, nello stesso ordine di emails
+        """
+        total = len(emails)
+        completed = 0
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        # Email identiche nello stesso batch attendono la prima e la trovano in cache
+        in_progress: Dict[str, asyncio.Event] = {}
+        
+        def report():
+            nonlocal completed
+            completed += 1
+            if progress_callback:
+                progress_callback(completed, total)
+            else:
+                print(f"Analisi email {completed}/{total}...", end='\r')
+        
+        async with self.backend.async_session() as client:
+            results: List[Optional[Dict]] = [None] * total
+            if self.pack_token_budget > 0:
+                await self._analyze_packed_async(client, emails, results, semaphore, report)
+            
+            async def analyze(email: Dict) -> Dict:
+                cache_key = self._cache_key(email)
+                done = None
+                if cache_key in in_progress:
+                    await in_progress[cache_key].wait()
+                elif cache_key is not None:
+                    done = in_progress[cache_key] = asyncio.Event()
+                
+                async with semaphore:
+                    analyzed = await self.analyze_email_async(client, email)
+                if done is not None:
+                    done.set()
+                report()
+                return analyzed
+            
+            # Email escluse dai pacchetti o non validate nella risposta: una richiesta ciascuna
+            remaining = [idx for idx, result in enumerate(results) if result is None]
+            for idx, analyzed in zip(remaining, await asyncio.gather(*(analyze(emails[idx]) for idx in remaining))):
+                results[idx] = analyzed
+            return results
+    
+    def reanalyze_fields(self, emails: List[Dict], progress_callback=None) -> List[Optional[Dict]]:
+        """
+        Rianalizza solo alcuni campi di email già analizzate, con richieste concorrenti
+        
+        Args:
+            emails: Email nel formato di GmailExtractor, ciascuna con 'stale_fields'
+                (campi da rianalizzare) e 'analysis' (valori correnti di tutti i campi)
             progress_callback: Funzione callback per il progresso (opzionale)
         
         Returns:
-            Lista di email analizzate
+            Per ogni email i nuovi valori dei campi e analysis_model (None se la rianalisi è fallita)
+        """
+        return asyncio.run(self.reanalyze_fields_async(emails, progress_callback))
+    
+    async def reanalyze_fields_async(self, emails: List[Dict], progress_callback=None) -> List[Optional[Dict]]:
+        """
+        Come reanalyze_fields(), con al massimo max_concurrency richieste in corso
+        """
+        total = len(emails)
+        completed = 0
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        
+        async with self.backend.async_session() as client:
+            async def reanalyze(email: Dict) -> Optional[Dict]:
+                nonlocal completed
+                async with semaphore:
+                    values = await self._reanalyze_email_async(client, email)
+                completed += 1
+                if progress_callback:
+                    progress_callback(completed, total)
+                else:
+                    print(f"Rianalisi email {completed}/{total}...", end='\r')
+                return values
+            
+            return await asyncio.gather(*(reanalyze(email) for email in emails))
+    
+    async def _reanalyze_email_async(self, client: AsyncOpenAI, email: Dict) -> Optional[Dict]:
+        """
+        Nuovi valori dei campi obsoleti di un'email (regole, poi modello)
+        
+        Aggiorna anche la cache e, se cambiano campi strutturali, l'indice near-duplicate.
+        """
+        fields = email['stale_fields']
+        try:
+            analysis = self._pre_classified(email)
+            if analysis is not None:
+                return {**{field: analysis.get(field, '') for field in fields}, 'analysis_model': RULES_MODEL}
+            
+            params = self._fields_completion_params(email, fields)
+            estimated_tokens = self._estimate_tokens(params)
+            queued_since = time.perf_counter()
+            await self.budget.acquire(estimated_tokens)
+            
+            response = await self._acreate_completion(client, params, 'reanalysis', email,
+                                                      queued=time.perf_counter() - queued_since)
+            self._count_usage(response)
+            if response.usage:
+                self.budget.record_usage(estimated_tokens, response.usage.total_tokens)
+            
+            content = json.loads(response.choices[0].message.content)
+            missing = [field for field in fields if not isinstance(content.get(field), str)]
+            if missing:
+                raise ValueError(f"campi mancanti nella risposta: {', '.join(missing)}")
+            values = {field: content[field] for field in fields}
+            
+            # Con tutti i campi aggiornati l'analisi completa vale per la versione corrente del prompt
+            merged = {field: (email.get('analysis') or {}).get(field, '') for field in ANALYSIS_FIELDS}
+            merged.update(values)
+            self._store_analysis(email, merged)
+            if set(fields) & set(STRUCTURAL_FIELDS):
+                self._index_analysis(email, merged)
+            return {**values, 'analysis_model': ANALYSIS_MODEL}
+        
+        except Exception as e:
+            print(f"Errore durante la rianalisi dell'email {email.get('id', '')}: {e}")
+            return None
+    
+    def _fields_completion_params(self, email: Dict, fields: List[str]) -> Dict:
+        """
+        Parametri della chiamata chat.completions per rianalizzare alcuni campi di un'email
+        """
+        return {
+            'model': ANALYSIS_MODEL,
+            'messages': [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": self._create_fields_prompt(email, fields)}
+            ],
+            'temperature': 0.3,
+            'response_format': {"type": "json_object"}
+        }
+    
+    def _create_fields_prompt(self, email: Dict, fields: List[str]) -> str:
+        """
+        Crea il prompt che richiede solo i campi indicati
+        
+        Args:
+            email: Dizionario con i dati dell'email e l'analisi corrente ('analysis')
+            fields: Campi da rianalizzare
+        """
+        body_preview = prompt_body(email, ANALYSIS_BODY_TOKENS, ANALYSIS_MODEL)
+        current = email.get('analysis') or {}
+        known = '\n'.join(f"{field}: {current[field]}" for field in ANALYSIS_FIELDS
+                          if field not in fields and current.get(field))
+        context = f"Fields already classified for this email:\n{known}\n\n" if known else ''
+        
+        prompt = f"""{context}EMAIL DATA:
+Sender: {email.get('from', '')}
+Subject: {email.get('subject', '')}
+Body Preview: {body_preview}
+Snippet: {email.get('snippet', '')}
+
+Analyze this email and provide a JSON response with only these fields:
+
+{{
+{field_spec(fields)}
+}}
+
+IMPORTANT GUIDELINES:
+- Be concise and precise
+- Use consistent categorization
+- For email_type and campaign_type, stick to the provided options when possible
+- Return valid JSON only
+"""
+        return prompt
+    
+    def _is_packable(self, email: Dict) -> bool:
+        """
+        True se l'email è abbastanza breve da condividere una richiesta con altre
+        (serve l'ID per ricollegare la risposta)
+        """
+        return bool(email.get('id')) and count_tokens(email_body_text(email), ANALYSIS_MODEL) <= PACK_MAX_BODY_TOKENS
+    
+    def _pack_emails(self, emails: List[Dict]) -> List[List[int]]:
+        """
+        Raggruppa le email in pacchetti che rispettano pack_token_budget e PACK_MAX_EMAILS
+        
+        Il costo di ogni email è stimato come token del suo blocco nel prompt
+        più ESTIMATED_COMPLETION_TOKENS per la sua risposta.
+        
+        Args:
+            emails: Email da raggruppare
+        
+        Returns:
+            Liste di indici in emails, nell'ordine originale
+        """
+        base_tokens = len(SYSTEM_PROMPT + self._create_packed_prompt([])) // 4
+        packs = []
+        current = []
+        current_tokens = base_tokens
+        for idx, email in enumerate(emails):
+            cost = len(self._packed_email_block(email)) // 4 + ESTIMATED_COMPLETION_TOKENS
+            if current and (current_tokens + cost > self.pack_token_budget or len(current) >= PACK_MAX_EMAILS):
+                packs.append(current)
+                current = []
+                current_tokens = base_tokens
+            current.append(idx)
+            current_tokens += cost
+        if current:
+            packs.append(current)
+        return packs
+    
+    async def _analyze_packed_async(self, client: AsyncOpenAI, emails: List[Dict],
+                                    results: List[Optional[Dict]], semaphore: asyncio.Semaphore, report):
+        """
+        Analizza le email brevi a pacchetti, una richiesta per pacchetto
+        
+        Le analisi valide vengono scritte in results; le posizioni che restano
+        None (email lunghe, duplicati, risposte non valide) passano al percorso
+        con una richiesta per email.
+        
+        Args:
+            client: Client AsyncOpenAI
+            emails: Email del batch
+            results: Risultati del batch, aggiornati sul posto
+            semaphore: Limite delle richieste contemporanee
+            report: Callback chiamata per ogni email completata
+        """
+        pending = []
+        sent_keys = set()
+        for idx, email in enumerate(emails):
+            if not self._is_packable(email):
+                continue
+            cache_key = self._cache_key(email)
+            if cache_key is not None and cache_key in sent_keys:
+                # Duplicato: lo analizza il percorso singolo, trovando l'analisi in cache
+                continue
+            analysis = self._known_analysis(email)
+            if analysis is not None:
+                results[idx] = self._build_result(email, analysis)
+                report()
+                continue
+            if cache_key is not None:
+                sent_keys.add(cache_key)
+            pending.append(idx)
+        
+        pending_emails = [emails[idx] for idx in pending]
+        
+        async def analyze_pack(pack: List[int]):
+            pack_emails = [pending_emails[position] for position in pack]
+            async with semaphore:
+                analyses = await self._request_pack_async(client, pack_emails)
+            for position, email, analysis in zip(pack, pack_emails, analyses):
+                if analysis is None:
+                    continue
+                self._store_analysis(email, analysis)
+                self._index_analysis(email, analysis)
+                results[pending[position]] = self._build_result(email, analysis)
+                report()
+        
+        await asyncio.gather(*(analyze_pack(pack) for pack in self._pack_emails(pending_emails) if len(pack) > 1))
+    
+    async def _request_pack_async(self, client: AsyncOpenAI, emails: List[Dict]) -> List[Optional[Dict]]:
+        """
+        Invia un pacchetto di email in una sola richiesta
+        
+        Args:
+            client: Client AsyncOpenAI
+            emails: Email del pacchetto
+        
+        Returns:
+            Analisi validate, nello stesso ordine di emails (None per quelle da rianalizzare)
+        """
+        params = self._packed_completion_params(emails)
+        estimated_tokens = self._estimate_tokens(params) + ESTIMATED_COMPLETION_TOKENS * (len(emails) - 1)
+        queued_since = time.perf_counter()
+        await self.budget.acquire(estimated_tokens)
+        
+        try:
+            response = await self._acreate_completion(client, params, 'analysis_packed', emails_count=len(emails),
+                                                      queued=time.perf_counter() - queued_since, emails=emails)
+        except Exception as e:
+            print(f"⚠️  Analisi del pacchetto di {len(emails)} email fallita, analisi singola: {e}")
+            return [None] * len(emails)
+        
+        self._count_usage(response)
+        if response.usage:
+            self.budget.record_usage(estimated_tokens, response.usage.total_tokens)
+        return self._parse_packed_response(response.choices[0].message.content, emails)
+    
+    def _packed_completion_params(self, emails: List[Dict]) -> Dict:
+        """
+        Parametri della chiamata chat.completions per un pacchetto di email
+        """
+        return {
+            'model': ANALYSIS_MODEL,
+            'messages': [
+                {
+                    "role": "system",
+                    "content": SYSTEM_PROMPT
+                },
+                {
+                    "role": "user",
+                    "content": self._create_packed_prompt(emails)
+                }
+            ],
+            'temperature': 0.3,
+            'response_format': {"type": "json_object"}
+        }
+    
+    @staticmethod
+    def _packed_email_block(email: Dict) -> str:
+        """
+        Blocco di un'email all'interno del prompt impacchettato
+        """
+        return f"""
+EMAIL ID: {email.get('id', '')}
+Sender: {email.get('from', '')}
+Subject: {email.get('subject', '')}
+Body Preview: {prompt_body(email, PACK_MAX_BODY_TOKENS, ANALYSIS_MODEL)}
+Snippet: {email.get('snippet', '')}
+"""
+
+    def _create_packed_prompt(self, emails: List[Dict]) -> str:
+        """
+        Crea il prompt che analizza più email con una sola copia delle istruzioni
+        """
+        blocks = ''.join(self._packed_email_block(email) for email in emails)
+        prompt = f"""Analyze each of the following {len(emails)} emails independently.
+
+Return a JSON object with a "results" array containing exactly one object per email, in this format:
+
+{{"results": [{{
+  "id": "The EMAIL ID exactly as given",
+{ANALYSIS_FIELD_SPEC}
+}}]}}
+
+IMPORTANT GUIDELINES:
+- Be concise and precise
+- Use consistent categorization
+- Extract exact pricing/discount information when present
+- Identify the primary funnel stage
+- For email_type and campaign_type, stick to the provided options when possible
+- Do not mix information between emails
+- Return valid JSON only
+
+EMAILS:
+{blocks}"""
+        return prompt
+    
+    @staticmethod
+    def _parse_packed_response(content: str, emails: List[Dict]) -> List[Optional[Dict]]:
+        """
+        Valida la risposta di un pacchetto confrontando ogni elemento con le email inviate
+        
+        Un elemento è accettato se il suo id corrisponde a un'email del pacchetto
+        (una sola volta) e contiene tutti i campi di ANALYSIS_FIELDS come stringhe,
+        con email_type non vuoto.
+        
+        Args:
+            content: Testo JSON restituito dal modello
+            emails: Email del pacchetto
+        
+        Returns:
+            Analisi nello stesso ordine di emails (None per gli elementi mancanti o non validi)
+        """
+        try:
+            data = json.loads(content)
+        except (TypeError, ValueError):
+            print(f"⚠️  Risposta del pacchetto non in JSON valido, analisi singola di {len(emails)} email")
+            return [None] * len(emails)
+        
+        items = data.get('results') if isinstance(data, dict) else data
+        if not isinstance(items, list):
+            print(f"⚠️  Risposta del pacchetto senza array 'results', analisi singola di {len(emails)} email")
+            return [None] * len(emails)
+        
+        expected_ids = {email.get('id', '') for email in emails}
+        by_id = {}
+        duplicated = set()
+        for item in items:
+            if not isinstance(item, dict) or item.get('id') not in expected_ids:
+                continue
+            if item['id'] in by_id:
+                duplicated.add(item['id'])
+            by_id[item['id']] = item
+        
+        analyses = []
+        for email in emails:
+            item = by_id.get(email.get('id', ''))
+            valid = (
+                item is not None
+                and item['id'] not in duplicated
+                and all(isinstance(item.get(field), str) for field in ANALYSIS_FIELDS)
+                and item['email_type'].strip() != ''
+            )
+            analyses.append({field: item[field] for field in ANALYSIS_FIELDS} if valid else None)
+        
+        invalid = analyses.count(None)
+        if invalid:
+            print(f"⚠️  {invalid}/{len(emails)} analisi del pacchetto non valide, analisi singola")
+        return analyses
+    
+    def _analyze_sequential(self, emails: List[Dict], progress_callback=None) -> List[Dict]:
+        """
+        Analizza le email una alla volta con il client sincrono
         """
         analyzed_emails = []
         total = len(emails)
@@ -217,6 +1069,242 @@ IMPORTANT GUIDELINES:
             analyzed = self.analyze_email(email)
             analyzed_emails.append(analyzed)
         
-        print(f"\n✅ Analizzate {len(analyzed_emails)} email!")
         return analyzed_emails
-
+    
+    def write_batch_file(self, emails: List[Dict], path: str) -> str:
+        """
+        Scrive le richieste di analisi in un file JSONL per la Batch API
+        
+        Ogni riga usa come custom_id l'ID dell'email, così i risultati
+        possono essere ricollegati alle email di partenza.
+        
+        Args:
+            emails: Lista di email da analizzare
+            path: Path del file JSONL da creare
+        
+        Returns:
+            Path del file creato
+        """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            for email in emails:
+                f.write(json.dumps({
+                    'custom_id': email.get('id', ''),
+                    'method': 'POST',
+                    'url': '/v1/chat/completions',
+                    'body': self._completion_params(email)
+                }) + '\n')
+        return path
+    
+    def submit_batch(self, path: str) -> str:
+        """
+        Carica il file JSONL e crea il job sulla Batch API
+        
+        Args:
+            path: File JSONL creato da write_batch_file
+        
+        Returns:
+            ID del batch OpenAI
+        """
+        with open(path, 'rb') as f:
+            input_file = self.client.files.create(file=f, purpose='batch')
+        
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint='/v1/chat/completions',
+            completion_window='24h',
+            metadata={'source': 'email_analyzer', 'input': os.path.basename(path)}
+        )
+        return batch.id
+    
+    def wait_for_batch(self, batch_id: str, poll_interval: float = BATCH_POLL_SECONDS,
+                       timeout: Optional[float] = None):
+        """
+        Attende la fine di un batch controllandone lo stato periodicamente
+        
+        Args:
+            batch_id: ID del batch OpenAI
+            poll_interval: Secondi tra un controllo e il successivo
+            timeout: Attesa massima in secondi (None = nessun limite)
+        
+        Returns:
+            Oggetto batch nello stato finale
+        
+        Raises:
+            TimeoutError: Se il batch non termina entro il timeout
+        """
+        started = time.monotonic()
+        while True:
+            batch = self.client.batches.retrieve(batch_id)
+            if batch.status in BATCH_FINAL_STATUSES:
+                return batch
+            
+            counts = batch.request_counts
+            if counts:
+                print(f"⏳ Batch {batch_id}: {batch.status} ({counts.completed}/{counts.total})", end='\r')
+            if timeout is not None and time.monotonic() - started > timeout:
+                raise TimeoutError(f"Batch {batch_id} non completato entro {timeout} secondi")
+            time.sleep(poll_interval)
+    
+    def collect_batch_results(self, batch, emails: List[Dict]) -> List[Dict]:
+        """
+        Scarica i risultati di un batch e li unisce alle email per email_id
+        
+        Args:
+            batch: Oggetto batch nello stato finale
+            emails: Email inviate nel batch
+        
+        Returns:
+            Lista di email analizzate nello stesso ordine di emails (risultato
+            di errore per le richieste fallite o mancanti)
+        """
+        responses = {}
+        errors = {}
+        
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            for line in self.client.files.content(file_id).text.splitlines():
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                response = item.get('response') or {}
+                if item.get('error') or response.get('status_code') != 200:
+                    errors[item['custom_id']] = item.get('error') or response.get('body')
+                    continue
+                responses[item['custom_id']] = response['body']
+        
+        results = []
+        for email in emails:
+            email_id = email.get('id', '')
+            try:
+                if email_id not in responses:
+                    raise ValueError(errors.get(email_id) or f"nessun risultato (batch {batch.status})")
+                if self.ledger is not None:
+                    body = responses[email_id]
+                    self.ledger.record('analysis_batch', body.get('model', ANALYSIS_MODEL), body.get('usage'),
+                                       email=email, batch=True)
+                analysis = json.loads(responses[email_id]['choices'][0]['message']['content'])
+                self._store_analysis(email, analysis)
+                self._index_analysis(email, analysis)
+                results.append(self._build_result(email, analysis))
+            except Exception as e:
+                print(f"Errore durante l'analisi dell'email {email_id}: {e}")
+                results.append(self._build_error_result(email, e))
+        return results
+    
+    def _save_pending_batch(self, path: str, batch_id: str, emails: List[Dict]) -> str:
+        """
+        Salva ID ed email di un batch inviato accanto al suo file JSONL
+        
+        Returns:
+            Path del file salvato (rimosso quando i risultati sono stati raccolti)
+        """
+        pending_path = os.path.splitext(path)[0] + BATCH_PENDING_SUFFIX
+        with open(pending_path, 'w', encoding='utf-8') as f:
+            json.dump({'batch_id': batch_id, 'emails': emails}, f, ensure_ascii=False, default=str)
+        return pending_path
+    
+    def _collect_pending_batch(self, pending_path: str, poll_interval: float) -> List[Dict]:
+        """
+        Attende il batch salvato in pending_path, ne raccoglie i risultati e rimuove il file
+        
+        Returns:
+            Lista di email analizzate, nello stesso ordine di quelle del batch
+        """
+        with open(pending_path, encoding='utf-8') as f:
+            pending = json.load(f)
+        
+        batch = self.wait_for_batch(pending['batch_id'], poll_interval)
+        print(f"\n📥 Batch {pending['batch_id']}: {batch.status}")
+        results = self.collect_batch_results(batch, pending['emails'])
+        os.remove(pending_path)
+        return results
+    
+    def resume_offline_batches(self, batch_dir: str = BATCH_DIR,
+                               poll_interval: float = BATCH_POLL_SECONDS) -> List[Dict]:
+        """
+        Raccoglie i batch inviati da un'esecuzione precedente e mai raccolti (es. processo interrotto)
+        
+        Args:
+            batch_dir: Cartella dei file JSONL
+            poll_interval: Secondi tra un controllo dello stato e il successivo
+        
+        Returns:
+            Lista di email analizzate di tutti i batch ripresi
+        """
+        if not os.path.isdir(batch_dir):
+            return []
+        
+        results = []
+        for name in sorted(os.listdir(batch_dir)):
+            if name.endswith(BATCH_PENDING_SUFFIX):
+                print(f"⏸️  Batch non raccolto trovato: {name}")
+                results.extend(self._collect_pending_batch(os.path.join(batch_dir, name), poll_interval))
+        return results
+    
+    def analyze_batch_offline(self, emails: List[Dict], batch_dir: str = BATCH_DIR,
+                              poll_interval: float = BATCH_POLL_SECONDS) -> List[Dict]:
+        """
+        Analizza le email con la Batch API di OpenAI (metà costo, nessun limite RPM/TPM)
+        
+        I risultati arrivano entro 24 ore: adatto ai backfill, non al monitor.
+        
+        Args:
+            emails: Lista di email da analizzare
+            batch_dir: Cartella in cui scrivere i file JSONL
+            poll_interval: Secondi tra un controllo dello stato e il successivo
+        
+        Returns:
+            Lista di email analizzate, nello stesso ordine di emails
+        """
+        if not emails:
+            return []
+        
+        # Solo le email non in cache e con contenuto non ancora incluso vanno nel batch
+        results: List[Optional[Dict]] = [None] * len(emails)
+        to_send = []
+        sent_keys = set()
+        pre_classified = 0
+        for idx, email in enumerate(emails):
+            analysis = self._pre_classified(email)
+            if analysis is not None:
+                results[idx] = self._build_result(email, analysis)
+                pre_classified += 1
+                continue
+            analysis = self._cached_analysis(email)
+            cache_key = self._cache_key(email)
+            if analysis is not None:
+                results[idx] = self._build_result(email, analysis)
+            elif cache_key is None or cache_key not in sent_keys:
+                sent_keys.add(cache_key)
+                to_send.append(idx)
+        
+        # Un batch accetta al massimo BATCH_MAX_REQUESTS richieste
+        jobs = []
+        pending_paths = {}
+        for start in range(0, len(to_send), BATCH_MAX_REQUESTS):
+            chunk_indexes = to_send[start:start + BATCH_MAX_REQUESTS]
+            chunk = [emails[idx] for idx in chunk_indexes]
+            path = os.path.join(batch_dir, f"analysis_{datetime.now():%Y%m%d_%H%M%S}_{start}.jsonl")
+            batch_id = self.submit_batch(self.write_batch_file(chunk, path))
+            print(f"📤 Batch {batch_id} inviato: {len(chunk)} email ({path})")
+            # Salvato prima dell'attesa (fino a 24 ore): un riavvio raccoglie il batch invece di reinviarlo
+            pending_paths[batch_id] = self._save_pending_batch(path, batch_id, chunk)
+            jobs.append((batch_id, chunk_indexes))
+        
+        for batch_id, chunk_indexes in jobs:
+            for idx, result in zip(chunk_indexes, self._collect_pending_batch(pending_paths[batch_id], poll_interval)):
+                results[idx] = result
+        
+        # Duplicati nel batch: ora l'analisi della prima copia è in cache
+        for idx, email in enumerate(emails):
+            if results[idx] is None:
+                analysis = self._cached_analysis(email)
+                results[idx] = (self._build_result(email, analysis) if analysis is not None
+                                else self._build_error_result(email, ValueError("analisi del duplicato non disponibile")))
+        
+        print(f"✅ Analizzate {len(results)} email con la Batch API!")
+        self._print_pre_classifier_summary(pre_classified)
+        self._print_cache_summary(len(emails) - pre_classified - len(to_send), len(emails) - pre_classified)
+        return results
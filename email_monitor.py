@@ -10,6 +10,9 @@ from gmail_extractor import GmailExtractor
 from email_analyzer import EmailAnalyzer
 from database import EmailDatabase
 from account_manager import AccountManager
+from history_sync import HistorySync
+from llm_resilience import ANALYSIS_RETRY_DRAIN_MINUTES
+from analysis_queue import AnalysisWorker
 import os
 from dotenv import load_dotenv
 
@@ -23,6 +26,9 @@ if not OPENAI_API_KEY:
 
 CHECK_INTERVAL_MINUTES = int(os.getenv('CHECK_INTERVAL_MINUTES', 15))  # Controlla ogni 15 minuti
 
+# 'history' = sync incrementale via History API, 'poll' = ultimi 50 messaggi
+SYNC_MODE = os.getenv('SYNC_MODE', 'history').lower()
+
 
 class EmailMonitor:
     """
@@ -39,7 +45,9 @@ class EmailMonitor:
         self.check_interval = check_interval
         self.db = EmailDatabase()
         self.analyzer = EmailAnalyzer(api_key=OPENAI_API_KEY)
+        self.worker = AnalysisWorker(self.analyzer, self.db, role='email_monitor')
         self.extractor = None
+        self.history_sync = None
         self.last_check = None
         self.running = False
         
@@ -62,6 +70,8 @@ class EmailMonitor:
                     print(f"   Email: {active['email']}")
             
             self.extractor = GmailExtractor(account_manager=account_mgr)
+            if SYNC_MODE == 'history':
+                self.history_sync = HistorySync(self.extractor, self.db)
             
             # Test connessione
             profile = self.extractor.get_profile()
@@ -72,7 +82,7 @@ class EmailMonitor:
             else:
                 print("❌ Impossibile connettersi a Gmail")
                 return False
-                
+        
         except Exception as e:
             print(f"❌ Errore nell'inizializzazione: {e}")
             return False
@@ -84,8 +94,29 @@ class EmailMonitor:
         Returns:
             Set di email_id già presenti
         """
-        emails = self.db.get_all_emails()
-        return {email['email_id'] for email in emails if email.get('email_id')}
+        return self.db.get_existing_email_ids()
+    
+    def get_new_message_ids(self) -> list:
+        """
+        Recupera gli ID delle nuove email secondo la modalità di sync configurata
+        
+        Returns:
+            Lista di ID dei nuovi messaggi, None se il controllo è fallito
+        """
+        if self.history_sync:
+            print("📥 Sync incrementale da Gmail (History API)...")
+            return self.history_sync.get_new_message_ids()
+        
+        # Recupera gli ID delle email già presenti
+        existing_ids = self.get_existing_email_ids()
+        print(f"📊 Email già nel database: {len(existing_ids)}")
+        
+        # Recupera le email più recenti (ultimi 50 messaggi)
+        print("📥 Recupero messaggi recenti da Gmail...")
+        messages = self.extractor.get_messages(max_results=50)
+        
+        # Filtra solo le nuove
+        return [msg['id'] for msg in messages if msg['id'] not in existing_ids]
     
     def check_for_new_emails(self):
         """
@@ -96,59 +127,83 @@ class EmailMonitor:
         print(f"🔍 Controllo nuove email - {timestamp}")
         print(f"{'='*80}")
         
+        # Email live rimaste in coda (es. presa in carico scaduta di un worker interrotto)
+        self.process_queued_live()
+        
         try:
-            # Recupera gli ID delle email già presenti
-            existing_ids = self.get_existing_email_ids()
-            print(f"📊 Email già nel database: {len(existing_ids)}")
-            
-            # Recupera le email più recenti (ultimi 50 messaggi)
-            print("📥 Recupero messaggi recenti da Gmail...")
-            messages = self.extractor.get_messages(max_results=50)
-            
-            # Filtra solo le nuove
-            new_messages = [msg for msg in messages if msg['id'] not in existing_ids]
+            new_messages = self.get_new_message_ids()
+            if new_messages is None:
+                print("❌ Impossibile recuperare le nuove email da Gmail")
+                return
             
             if not new_messages:
                 print("✅ Nessuna nuova email trovata")
+                if self.history_sync:
+                    self.history_sync.commit()
                 self.last_check = datetime.now()
                 return
             
             print(f"\n🆕 Trovate {len(new_messages)} nuove email!")
             
-            # Processa le nuove email
-            new_emails_data = []
-            for idx, message in enumerate(new_messages, 1):
-                print(f"\n📧 Email {idx}/{len(new_messages)}...")
-                
-                # Estrai dettagli
-                email_detail = self.extractor.get_message_detail(message['id'])
-                
-                if email_detail:
-                    print(f"   Da: {email_detail.get('from', 'Unknown')}")
-                    print(f"   Oggetto: {email_detail.get('subject', 'No subject')[:60]}...")
-                    new_emails_data.append(email_detail)
+            # Estrai i dettagli delle nuove email (in parallelo)
+            new_emails_data = self.extractor.get_messages_details(new_messages)
+            
+            for idx, email_detail in enumerate(new_emails_data, 1):
+                print(f"\n📧 Email {idx}/{len(new_emails_data)}...")
+                print(f"   Da: {email_detail.get('from', 'Unknown')}")
+                print(f"   Oggetto: {email_detail.get('subject', 'No subject')[:60]}...")
             
-            # Analizza con AI
+            # Analizza con AI e salva nel database (con priorità live sul backfill in corso)
             if new_emails_data:
                 print(f"\n🤖 Analisi AI in corso per {len(new_emails_data)} email...")
-                analyzed_emails = self.analyzer.analyze_batch(new_emails_data)
+                analyzed_emails = self.worker.analyze_now(new_emails_data)
                 
-                # Salva nel database
-                print(f"\n💾 Salvataggio nel database...")
-                saved_count = self.db.save_batch(analyzed_emails)
-                
-                print(f"\n✅ Processate e salvate {saved_count} nuove email!")
+                print(f"\n✅ Processate {len(analyzed_emails)} nuove email!")
                 
                 # Mostra riepilogo
                 self.show_summary(analyzed_emails)
             
-            self.last_check = datetime.now()
+            # Il checkpoint avanza solo se ogni nuova email è salvata, ancora in coda o non più su Gmail
+            unsaved = self.worker.unsaved(new_messages, resolved=self.extractor.unavailable_ids)
+            if unsaved:
+                print(f"⚠️  {len(unsaved)} email non salvate: verranno riprese al prossimo controllo")
+            elif self.history_sync:
+                self.history_sync.commit()
             
+            self.last_check = datetime.now()
+        
         except Exception as e:
             print(f"\n❌ Errore durante il controllo: {e}")
             import traceback
             traceback.print_exc()
     
+    def process_queued_live(self, recover: bool = False):
+        """
+        Analizza e salva le email live rimaste in coda
+        
+        Args:
+            recover: True all'avvio, per riprendere anche quelle di un'esecuzione interrotta
+        """
+        try:
+            if recover:
+                self.worker.recover()
+            else:
+                self.worker.run(max_priority='live')
+        except Exception as e:
+            print(f"\n❌ Errore durante l'analisi delle email in coda: {e}")
+    
+    def drain_retry_queue(self):
+        """
+        Rianalizza le email la cui analisi era fallita e aggiorna il database
+        """
+        try:
+            recovered = self.analyzer.retry_failed_analyses()
+            if recovered:
+                saved_count = self.db.save_batch(recovered)
+                print(f"💾 Aggiornate {saved_count} email con l'analisi recuperata")
+        except Exception as e:
+            print(f"\n❌ Errore durante i nuovi tentativi di analisi: {e}")
+    
     def show_summary(self, emails: list):
         """
         Mostra un riepilogo delle email processate
@@ -203,10 +258,13 @@ class EmailMonitor:
         
         # Esegui il primo controllo immediatamente
         print("📍 Esecuzione primo controllo...")
+        self.process_queued_live(recover=True)
         self.check_for_new_emails()
+        self.drain_retry_queue()
         
-        # Schedula i controlli periodici
+        # Schedula i controlli periodici e i nuovi tentativi delle analisi fallite
         schedule.every(self.check_interval).minutes.do(self.check_for_new_emails)
+        schedule.every(ANALYSIS_RETRY_DRAIN_MINUTES).minutes.do(self.drain_retry_queue)
         
         self.running = True
         
@@ -225,6 +283,7 @@ class EmailMonitor:
         Ferma il servizio di monitoraggio
         """
         self.running = False
+        self.worker.close()
         print("\n✅ Servizio monitor fermato")
         print("="*80)
 
@@ -5,25 +5,98 @@ Modulo per estrarre email da Gmail usando OAuth 2.0
 import os
 import pickle
 import base64
-from typing import List, Dict, Optional
+import json
+import time
+import threading
+from datetime import datetime, timedelta
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, List, Dict, Optional, Iterator, Tuple
 from email.mime.text import MIMEText
+import httplib2
+import google_auth_httplib2
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+from googleapiclient import discovery_cache
+from googleapiclient.discovery import build_from_document
 from googleapiclient.errors import HttpError
+from rate_limiter import QuotaRateLimiter, QUOTA_COSTS
+from raw_archive import RawMessageArchive
+from message_parser import ParsePool, PARSE_WORKERS, parse_full_payload, parse_raw_message
+from dotenv import load_dotenv
+
+# Carica variabili d'ambiente
+load_dotenv()
 
 
 # Scopes necessari per leggere le email
 SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
 
+# Limite massimo di richieste per singola batch request dell'API Gmail
+BATCH_SIZE = 100
+
+# Numero di batch request inviate in parallelo
+MAX_PARALLEL_BATCHES = 4
+
+# Modalità di recupero dei dettagli: 'batch', 'threads' oppure 'sequential'
+FETCH_MODE = os.getenv('GMAIL_FETCH_MODE', 'batch').lower()
+
+# Numero di worker per la modalità 'threads'
+FETCH_WORKERS = int(os.getenv('GMAIL_FETCH_WORKERS', 8))
+
+# Messaggi stimati oltre i quali un intervallo di date viene diviso in shard più piccoli
+SHARD_TARGET_SIZE = int(os.getenv('GMAIL_SHARD_TARGET_SIZE', 5000))
+
+# Durata minima di uno shard (sotto questa soglia non viene più diviso)
+MIN_SHARD_SECONDS = 3600
+
+# Data di lancio di Gmail: nessuna email è più vecchia
+GMAIL_EPOCH = datetime(2004, 4, 1)
+
+# Formato dei messaggi scaricati: 'full' (payload JSON) oppure 'raw' (RFC822)
+FETCH_FORMAT = os.getenv('GMAIL_FETCH_FORMAT', 'full').lower()
+
+# Cartella dell'archivio locale dei messaggi raw (vuoto = archivio disattivato)
+RAW_ARCHIVE_DIR = os.getenv('GMAIL_RAW_ARCHIVE_DIR', '')
+
+
+@lru_cache(maxsize=1)
+def _gmail_discovery_document() -> Dict:
+    """
+    Carica una sola volta il discovery document Gmail v1 incluso in google-api-python-client
+    
+    Evita il download (o il parsing ripetuto) del documento a ogni build del servizio.
+    """
+    document = discovery_cache.get_static_doc('gmail', 'v1')
+    if document is None:
+        raise RuntimeError("Discovery document statico per gmail v1 non disponibile")
+    return json.loads(document)
+
+
+def build_gmail_service(creds: Credentials):
+    """
+    Crea un servizio Gmail v1 dal discovery document statico
+    
+    Args:
+        creds: Credenziali OAuth 2.0
+    
+    Returns:
+        Risorsa del servizio Gmail
+    """
+    return build_from_document(_gmail_discovery_document(), credentials=creds)
+
 
 class GmailExtractor:
     """
     Classe per estrarre email da Gmail usando OAuth 2.0
     """
     
-    def __init__(self, credentials_file: str = 'credentials.json', token_file: str = 'token.pickle', account_manager=None):
+    def __init__(self, credentials_file: str = 'credentials.json', token_file: str = 'token.pickle', account_manager=None,
+                 fetch_mode: str = FETCH_MODE, fetch_workers: int = FETCH_WORKERS,
+                 rate_limiter: Optional[QuotaRateLimiter] = None, fetch_format: str = FETCH_FORMAT,
+                 client_config: Optional[Dict] = None, archive: Optional[RawMessageArchive] = None,
+                 parse_workers: int = PARSE_WORKERS):
         """
         Inizializza l'estrattore Gmail
         
@@ -31,10 +104,40 @@ class GmailExtractor:
             credentials_file: Path al file credentials.json scaricato da Google Cloud Console
             token_file: Path dove salvare/caricare il token di autenticazione
             account_manager: Opzionale AccountManager per gestire multipli account
+            fetch_mode: Modalità di recupero dei dettagli ('batch', 'threads', 'sequential')
+            fetch_workers: Numero di worker per la modalità 'threads'
+            rate_limiter: QuotaRateLimiter da usare (default: uno nuovo per questo estrattore)
+            fetch_format: Formato dei messaggi scaricati ('full' oppure 'raw')
+            client_config: Configurazione OAuth in memoria (alternativa a credentials_file)
+            archive: Archivio dei messaggi raw (default: GMAIL_RAW_ARCHIVE_DIR se impostata)
+            parse_workers: Processi per il parsing dei messaggi (0 = parsing nei thread di download)
         """
         self.credentials_file = credentials_file
+        self.client_config = client_config
+        self.account_email = ''
+        self.account_name = ''
+        
         self.token_file = token_file
         self.service = None
+        self.creds = None
+        self.fetch_mode = fetch_mode
+        self.fetch_workers = fetch_workers
+        self.fetch_format = fetch_format
+        self.archive = archive
+        if self.archive is None and RAW_ARCHIVE_DIR:
+            self.archive = RawMessageArchive(RAW_ARCHIVE_DIR)
+        if self.archive is not None:
+            # L'archivio conserva i byte RFC822 originali: servono in formato raw
+            self.fetch_format = 'raw'
+        self.parse_pool = ParsePool(parse_workers) if parse_workers > 0 else None
+        self._executor = None
+        self._thread_local = threading.local()
+        self.rate_limiter = rate_limiter or QuotaRateLimiter()
+        # Messaggi che Gmail non restituirà mai (404 o altro errore 4xx non di quota, es. eliminati)
+        self.unavailable_ids = set()
+        self.startup_timings = {}
+        self._token_lock = threading.Lock()
+        self._saved_token = None
         
         # Se viene passato un account manager, usa l'account attivo
         if account_manager:
@@ -43,90 +146,253 @@ class GmailExtractor:
                 # Crea il file credentials.json per l'account attivo
                 account_manager.create_credentials_file(active_account, self.credentials_file)
                 self.token_file = active_account['token_file']
+                self.account_name = active_account['name']
                 print(f"📧 Usando account: {active_account['name']}")
         
         self._authenticate()
     
+    @classmethod
+    def for_account(cls, account: Dict, account_manager, **kwargs) -> 'GmailExtractor':
+        """
+        Crea un estrattore per un account specifico con credenziali in memoria
+        
+        A differenza di account_manager=..., non riscrive credentials.json:
+        più estrattori per account diversi possono coesistere.
+        
+        Args:
+            account: Dizionario dell'account (da AccountManager)
+            account_manager: AccountManager che gestisce l'account
+            **kwargs: Altri parametri per GmailExtractor
+        
+        Returns:
+            GmailExtractor autenticato sull'account
+        """
+        print(f"📧 Usando account: {account['name']}")
+        extractor = cls(
+            token_file=account['token_file'],
+            client_config=account_manager.get_client_config(account),
+            **kwargs
+        )
+        extractor.account_name = account['name']
+        return extractor
+    
     def _authenticate(self):
         """
         Gestisce l'autenticazione OAuth 2.0
+        
+        Un token scaduto con refresh token non viene rinnovato qui ma alla
+        prima chiamata API (vedi _ensure_fresh_token).
         """
         creds = None
+        started = time.perf_counter()
         
         # Carica il token salvato se esiste
         if os.path.exists(self.token_file):
             with open(self.token_file, 'rb') as token:
                 creds = pickle.load(token)
+        self.startup_timings['load_token'] = time.perf_counter() - started
         
         # Se non ci sono credenziali valide, fai login
         if not creds or not creds.valid:
             if creds and creds.expired and creds.refresh_token:
-                creds.refresh(Request())
+                # Refresh rimandato al primo utilizzo
+                pass
             else:
-                if not os.path.exists(self.credentials_file):
-                    raise FileNotFoundError(
-                        f"File {self.credentials_file} non trovato. "
-                        "Scarica le credenziali da Google Cloud Console."
-                    )
-                
-                flow = InstalledAppFlow.from_client_secrets_file(
-                    self.credentials_file, SCOPES)
+                started = time.perf_counter()
+                if self.client_config:
+                    flow = InstalledAppFlow.from_client_config(self.client_config, SCOPES)
+                else:
+                    if not os.path.exists(self.credentials_file):
+                        raise FileNotFoundError(
+                            f"File {self.credentials_file} non trovato. "
+                            "Scarica le credenziali da Google Cloud Console."
+                        )
+                    
+                    flow = InstalledAppFlow.from_client_secrets_file(
+                        self.credentials_file, SCOPES)
                 creds = flow.run_local_server(port=8080)
-            
-            # Salva il token per il prossimo utilizzo
-            with open(self.token_file, 'wb') as token:
-                pickle.dump(creds, token)
+                self.startup_timings['oauth_flow'] = time.perf_counter() - started
+                
+                # Salva il token per il prossimo utilizzo
+                self._save_token(creds)
+        
+        self.creds = creds
+        self._saved_token = creds.token
+        
+        # Crea il servizio Gmail dal discovery document statico
+        started = time.perf_counter()
+        self.service = build_gmail_service(creds)
+        self.startup_timings['build_service'] = time.perf_counter() - started
         
-        # Crea il servizio Gmail
-        self.service = build('gmail', 'v1', credentials=creds)
         print("Autenticazione completata con successo!")
+        self.print_startup_timings()
+    
+    def _save_token(self, creds: Credentials):
+        """
+        Salva il token su disco per il prossimo utilizzo
+        """
+        with open(self.token_file, 'wb') as token:
+            pickle.dump(creds, token)
+        self._saved_token = creds.token
+    
+    def _ensure_fresh_token(self):
+        """
+        Rinnova il token se scaduto (una sola volta anche con più thread) e lo salva
+        """
+        if self.creds is None or (self.creds.valid and self.creds.token == self._saved_token):
+            return
+        
+        with self._token_lock:
+            if not self.creds.valid and self.creds.refresh_token:
+                started = time.perf_counter()
+                self.creds.refresh(Request())
+                self.startup_timings['token_refresh'] = time.perf_counter() - started
+            if self.creds.token != self._saved_token:
+                self._save_token(self.creds)
+    
+    def _execute(self, request, method: str):
+        """
+        Esegue una richiesta API con token aggiornato e rate limiting
+        
+        Args:
+            request: HttpRequest di googleapiclient
+            method: Nome del metodo per il calcolo della quota (es. 'messages.get')
+        
+        Returns:
+            Risposta della richiesta
+        """
+        self._ensure_fresh_token()
+        return self.rate_limiter.execute(request, method)
     
-    def get_messages(self, max_results: Optional[int] = None, query: str = '') -> List[Dict]:
+    def print_startup_timings(self):
+        """
+        Mostra la durata delle fasi di avvio dell'estrattore
+        """
+        phases = ', '.join(f"{name}: {seconds * 1000:.0f}ms" for name, seconds in self.startup_timings.items())
+        print(f"⏱️  Avvio estrattore Gmail - {phases}")
+    
+    def get_messages(self, max_results: Optional[int] = None, query: str = '', strict: bool = False) -> List[Dict]:
         """
         Recupera la lista dei messaggi
         
         Args:
             max_results: Numero massimo di messaggi da recuperare (None = tutti)
             query: Query di ricerca Gmail (es: 'from:example@gmail.com')
+            strict: True = un errore dell'API viene sollevato invece di restituire una lista parziale
         
         Returns:
             Lista di dizionari con i metadati dei messaggi
+        
+        Raises:
+            HttpError: Solo con strict, se la lista non può essere completata
+        """
+        messages = []
+        for page_num, (page, _) in enumerate(self.iter_message_pages(max_results, query, strict=strict), 1):
+            messages.extend(page)
+            print(f"Pagina {page_num}: {len(messages)} messaggi totali scaricati...", end='\r')
+        
+        print(f"\nTrovati {len(messages)} messaggi totali")
+        return messages
+    
+    def iter_message_pages(self, max_results: Optional[int] = None, query: str = '',
+                           page_size: int = 500, page_token: Optional[str] = None,
+                           strict: bool = False) -> Iterator[Tuple[List[Dict], Optional[str]]]:
+        """
+        Scorre la lista dei messaggi una pagina alla volta
+        
+        Args:
+            max_results: Numero massimo di messaggi da recuperare (None = tutti)
+            query: Query di ricerca Gmail
+            page_size: Messaggi per pagina (massimo 500)
+            page_token: Token da cui riprendere la paginazione (opzionale)
+            strict: True = un errore dell'API viene sollevato invece di interrompere la paginazione
+        
+        Yields:
+            Tuple (messaggi della pagina, token della pagina successiva o None)
         """
         try:
-            messages = []
-            page_size = 500  # Massimo permesso dall'API Gmail per pagina
+            count = 0
+            page_size = min(page_size, 500)  # Massimo permesso dall'API Gmail per pagina
             
             request = self.service.users().messages().list(
                 userId='me',
                 maxResults=page_size,
-                q=query
+                q=query,
+                pageToken=page_token
             )
             
-            page_num = 0
             while request is not None:
-                page_num += 1
-                response = request.execute()
-                
-                if 'messages' in response:
-                    messages.extend(response['messages'])
-                    print(f"Pagina {page_num}: {len(messages)} messaggi totali scaricati...", end='\r')
+                response = self._execute(request, 'messages.list')
+                messages = response.get('messages', [])
+                next_page_token = response.get('nextPageToken')
                 
                 # Se abbiamo un limite e l'abbiamo raggiunto, fermiamoci
-                if max_results is not None and len(messages) >= max_results:
-                    messages = messages[:max_results]
-                    break
+                if max_results is not None and count + len(messages) >= max_results:
+                    yield messages[:max_results - count], None
+                    return
+                
+                count += len(messages)
+                yield messages, next_page_token
                 
                 # Altrimenti continua alla prossima pagina
                 request = self.service.users().messages().list_next(
                     request, response
                 )
-            
-            print(f"\nTrovati {len(messages)} messaggi totali")
-            return messages
         
         except HttpError as error:
             print(f'Errore durante il recupero dei messaggi: {error}')
-            return []
+            if strict:
+                raise
+    
+    def get_history_changes(self, start_history_id: str) -> Optional[Dict]:
+        """
+        Recupera i messaggi aggiunti alla mailbox dopo un historyId
+        
+        Args:
+            start_history_id: historyId dell'ultimo checkpoint
+        
+        Returns:
+            Dizionario con 'message_ids' (in ordine cronologico), 'history_id'
+            (nuovo checkpoint) ed 'expired' (True se il checkpoint è scaduto
+            e serve una risincronizzazione completa). None in caso di errore.
+        """
+        try:
+            message_ids = []
+            seen = set()
+            history_id = start_history_id
+            
+            request = self.service.users().history().list(
+                userId='me',
+                startHistoryId=start_history_id,
+                historyTypes=['messageAdded'],
+                maxResults=500
+            )
+            
+            while request is not None:
+                response = self._execute(request, 'history.list')
+                
+                for record in response.get('history', []):
+                    for added in record.get('messagesAdded', []):
+                        message = added['message']
+                        labels = message.get('labelIds', [])
+                        # Come messages.list, ignora bozze, spam e cestino
+                        if any(label in labels for label in ('DRAFT', 'SPAM', 'TRASH')):
+                            continue
+                        if message['id'] not in seen:
+                            seen.add(message['id'])
+                            message_ids.append(message['id'])
+                
+                history_id = response.get('historyId', history_id)
+                request = self.service.users().history().list_next(request, response)
+            
+            return {'message_ids': message_ids, 'history_id': history_id, 'expired': False}
+        
+        except HttpError as error:
+            if error.resp.status == 404:
+                # historyId troppo vecchio: Gmail non conserva più la cronologia
+                return {'message_ids': [], 'history_id': None, 'expired': True}
+            print(f'Errore durante il recupero della cronologia: {error}')
+            return None
     
     def get_message_detail(self, message_id: str) -> Optional[Dict]:
         """
@@ -138,108 +404,627 @@ class GmailExtractor:
         Returns:
             Dizionario con i dettagli del messaggio
         """
+        message = self._fetch_message(message_id)
+        return self._parse_message(message) if message else None
+    
+    def _fetch_message(self, message_id: str, service=None) -> Optional[Dict]:
+        """
+        Scarica un messaggio (nel formato fetch_format) senza parsarlo
+        
+        Args:
+            message_id: ID del messaggio da recuperare
+            service: Servizio Gmail da usare (default: quello dell'estrattore)
+        
+        Returns:
+            Messaggio restituito dall'API Gmail, None se non recuperabile
+        """
+        service = service or self.service
+        
         try:
-            message = self.service.users().messages().get(
+            request = service.users().messages().get(
                 userId='me',
                 id=message_id,
-                format='full'
-            ).execute()
-            
-            return self._parse_message(message)
+                format=self.fetch_format
+            )
+            return self._execute(request, 'messages.get')
         
         except HttpError as error:
-            print(f'Errore durante il recupero del messaggio {message_id}: {error}')
+            self._record_fetch_error(message_id, error)
             return None
     
-    def _parse_message(self, message: Dict) -> Dict:
+    def _record_fetch_error(self, message_id: str, error: Exception):
         """
-        Parsa un messaggio Gmail estraendo le informazioni principali
+        Segnala un messaggio non recuperato e registra in unavailable_ids quelli persi per sempre
         
         Args:
-            message: Messaggio raw da Gmail API
+            message_id: ID del messaggio
+            error: Errore della richiesta messages.get
+        """
+        print(f'Errore durante il recupero del messaggio {message_id}: {error}')
+        if (isinstance(error, HttpError) and 400 <= error.resp.status < 500
+                and not self.rate_limiter.is_retryable(error)):
+            self.unavailable_ids.add(message_id)
+    
+    def get_messages_details_batch(self, message_ids: List[str],
+                                   batch_size: int = BATCH_SIZE,
+                                   max_parallel_batches: int = MAX_PARALLEL_BATCHES) -> List[Optional[Dict]]:
+        """
+        Recupera i dettagli di più messaggi usando le batch request dell'API Gmail
+        
+        Le richieste messages.get vengono raggruppate in batch da al massimo
+        `batch_size` elementi e più batch vengono inviate in parallelo.
+        
+        Args:
+            message_ids: Lista degli ID dei messaggi da recuperare
+            batch_size: Numero di richieste per batch (massimo 100)
+            max_parallel_batches: Numero di batch inviate contemporaneamente
         
         Returns:
-            Dizionario con i dati parsati del messaggio
+            Lista di dizionari con i dettagli dei messaggi, nello stesso ordine
+            di message_ids (None per i messaggi non recuperabili)
+        
+        Raises:
+            HttpError: Se una batch request fallisce anche dopo i retry
+        """
+        messages = self._fetch_messages_batch(message_ids, batch_size, max_parallel_batches)
+        return [self._parse_message(message) if message else None for message in messages]
+    
+    def _fetch_messages_batch(self, message_ids: List[str], batch_size: int,
+                              max_parallel_batches: int) -> List[Optional[Dict]]:
         """
-        headers = message['payload']['headers']
+        Scarica i messaggi (nel formato fetch_format) tramite batch request parallele
         
-        # Estrai gli header principali
-        subject = ''
-        sender = ''
-        recipient = ''
-        date = ''
+        Args:
+            message_ids: Lista degli ID dei messaggi
+            batch_size: Numero di richieste per batch
+            max_parallel_batches: Numero di batch inviate contemporaneamente
         
-        for header in headers:
-            name = header['name'].lower()
-            if name == 'subject':
-                subject = header['value']
-            elif name == 'from':
-                sender = header['value']
-            elif name == 'to':
-                recipient = header['value']
-            elif name == 'date':
-                date = header['value']
+        Returns:
+            Lista dei messaggi raw nello stesso ordine di message_ids
         
-        # Estrai il corpo del messaggio
-        body = self._get_message_body(message['payload'])
+        Raises:
+            HttpError: Se una batch request fallisce anche dopo i retry
+        """
+        self._ensure_fresh_token()
+        batch_size = max(1, min(batch_size, BATCH_SIZE))
+        results: List[Optional[Dict]] = [None] * len(message_ids)
+        chunks = [
+            list(range(start, min(start + batch_size, len(message_ids))))
+            for start in range(0, len(message_ids), batch_size)
+        ]
         
+        def execute_chunk(indexes: List[int]):
+            # httplib2 non è thread-safe: ogni batch usa una connessione dedicata
+            http = google_auth_httplib2.AuthorizedHttp(self.creds, http=httplib2.Http())
+            attempt = 0
+            
+            while indexes:
+                retry_indexes = []
+                rate_limited = []
+                
+                def callback(request_id, response, exception):
+                    idx = int(request_id)
+                    if exception is not None:
+                        # Gli elementi limitati dalla quota vengono ritentati con backoff
+                        if (isinstance(exception, HttpError) and self.rate_limiter.is_retryable(exception)
+                                and attempt < self.rate_limiter.max_retries):
+                            retry_indexes.append(idx)
+                            if self.rate_limiter.is_rate_limit_error(exception):
+                                rate_limited.append(idx)
+                            return
+                        self._record_fetch_error(message_ids[idx], exception)
+                        return
+                    results[idx] = response
+                
+                batch = self.service.new_batch_http_request(callback=callback)
+                for idx in indexes:
+                    batch.add(
+                        self.service.users().messages().get(
+                            userId='me',
+                            id=message_ids[idx],
+                            format=self.fetch_format
+                        ),
+                        request_id=str(idx)
+                    )
+                
+                # Il rate limiter ritenta con backoff la batch request intera (429/5xx):
+                # se i tentativi si esauriscono l'errore arriva al chiamante, i messaggi non vengono persi in silenzio
+                try:
+                    self.rate_limiter.call(lambda: batch.execute(http=http),
+                                           QUOTA_COSTS['messages.get'] * len(indexes))
+                except HttpError as error:
+                    print(f'Errore durante la batch request ({len(indexes)} messaggi): {error}')
+                    raise
+                
+                if retry_indexes:
+                    if rate_limited:
+                        self.rate_limiter.on_rate_limited()
+                    self.rate_limiter.backoff(attempt)
+                    attempt += 1
+                indexes = sorted(retry_indexes)
+        
+        if len(chunks) <= 1 or max_parallel_batches <= 1:
+            for indexes in chunks:
+                execute_chunk(indexes)
+        else:
+            with ThreadPoolExecutor(max_workers=max_parallel_batches) as executor:
+                list(executor.map(execute_chunk, chunks))
+        
+        return results
+    
+    def get_messages_details_concurrent(self, message_ids: List[str],
+                                        max_workers: Optional[int] = None) -> List[Optional[Dict]]:
+        """
+        Recupera i dettagli di più messaggi in parallelo con un pool di thread
+        
+        Alternativa alle batch request: ogni worker usa un proprio servizio Gmail,
+        perché il trasporto httplib2 non è thread-safe.
+        
+        Args:
+            message_ids: Lista degli ID dei messaggi da recuperare
+            max_workers: Numero di worker (default: fetch_workers)
+        
+        Returns:
+            Lista di dizionari con i dettagli dei messaggi, nello stesso ordine
+            di message_ids (None per i messaggi non recuperabili)
+        """
+        if max_workers is not None and max_workers != self.fetch_workers:
+            # Solo il pool di thread dipende dal numero di worker: il pool di parsing resta aperto
+            self._close_executor()
+            self.fetch_workers = max_workers
+        
+        self._ensure_fresh_token()
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.fetch_workers,
+                                                thread_name_prefix='gmail-fetch')
+        
+        return list(self._executor.map(self._get_message_detail_threaded, message_ids))
+    
+    def _fetch_messages_concurrent(self, message_ids: List[str]) -> List[Optional[Dict]]:
+        """
+        Scarica i messaggi con il pool di thread, senza parsarli
+        """
+        self._ensure_fresh_token()
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.fetch_workers,
+                                                thread_name_prefix='gmail-fetch')
+        
+        return list(self._executor.map(self._fetch_message_threaded, message_ids))
+    
+    def _get_message_detail_threaded(self, message_id: str) -> Optional[Dict]:
+        """
+        Recupera un messaggio usando il servizio Gmail del thread corrente
+        """
+        message = self._fetch_message_threaded(message_id)
+        return self._parse_message(message) if message else None
+    
+    def _fetch_message_threaded(self, message_id: str) -> Optional[Dict]:
+        """
+        Scarica un messaggio usando il servizio Gmail del thread corrente
+        """
+        return self._fetch_message(message_id, self._thread_service())
+    
+    def _thread_service(self):
+        """
+        Restituisce il servizio Gmail del thread corrente, creandolo al primo uso
+        """
+        service = getattr(self._thread_local, 'service', None)
+        if service is None:
+            service = build_gmail_service(self.creds)
+            self._thread_local.service = service
+        return service
+    
+    def get_messages_sharded(self, after: Optional[datetime] = None, before: Optional[datetime] = None,
+                             query: str = '', max_workers: Optional[int] = None,
+                             target_shard_size: int = SHARD_TARGET_SIZE) -> List[Dict]:
+        """
+        Recupera la lista dei messaggi di un intervallo di date dividendolo in shard paralleli
+        
+        La paginazione di messages.list è sequenziale: l'intervallo viene diviso
+        in finestre after:/before: elencate in parallelo. Le finestre con più di
+        target_shard_size messaggi stimati vengono divise ulteriormente, così i
+        periodi più densi ottengono shard più piccoli.
+        
+        Args:
+            after: Inizio dell'intervallo (default: lancio di Gmail)
+            before: Fine dell'intervallo, esclusa (default: domani)
+            query: Query di ricerca Gmail aggiuntiva
+            max_workers: Shard elencati in parallelo (default: fetch_workers)
+            target_shard_size: Messaggi stimati massimi per shard
+        
+        Returns:
+            Lista dei messaggi senza duplicati, dal più recente al più vecchio
+        
+        Raises:
+            HttpError: Se una finestra non può essere elencata (dopo i retry del rate limiter)
+        """
+        start = int((after or GMAIL_EPOCH).timestamp())
+        end = int((before or datetime.now() + timedelta(days=1)).timestamp())
+        max_workers = max_workers or self.fetch_workers
+        self._ensure_fresh_token()
+        
+        # Shard iniziali di uguale durata, uno per worker
+        step = max((end - start) // max_workers, MIN_SHARD_SECONDS)
+        windows = [(t, min(t + step, end)) for t in range(start, end, step)]
+        
+        shards = {}
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='gmail-shard') as executor:
+            pending = {
+                executor.submit(self._list_shard, window, query, target_shard_size): window
+                for window in windows
+            }
+            while pending:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    window = pending.pop(future)
+                    try:
+                        messages, sub_windows = future.result()
+                    except Exception:
+                        # Una finestra non elencata non è una finestra vuota: il listing fallisce per intero
+                        for other in pending:
+                            other.cancel()
+                        raise
+                    if sub_windows:
+                        for sub_window in sub_windows:
+                            pending[executor.submit(self._list_shard, sub_window, query, target_shard_size)] = sub_window
+                    else:
+                        shards[window] = messages
+        
+        # Unisce gli shard dal più recente, eliminando i duplicati ai bordi
+        messages = []
+        seen = set()
+        for window in sorted(shards, reverse=True):
+            for message in shards[window]:
+                if message['id'] not in seen:
+                    seen.add(message['id'])
+                    messages.append(message)
+        
+        print(f"Trovati {len(messages)} messaggi in {len(shards)} shard")
+        return messages
+    
+    def _list_shard(self, window: Tuple[int, int], query: str,
+                    target_shard_size: int) -> Tuple[List[Dict], List[Tuple[int, int]]]:
+        """
+        Elenca i messaggi di una finestra temporale, o la divide se è troppo densa
+        
+        Args:
+            window: (inizio, fine) in secondi epoch
+            query: Query di ricerca Gmail aggiuntiva
+            target_shard_size: Messaggi stimati massimi per shard
+        
+        Returns:
+            Tuple (messaggi della finestra, sotto-finestre da elencare al suo posto)
+        
+        Raises:
+            HttpError: Se la finestra non può essere elencata
+        """
+        start, end = window
+        service = self._thread_service()
+        shard_query = f"{query} after:{start} before:{end}".strip()
+        
+        try:
+            if end - start > MIN_SHARD_SECONDS:
+                request = service.users().messages().list(userId='me', maxResults=1, q=shard_query)
+                estimate = self._execute(request, 'messages.list').get('resultSizeEstimate', 0)
+                if estimate > target_shard_size:
+                    parts = min(-(-estimate // target_shard_size), 8)
+                    step = max((end - start) // parts, MIN_SHARD_SECONDS // 2)
+                    return [], [(t, min(t + step, end)) for t in range(start, end, step)]
+            
+            messages = []
+            request = service.users().messages().list(userId='me', maxResults=500, q=shard_query)
+            while request is not None:
+                response = self._execute(request, 'messages.list')
+                messages.extend(response.get('messages', []))
+                request = service.users().messages().list_next(request, response)
+            return messages, []
+        
+        except HttpError as error:
+            print(f'Errore durante il recupero dei messaggi ({shard_query}): {error}')
+            raise
+    
+    def _close_executor(self):
+        """
+        Chiude il pool di thread usato per il recupero concorrente (e i servizi Gmail dei suoi thread)
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+            self._thread_local = threading.local()
+    
+    def close(self):
+        """
+        Chiude il pool di thread usato per il recupero concorrente e il pool di parsing
+        """
+        self._close_executor()
+        if self.parse_pool is not None:
+            self.parse_pool.close()
+    
+    def _parse_message(self, message: Dict) -> Dict:
+        """
+        Parsa un messaggio Gmail estraendo le informazioni principali
+        
+        Args:
+            message: Messaggio da Gmail API (format 'full' oppure 'raw')
+        
+        Returns:
+            Dizionario con i dati parsati del messaggio
+        """
+        if 'raw' in message:
+            raw = base64.urlsafe_b64decode(message['raw'])
+            self._archive_message(message, raw)
+            parsed = parse_raw_message(raw)
+        else:
+            parsed = parse_full_payload(message['payload'])
+        
+        return self._build_email(message, parsed)
+    
+    def _archive_message(self, message: Dict, raw: Optional[bytes] = None):
+        """
+        Salva nell'archivio raw un messaggio scaricato in formato 'raw' (se l'archivio è attivo)
+        """
+        if self.archive is None or 'raw' not in message:
+            return
+        if raw is None:
+            raw = base64.urlsafe_b64decode(message['raw'])
+        self.archive.put(message['id'], raw, message.get('threadId', ''),
+                         message.get('labelIds', []), message.get('snippet', ''))
+    
+    def _build_email(self, message: Dict, parsed: Dict) -> Dict:
+        """
+        Unisce i campi parsati (subject, from, to, date, body, headers) ai metadati del messaggio
+        """
         return {
             'id': message['id'],
             'thread_id': message['threadId'],
-            'subject': subject,
-            'from': sender,
-            'to': recipient,
-            'date': date,
-            'body': body,
+            'subject': parsed['subject'],
+            'from': parsed['from'],
+            'to': parsed['to'],
+            'date': parsed['date'],
+            'body': parsed['body'],
+            'headers': parsed.get('headers', {}),
             'snippet': message.get('snippet', ''),
-            'labels': message.get('labelIds', [])
+            'labels': message.get('labelIds', []),
+            'account': self.account_email
         }
     
-    def _get_message_body(self, payload: Dict) -> str:
+    def iter_email_pages(self, max_results: Optional[int] = None, query: str = '',
+                         page_size: int = 500, page_token: Optional[str] = None,
+                         fetch_mode: Optional[str] = None) -> Iterator[Tuple[List[Dict], Optional[str]]]:
+        """
+        Estrae le email una pagina alla volta, senza tenere in memoria l'intera mailbox
+        
+        Args:
+            max_results: Numero massimo di email da estrarre (None = tutte le email)
+            query: Query di ricerca Gmail
+            page_size: Email per pagina (massimo 500)
+            page_token: Token da cui riprendere l'estrazione (opzionale)
+            fetch_mode: Modalità di recupero dei dettagli (default: quella dell'estrattore)
+        
+        Yields:
+            Tuple (email parsate della pagina, token della pagina successiva o None)
+        """
+        pages = (
+            ([message['id'] for message in messages], next_page_token)
+            for messages, next_page_token in self.iter_message_pages(max_results, query, page_size, page_token)
+        )
+        yield from self.iter_details_pipelined(pages, fetch_mode)
+    
+    def iter_emails(self, max_results: Optional[int] = None, query: str = '',
+                    page_size: int = 500, fetch_mode: Optional[str] = None) -> Iterator[Dict]:
+        """
+        Estrae le email una alla volta (streaming)
+        
+        Args:
+            max_results: Numero massimo di email da estrarre (None = tutte le email)
+            query: Query di ricerca Gmail
+            page_size: Email scaricate per pagina
+            fetch_mode: Modalità di recupero dei dettagli (default: quella dell'estrattore)
+        
+        Yields:
+            Dizionari con i dettagli delle email
+        """
+        for emails, _ in self.iter_email_pages(max_results, query, page_size, fetch_mode=fetch_mode):
+            yield from emails
+    
+    def iter_email_pages_sharded(self, after: Optional[datetime] = None, before: Optional[datetime] = None,
+                                 query: str = '', page_size: int = 500,
+                                 fetch_mode: Optional[str] = None) -> Iterator[List[Dict]]:
         """
-        Estrae il corpo del messaggio dal payload
+        Estrae le email di un intervallo di date con listing parallelo per shard
         
         Args:
-            payload: Payload del messaggio
+            after: Inizio dell'intervallo (default: lancio di Gmail)
+            before: Fine dell'intervallo, esclusa (default: domani)
+            query: Query di ricerca Gmail aggiuntiva
+            page_size: Email per pagina
+            fetch_mode: Modalità di recupero dei dettagli (default: quella dell'estrattore)
+        
+        Yields:
+            Liste di email parsate, una pagina alla volta
+        """
+        messages = self.get_messages_sharded(after, before, query)
+        pages = (
+            ([message['id'] for message in messages[start:start + page_size]], None)
+            for start in range(0, len(messages), page_size)
+        )
+        for emails, _ in self.iter_details_pipelined(pages, fetch_mode):
+            yield emails
+    
+    def get_messages_details(self, message_ids: List[str], fetch_mode: Optional[str] = None) -> List[Dict]:
+        """
+        Recupera i dettagli dei messaggi scartando quelli non recuperabili
+        
+        Args:
+            message_ids: Lista degli ID dei messaggi da recuperare
+            fetch_mode: 'batch', 'threads' o 'sequential' (default: quella dell'estrattore)
         
         Returns:
-            Corpo del messaggio decodificato
+            Lista di dizionari con i dettagli dei messaggi, in ordine
         """
-        if 'parts' in payload:
-            # Messaggio multiparte
-            parts = payload['parts']
-            body = ''
-            
-            for part in parts:
-                if part['mimeType'] == 'text/plain':
-                    if 'data' in part['body']:
-                        body = base64.urlsafe_b64decode(
-                            part['body']['data']
-                        ).decode('utf-8')
-                        break
-                elif part['mimeType'] == 'text/html' and not body:
-                    if 'data' in part['body']:
-                        body = base64.urlsafe_b64decode(
-                            part['body']['data']
-                        ).decode('utf-8')
-            
-            return body
-        else:
-            # Messaggio semplice
-            if 'data' in payload['body']:
-                return base64.urlsafe_b64decode(
-                    payload['body']['data']
-                ).decode('utf-8')
+        return self.start_messages_details(message_ids, fetch_mode)()
+    
+    def start_messages_details(self, message_ids: List[str],
+                               fetch_mode: Optional[str] = None) -> Callable[[], List[Dict]]:
+        """
+        Scarica i messaggi e avvia il parsing, senza attenderne la fine
+        
+        Con il pool di parsing attivo i messaggi vengono scaricati a blocchi:
+        mentre i processi worker parsano un blocco si scarica il successivo.
+        
+        Args:
+            message_ids: Lista degli ID dei messaggi da recuperare
+            fetch_mode: 'batch', 'threads' o 'sequential' (default: quella dell'estrattore)
+        
+        Returns:
+            Funzione che attende il parsing e restituisce i dettagli, in ordine
+        """
+        # I messaggi già archiviati si leggono dal disco, senza chiamate a Gmail
+        archived = {}
+        if self.archive is not None and message_ids:
+            for message_id in self.archive.get_existing_ids(message_ids):
+                detail = self._get_archived_detail(message_id)
+                # I messaggi non leggibili vengono scaricati di nuovo e riarchiviati
+                if detail is not None:
+                    archived[message_id] = detail
+        to_fetch = [message_id for message_id in message_ids if message_id not in archived]
+        fetch_mode = fetch_mode or self.fetch_mode
         
-        return ''
+        if self.parse_pool is None:
+            if not to_fetch:
+                details = []
+            elif fetch_mode == 'batch':
+                details = self.get_messages_details_batch(to_fetch)
+            elif fetch_mode == 'threads':
+                details = self.get_messages_details_concurrent(to_fetch)
+            else:
+                details = [self.get_message_detail(message_id) for message_id in to_fetch]
+            return lambda: self._merge_details(message_ids, details, archived)
+        
+        # Un blocco corrisponde alle batch request inviate in parallelo
+        block_size = BATCH_SIZE * MAX_PARALLEL_BATCHES
+        jobs = []
+        for start in range(0, len(to_fetch), block_size):
+            messages = [message for message in self.fetch_messages(to_fetch[start:start + block_size], fetch_mode)
+                        if message]
+            jobs.append((messages, self.parse_pool.submit(messages)))
+        
+        def finish() -> List[Dict]:
+            details = []
+            for messages, job in jobs:
+                for message, parsed in zip(messages, job.result()):
+                    if parsed is None:
+                        print(f"⚠️  Impossibile parsare il messaggio {message['id']}")
+                        continue
+                    self._archive_message(message)
+                    details.append(self._build_email(message, parsed))
+            return self._merge_details(message_ids, details, archived)
+        
+        return finish
     
-    def extract_all_emails(self, max_results: Optional[int] = None, query: str = '') -> List[Dict]:
+    def fetch_messages(self, message_ids: List[str], fetch_mode: Optional[str] = None) -> List[Optional[Dict]]:
+        """
+        Scarica i messaggi (nel formato fetch_format) senza parsarli
+        
+        Args:
+            message_ids: Lista degli ID dei messaggi da recuperare
+            fetch_mode: 'batch', 'threads' o 'sequential' (default: quella dell'estrattore)
+        
+        Returns:
+            Messaggi dell'API Gmail nello stesso ordine di message_ids (None se non recuperabili)
+        """
+        fetch_mode = fetch_mode or self.fetch_mode
+        if fetch_mode == 'batch':
+            return self._fetch_messages_batch(message_ids, BATCH_SIZE, MAX_PARALLEL_BATCHES)
+        if fetch_mode == 'threads':
+            return self._fetch_messages_concurrent(message_ids)
+        return [self._fetch_message(message_id) for message_id in message_ids]
+    
+    def iter_details_pipelined(self, pages: Iterator[Tuple[List[str], Any]],
+                               fetch_mode: Optional[str] = None) -> Iterator[Tuple[List[Dict], Any]]:
+        """
+        Recupera i dettagli di una sequenza di pagine di ID
+        
+        Con il pool di parsing attivo la pagina successiva viene scaricata
+        mentre i worker parsano quella corrente.
+        
+        Args:
+            pages: Tuple (ID dei messaggi, dato associato alla pagina, es. il page token)
+            fetch_mode: Modalità di recupero dei dettagli (default: quella dell'estrattore)
+        
+        Yields:
+            Tuple (email parsate della pagina, dato associato alla pagina), in ordine
+        """
+        if self.parse_pool is None:
+            for ids, tag in pages:
+                yield self.get_messages_details(ids, fetch_mode), tag
+            return
+        
+        pending = None
+        for ids, tag in pages:
+            finish = self.start_messages_details(ids, fetch_mode)
+            if pending is not None:
+                yield pending[0](), pending[1]
+            pending = (finish, tag)
+        if pending is not None:
+            yield pending[0](), pending[1]
+    
+    @staticmethod
+    def _merge_details(message_ids: List[str], details: List[Optional[Dict]], archived: Dict[str, Dict]) -> List[Dict]:
+        """
+        Unisce i messaggi scaricati e quelli archiviati nell'ordine di message_ids
+        """
+        if archived:
+            fetched = {detail['id']: detail for detail in details if detail}
+            details = [archived.get(message_id) or fetched.get(message_id) for message_id in message_ids]
+        return [detail for detail in details if detail]
+    
+    def _get_archived_detail(self, message_id: str) -> Optional[Dict]:
+        """
+        Parsa un messaggio dall'archivio raw locale
+        
+        Args:
+            message_id: ID del messaggio archiviato
+        
+        Returns:
+            Dizionario con i dettagli del messaggio, None se non leggibile
+        """
+        try:
+            entry = self.archive.get_metadata(message_id)
+            parsed = parse_raw_message(self.archive.get(message_id))
+        except Exception as e:
+            print(f"⚠️  Messaggio {message_id} non leggibile dall'archivio, verrà scaricato di nuovo: {e}")
+            try:
+                self.archive.discard(message_id)
+            except Exception as discard_error:
+                print(f"⚠️  Impossibile rimuovere il messaggio {message_id} dall'archivio: {discard_error}")
+            return None
+        
+        parsed.update({
+            'id': message_id,
+            'thread_id': entry['thread_id'] or '',
+            'snippet': entry['snippet'] or '',
+            'labels': entry['labels'],
+            'account': self.account_email
+        })
+        return parsed
+    
+    def extract_all_emails(self, max_results: Optional[int] = None, query: str = '',
+                           fetch_mode: Optional[str] = None, after: Optional[datetime] = None,
+                           before: Optional[datetime] = None) -> List[Dict]:
         """
         Estrae tutte le email con i loro dettagli completi
         
+        Per mailbox grandi preferire iter_email_pages(), che non tiene in
+        memoria tutte le email.
+        
         Args:
             max_results: Numero massimo di email da estrarre (None = tutte le email)
             query: Query di ricerca Gmail (es: 'is:unread', 'from:example@gmail.com')
+            fetch_mode: Modalità di recupero dei dettagli (default: quella dell'estrattore)
+            after: Se specificato (con o senza before), estrae solo l'intervallo di date
+                con listing parallelo per shard (max_results viene ignorato)
+            before: Fine dell'intervallo di date, esclusa
         
         Returns:
             Lista di dizionari con tutti i dettagli delle email
@@ -249,23 +1034,29 @@ class GmailExtractor:
         else:
             print(f"Inizio estrazione di massimo {max_results} email...")
         
-        # Recupera la lista dei messaggi
-        messages = self.get_messages(max_results=max_results, query=query)
+        if after or before:
+            pages = self.iter_email_pages_sharded(after, before, query, fetch_mode=fetch_mode)
+        else:
+            pages = (page for page, _ in self.iter_email_pages(max_results, query, fetch_mode=fetch_mode))
         
-        # Recupera i dettagli di ogni messaggio
         emails = []
-        total = len(messages)
-        
-        for idx, message in enumerate(messages, 1):
-            print(f"Estrazione email {idx}/{total}...", end='\r')
-            
-            email_detail = self.get_message_detail(message['id'])
-            if email_detail:
-                emails.append(email_detail)
+        for page in pages:
+            emails.extend(page)
+            print(f"Estrazione email {len(emails)}...", end='\r')
         
         print(f"\nEstrazione completata! Totale email estratte: {len(emails)}")
+        self.print_quota_stats()
         return emails
     
+    def print_quota_stats(self):
+        """
+        Mostra le quota unit consumate e la velocità ottenuta
+        """
+        stats = self.rate_limiter.get_stats()
+        print(f"📈 Quota Gmail: {stats['units_consumed']} unit in {stats['elapsed_seconds']}s "
+              f"({stats['units_per_second']} unit/s, limite attuale {stats['current_rate']}/{stats['max_rate']}, "
+              f"rate limit: {stats['rate_limited']}, retry: {stats['retries']})")
+    
     def get_labels(self) -> List[Dict]:
         """
         Recupera tutte le etichette (labels) dell'account
@@ -274,7 +1065,9 @@ class GmailExtractor:
             Lista delle etichette disponibili
         """
         try:
-            results = self.service.users().labels().list(userId='me').execute()
+            results = self._execute(
+                self.service.users().labels().list(userId='me'), 'labels.list'
+            )
             labels = results.get('labels', [])
             return labels
         except HttpError as error:
@@ -289,7 +1082,11 @@ class GmailExtractor:
             Dizionario con le informazioni del profilo
         """
         try:
-            profile = self.service.users().getProfile(userId='me').execute()
+            profile = self._execute(
+                self.service.users().getProfile(userId='me'), 'users.getProfile'
+            )
+            # Le email estratte vengono associate all'account
+            self.account_email = profile.get('emailAddress', '')
             return profile
         except HttpError as error:
             print(f'Errore durante il recupero del profilo: {error}')
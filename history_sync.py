@@ -0,0 +1,108 @@
+"""
+Sincronizzazione incrementale delle nuove email tramite Gmail History API
+"""
+
+import os
+from typing import List, Optional
+from googleapiclient.errors import HttpError
+from gmail_extractor import GmailExtractor
+from database import EmailDatabase
+from dotenv import load_dotenv
+
+# Carica variabili d'ambiente
+load_dotenv()
+
+
+# Numero massimo di messaggi recenti controllati durante una risincronizzazione completa
+RESYNC_MAX_RESULTS = int(os.getenv('RESYNC_MAX_RESULTS', 500))
+
+
+class HistorySync:
+    """
+    Individua le nuove email a partire dall'ultimo historyId salvato per l'account
+    """
+    
+    def __init__(self, extractor: GmailExtractor, db: EmailDatabase,
+                 resync_max_results: int = RESYNC_MAX_RESULTS):
+        """
+        Inizializza la sincronizzazione incrementale
+        
+        Args:
+            extractor: GmailExtractor già autenticato
+            db: Database in cui sono salvati i checkpoint
+            resync_max_results: Messaggi controllati in caso di risincronizzazione completa
+        """
+        self.extractor = extractor
+        self.db = db
+        self.resync_max_results = resync_max_results
+        self.account = None
+        self.pending_history_id = None
+    
+    def get_new_message_ids(self) -> Optional[List[str]]:
+        """
+        Recupera gli ID dei messaggi arrivati dopo l'ultimo checkpoint
+        
+        Il nuovo checkpoint non viene salvato finché non si chiama commit(),
+        così un ciclo fallito viene ripetuto al controllo successivo.
+        
+        Returns:
+            Lista degli ID dei nuovi messaggi non ancora nel database,
+            None se non è stato possibile sincronizzare
+        """
+        if self.account is None:
+            profile = self.extractor.get_profile()
+            if not profile:
+                return None
+            self.account = profile['emailAddress']
+        
+        # Un checkpoint di un ciclo precedente non completato non va salvato con questo
+        self.pending_history_id = None
+        start_history_id = self.db.get_history_id(self.account)
+        
+        if start_history_id:
+            changes = self.extractor.get_history_changes(start_history_id)
+            if changes is None:
+                return None
+            if not changes['expired']:
+                self.pending_history_id = changes['history_id']
+                return self._filter_new(changes['message_ids'])
+            print("⚠️  Checkpoint historyId scaduto, risincronizzazione completa...")
+        else:
+            print("ℹ️  Nessun checkpoint historyId, sincronizzazione iniziale...")
+        
+        return self._full_resync()
+    
+    def commit(self):
+        """
+        Salva il checkpoint dopo che i nuovi messaggi sono stati processati
+        """
+        if self.account and self.pending_history_id:
+            self.db.save_history_id(self.account, self.pending_history_id)
+            self.pending_history_id = None
+    
+    def _full_resync(self) -> Optional[List[str]]:
+        """
+        Risincronizzazione limitata agli ultimi messaggi della mailbox
+        """
+        # Il historyId va letto prima della lista per non perdere messaggi intermedi
+        profile = self.extractor.get_profile()
+        if not profile:
+            return None
+        
+        try:
+            messages = self.extractor.get_messages(max_results=self.resync_max_results, strict=True)
+        except HttpError:
+            # Una lista parziale farebbe avanzare il checkpoint oltre i messaggi mancanti
+            return None
+        self.pending_history_id = profile['historyId']
+        
+        # messages.list restituisce i più recenti per primi
+        message_ids = [message['id'] for message in reversed(messages)]
+        return self._filter_new(message_ids)
+    
+    def _filter_new(self, message_ids: List[str]) -> List[str]:
+        """
+        Esclude i messaggi già presenti nel database
+        """
+        existing = self.db.get_existing_email_ids(message_ids)
+        return [message_id for message_id in message_ids if message_id not in existing]
@@ -0,0 +1,222 @@
+"""
+Backend dei modelli linguistici: client, modello per attività, retry e registro delle chiamate
+EmailAnalyzer e SwipeGenerator passano da qui invece di creare ciascuno il proprio client
+
+LLM_BACKEND=openai usa l'API OpenAI (o l'endpoint compatibile OPENAI_BASE_URL),
+LLM_BACKEND=mock avvia in locale mock_openai_server: pipeline e benchmark senza rete né costi
+"""
+
+import os
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, List, Optional
+from openai import OpenAI, AsyncOpenAI
+from llm_ledger import LLMLedger
+from llm_resilience import RetryPolicy
+from dotenv import load_dotenv
+
+# Carica variabili d'ambiente
+load_dotenv()
+
+
+# Backend usato se non indicato: openai o mock
+LLM_BACKEND = os.getenv('LLM_BACKEND', 'openai').lower()
+
+# Endpoint compatibile OpenAI (es. server locale di test), vuoto = API OpenAI
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL') or None
+
+# Modello per attività (LLM_MODEL_<ATTIVITÀ> nel .env)
+TASK_MODELS = {
+    'analysis': os.getenv('LLM_MODEL_ANALYSIS', 'gpt-4o-mini'),
+    'swipe': os.getenv('LLM_MODEL_SWIPE', 'gpt-4o')
+}
+
+# Attività che usano il modello di un'altra: stesso prompt di base, stessa cache
+TASK_ALIASES = {
+    'analysis_packed': 'analysis',
+    'analysis_batch': 'analysis',
+    'reanalysis': 'analysis'
+}
+
+
+def model_for(task: str) -> str:
+    """
+    Modello configurato per un'attività
+    
+    Args:
+        task: Attività (analysis, analysis_packed, reanalysis, swipe, ...)
+    
+    Returns:
+        Nome del modello
+    
+    Raises:
+        KeyError: Se l'attività non ha un modello configurato
+    """
+    return TASK_MODELS[TASK_ALIASES.get(task, task)]
+
+
+class LLMBackend(ABC):
+    """
+    Interfaccia comune dei backend: le sottoclassi forniscono i client,
+    la classe base aggiunge modello per attività, retry e registro delle chiamate
+    """
+    
+    name = 'base'
+    
+    def __init__(self, ledger: Optional[LLMLedger] = None, retry_policy: Optional[RetryPolicy] = None):
+        """
+        Args:
+            ledger: Registro delle chiamate (None = non registrate)
+            retry_policy: Retry con backoff e circuit breaker (default: RetryPolicy())
+        """
+        self.ledger = ledger
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+    
+    @abstractmethod
+    def create_function(self) -> Callable[..., Any]:
+        """
+        Funzione sincrona chat.completions.create del backend
+        """
+    
+    @abstractmethod
+    def async_session(self):
+        """
+        Client asincrono da usare come context manager per un batch di chiamate
+        """
+    
+    def provider_name(self, model: str) -> str:
+        """
+        Nome leggibile di fornitore e modello (es. per la UI)
+        """
+        return f"{self.name} {model}"
+    
+    def _params(self, params: Dict, task: str) -> Dict:
+        if 'model' in params:
+            return params
+        return {**params, 'model': model_for(task)}
+    
+    def complete(self, params: Dict, task: str, email: Optional[Dict] = None, emails_count: int = 1,
+                 emails: Optional[List[Dict]] = None):
+        """
+        Chiamata chat.completions sincrona con retry, registrata nel ledger se attivo
+        
+        Args:
+            params: Parametri della chiamata (senza 'model' usa il modello dell'attività)
+            task: Attività da registrare
+            email: Email a cui si riferisce la chiamata
+            emails_count: Email incluse nella richiesta
+            emails: Email di una richiesta impacchettata (token ripartiti tra i mittenti nel ledger)
+        
+        Returns:
+            Risposta chat.completions
+        """
+        params = self._params(params, task)
+        create = self.create_function()
+        
+        def attempt_call(attempt: int):
+            if self.ledger is None:
+                return create(**params)
+            return self.ledger.call(create, params, task, email, emails_count, attempt, emails)
+        
+        return self.retry_policy.call(attempt_call)
+    
+    async def acomplete(self, session, params: Dict, task: str, email: Optional[Dict] = None,
+                        emails_count: int = 1, queued: float = 0.0, emails: Optional[List[Dict]] = None):
+        """
+        Come complete(), con il client asincrono di async_session()
+        
+        Args:
+            queued: Secondi attesi per il budget RPM/TPM (distingue i nostri limiti da quelli del fornitore)
+        """
+        params = self._params(params, task)
+        create = session.chat.completions.create
+        
+        async def attempt_call(attempt: int):
+            if self.ledger is None:
+                return await create(**params)
+            # L'attesa per il budget riguarda solo il primo tentativo
+            return await self.ledger.acall(create, params, task, email, emails_count,
+                                           queued if attempt == 1 else 0.0, attempt, emails)
+        
+        return await self.retry_policy.acall(attempt_call)
+    
+    def close(self):
+        """
+        Rilascia le risorse del backend
+        """
+
+
+class OpenAIBackend(LLMBackend):
+    """
+    API OpenAI o qualunque endpoint compatibile con chat/completions, files e batches
+    """
+    
+    name = 'OpenAI'
+    
+    def __init__(self, api_key: str, base_url: Optional[str] = OPENAI_BASE_URL,
+                 ledger: Optional[LLMLedger] = None, retry_policy: Optional[RetryPolicy] = None):
+        """
+        Args:
+            api_key: Chiave API
+            base_url: Endpoint compatibile OpenAI (default: API OpenAI)
+        """
+        super().__init__(ledger, retry_policy)
+        self.api_key = api_key
+        self.base_url = base_url
+        # I retry sono gestiti da retry_policy, non dal client
+        self.client = OpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+    
+    def create_function(self) -> Callable[..., Any]:
+        return self.client.chat.completions.create
+    
+    def async_session(self) -> AsyncOpenAI:
+        return AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, max_retries=0)
+    
+    def provider_name(self, model: str) -> str:
+        # Es. "OpenAI GPT-4o"
+        return f"{self.name} {model.replace('gpt', 'GPT')}"
+
+
+class MockBackend(OpenAIBackend):
+    """
+    Server locale mock_openai_server avviato in background (latenza, errori e risposte da .env)
+    """
+    
+    name = 'Mock'
+    
+    def __init__(self, ledger: Optional[LLMLedger] = None, retry_policy: Optional[RetryPolicy] = None,
+                 state=None):
+        """
+        Args:
+            state: MockOpenAIState con latenza, errori e risposte (default: configurazione da .env)
+        """
+        from mock_openai_server import start_server
+        self.server = start_server(state=state)
+        super().__init__('sk-mock', f"http://127.0.0.1:{self.server.server_port}/v1", ledger, retry_policy)
+    
+    def close(self):
+        self.server.shutdown()
+
+
+def create_backend(api_key: Optional[str] = None, name: str = LLM_BACKEND, base_url: Optional[str] = OPENAI_BASE_URL,
+                   ledger: Optional[LLMLedger] = None, retry_policy: Optional[RetryPolicy] = None) -> LLMBackend:
+    """
+    Crea il backend configurato
+    
+    Args:
+        api_key: Chiave API (ignorata dal backend mock)
+        name: openai o mock
+        base_url: Endpoint compatibile OpenAI
+        ledger: Registro delle chiamate
+        retry_policy: Retry con backoff e circuit breaker
+    
+    Returns:
+        Backend pronto all'uso
+    
+    Raises:
+        ValueError: Se il backend non esiste
+    """
+    if name == 'mock':
+        return MockBackend(ledger, retry_policy)
+    if name == 'openai':
+        return OpenAIBackend(api_key, base_url, ledger, retry_policy)
+    raise ValueError(f"Backend LLM sconosciuto: {name} (disponibili: openai, mock)")
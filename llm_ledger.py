@@ -0,0 +1,399 @@
+"""
+Registro locale delle chiamate ai modelli: token, costo stimato, latenza ed esito
+Ogni chiamata chat.completions di EmailAnalyzer e SwipeGenerator viene salvata in SQLite
+
+Uso: python llm_ledger.py [report|hours|senders] [N]
+"""
+
+import os
+import sys
+import time
+import sqlite3
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from analysis_cache import normalize_sender
+from dotenv import load_dotenv
+
+# Carica variabili d'ambiente
+load_dotenv()
+
+
+# Database del registro (vuoto = registro disattivato)
+LLM_LEDGER_DB = os.getenv('LLM_LEDGER_DB', 'llm_ledger.db')
+
+# Prezzi in dollari per milione di token: (input, input in cache, output)
+MODEL_PRICES = {
+    'gpt-4o-mini': (0.15, 0.075, 0.60),
+    'gpt-4o': (2.50, 1.25, 10.00),
+    'gpt-4.1-mini': (0.40, 0.10, 1.60),
+    'gpt-4.1': (2.00, 0.50, 8.00)
+}
+
+# Sconto della Batch API sul prezzo standard
+BATCH_DISCOUNT = 0.5
+
+
+def usage_fields(usage: Any) -> Tuple[int, int, int]:
+    """
+    Token di prompt, risposta e prompt in cache da un oggetto usage (SDK o dizionario JSON)
+    
+    Returns:
+        Tuple (prompt_tokens, completion_tokens, cached_tokens)
+    """
+    if usage is None:
+        return 0, 0, 0
+    if isinstance(usage, dict):
+        details = usage.get('prompt_tokens_details') or {}
+        return usage.get('prompt_tokens') or 0, usage.get('completion_tokens') or 0, details.get('cached_tokens') or 0
+    details = getattr(usage, 'prompt_tokens_details', None)
+    cached = getattr(details, 'cached_tokens', 0) if details is not None else 0
+    return usage.prompt_tokens or 0, usage.completion_tokens or 0, cached or 0
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0,
+                  batch: bool = False) -> float:
+    """
+    Costo stimato di una chiamata in dollari (0 per modelli senza prezzo noto)
+    
+    Args:
+        model: Nome del modello (le versioni datate usano il prezzo del modello base)
+        prompt_tokens: Token di input, inclusi quelli in cache
+        completion_tokens: Token di output
+        cached_tokens: Token di input serviti dalla cache del prompt
+        batch: True per le richieste della Batch API
+    
+    Returns:
+        Costo in dollari
+    """
+    prices = MODEL_PRICES.get(model)
+    if prices is None:
+        # Es. gpt-4o-mini-2024-07-18 -> gpt-4o-mini
+        base = max((name for name in MODEL_PRICES if model.startswith(name)), key=len, default=None)
+        prices = MODEL_PRICES.get(base)
+    if prices is None:
+        return 0.0
+    
+    input_price, cached_price, output_price = prices
+    cost = ((prompt_tokens - cached_tokens) * input_price + cached_tokens * cached_price
+            + completion_tokens * output_price) / 1_000_000
+    return cost * BATCH_DISCOUNT if batch else cost
+
+
+class LLMLedger:
+    """
+    Registro SQLite delle chiamate ai modelli, con riepiloghi per ora, mittente e attività
+    """
+    
+    def __init__(self, db_path: str = LLM_LEDGER_DB):
+        """
+        Inizializza il registro
+        
+        Args:
+            db_path: Path del database SQLite
+        """
+        self.db_path = db_path
+        self._create_tables()
+    
+    def _create_tables(self):
+        """
+        Crea la tabella delle chiamate se non esiste
+        """
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS llm_calls (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                task TEXT,
+                model TEXT,
+                email_id TEXT,
+                sender TEXT,
+                emails_count INTEGER DEFAULT 1,
+                prompt_tokens INTEGER DEFAULT 0,
+                completion_tokens INTEGER DEFAULT 0,
+                cached_tokens INTEGER DEFAULT 0,
+                latency_ms REAL,
+                queued_ms REAL DEFAULT 0,
+                status TEXT,
+                error TEXT,
+                attempt INTEGER DEFAULT 1,
+                cost_usd REAL DEFAULT 0
+            )
+        ''')
+        # Email di una richiesta impacchettata: token e costo ripartiti in parti uguali
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS llm_call_emails (
+                call_id INTEGER,
+                email_id TEXT,
+                sender TEXT,
+                prompt_tokens REAL DEFAULT 0,
+                completion_tokens REAL DEFAULT 0,
+                cost_usd REAL DEFAULT 0
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_llm_calls_created ON llm_calls(created_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_llm_calls_sender ON llm_calls(sender)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_llm_call_emails_sender ON llm_call_emails(sender)')
+        conn.commit()
+        conn.close()
+    
+    def record(self, task: str, model: str, usage: Any = None, latency: Optional[float] = None,
+               status: str = 'ok', error: str = '', email: Optional[Dict] = None, emails_count: int = 1,
+               queued: float = 0.0, attempt: int = 1, batch: bool = False, emails: Optional[List[Dict]] = None):
+        """
+        Salva una chiamata nel registro
+        
+        Args:
+            task: Attività ('analysis', 'analysis_packed', 'analysis_batch', 'swipe', ...)
+            model: Modello chiamato
+            usage: Oggetto usage della risposta (None se la chiamata è fallita)
+            latency: Durata della chiamata in secondi
+            status: 'ok' oppure 'error'
+            error: Messaggio di errore
+            email: Email analizzata (per email_id e mittente)
+            emails_count: Email incluse nella richiesta (pacchetti)
+            queued: Secondi di attesa del budget RPM/TPM prima della chiamata
+            attempt: Numero del tentativo
+            batch: True per le richieste della Batch API
+            emails: Email di una richiesta impacchettata (una riga ciascuna in llm_call_emails)
+        """
+        prompt_tokens, completion_tokens, cached_tokens = usage_fields(usage)
+        cost = estimate_cost(model, prompt_tokens, completion_tokens, cached_tokens, batch)
+        email = email or {}
+        if emails:
+            emails_count = len(emails)
+        try:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO llm_calls (
+                    task, model, email_id, sender, emails_count, prompt_tokens, completion_tokens,
+                    cached_tokens, latency_ms, queued_ms, status, error, attempt, cost_usd
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                task,
+                model,
+                email.get('id', email.get('email_id', '')),
+                normalize_sender(email.get('from', email.get('sender', ''))),
+                emails_count,
+                prompt_tokens,
+                completion_tokens,
+                cached_tokens,
+                latency * 1000 if latency is not None else None,
+                queued * 1000,
+                status,
+                error[:500],
+                attempt,
+                cost
+            ))
+            if emails:
+                call_id = cursor.lastrowid
+                cursor.executemany('''
+                    INSERT INTO llm_call_emails (call_id, email_id, sender, prompt_tokens, completion_tokens, cost_usd)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', [(
+                    call_id,
+                    packed.get('id', packed.get('email_id', '')),
+                    normalize_sender(packed.get('from', packed.get('sender', ''))),
+                    prompt_tokens / len(emails),
+                    completion_tokens / len(emails),
+                    cost / len(emails)
+                ) for packed in emails])
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            print(f"⚠️  Errore nella scrittura del registro LLM: {e}")
+    
+    def call(self, create: Callable[..., Any], params: Dict, task: str, email: Optional[Dict] = None,
+             emails_count: int = 1, attempt: int = 1, emails: Optional[List[Dict]] = None):
+        """
+        Esegue una chiamata sincrona e la registra (anche se fallisce)
+        
+        Args:
+            create: Funzione da chiamare (es. client.chat.completions.create)
+            params: Parametri della chiamata (deve contenere 'model')
+            task: Attività da registrare
+            email: Email a cui si riferisce la chiamata
+            emails_count: Email incluse nella richiesta
+            attempt: Numero del tentativo
+            emails: Email di una richiesta impacchettata
+        
+        Returns:
+            Risposta della chiamata
+        """
+        started = time.perf_counter()
+        try:
+            response = create(**params)
+        except Exception as e:
+            self.record(task, params.get('model', ''), None, time.perf_counter() - started, 'error', str(e),
+                        email, emails_count, attempt=attempt, emails=emails)
+            raise
+        self.record(task, params.get('model', ''), response.usage, time.perf_counter() - started, 'ok', '',
+                    email, emails_count, attempt=attempt, emails=emails)
+        return response
+    
+    async def acall(self, create: Callable[..., Awaitable[Any]], params: Dict, task: str,
+                    email: Optional[Dict] = None, emails_count: int = 1, queued: float = 0.0, attempt: int = 1,
+                    emails: Optional[List[Dict]] = None):
+        """
+        Come call(), per i client asincroni
+        
+        Args:
+            queued: Secondi già attesi per il budget RPM/TPM
+        """
+        started = time.perf_counter()
+        try:
+            response = await create(**params)
+        except Exception as e:
+            self.record(task, params.get('model', ''), None, time.perf_counter() - started, 'error', str(e),
+                        email, emails_count, queued, attempt, emails=emails)
+            raise
+        self.record(task, params.get('model', ''), response.usage, time.perf_counter() - started, 'ok', '',
+                    email, emails_count, queued, attempt, emails=emails)
+        return response
+    
+    def _query(self, sql: str, params: tuple = ()) -> List[Dict]:
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        cursor.execute(sql, params)
+        rows = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        return rows
+    
+    def get_summary(self) -> Dict:
+        """
+        Totali del registro
+        
+        Returns:
+            Dizionario con chiamate, errori, token, costo e latenze medie
+        """
+        rows = self._query('''
+            SELECT COUNT(*) AS calls,
+                   SUM(status != 'ok') AS errors,
+                   SUM(emails_count) AS emails,
+                   SUM(prompt_tokens) AS prompt_tokens,
+                   SUM(completion_tokens) AS completion_tokens,
+                   SUM(cached_tokens) AS cached_tokens,
+                   SUM(cost_usd) AS cost_usd,
+                   AVG(latency_ms) AS avg_latency_ms,
+                   AVG(queued_ms) AS avg_queued_ms
+            FROM llm_calls
+        ''')
+        return {key: value or 0 for key, value in rows[0].items()}
+    
+    def hourly_rollup(self, hours: int = 24) -> List[Dict]:
+        """
+        Riepilogo per ora delle ultime `hours` ore
+        
+        La latenza media misura OpenAI, l'attesa media il nostro limitatore RPM/TPM.
+        """
+        return self._query('''
+            SELECT strftime('%Y-%m-%d %H:00', created_at) AS hour,
+                   COUNT(*) AS calls,
+                   SUM(status != 'ok') AS errors,
+                   SUM(prompt_tokens + completion_tokens) AS tokens,
+                   SUM(cost_usd) AS cost_usd,
+                   AVG(latency_ms) AS avg_latency_ms,
+                   AVG(queued_ms) AS avg_queued_ms
+            FROM llm_calls
+            WHERE created_at >= datetime('now', ?)
+            GROUP BY hour
+            ORDER BY hour
+        ''', (f'-{int(hours)} hours',))
+    
+    def sender_rollup(self, limit: int = 20) -> List[Dict]:
+        """
+        Mittenti più costosi da analizzare
+        
+        Le email delle richieste impacchettate contano con la loro quota di token e costo.
+        """
+        return self._query('''
+            SELECT sender,
+                   COUNT(*) AS calls,
+                   SUM(prompt_tokens) AS prompt_tokens,
+                   SUM(completion_tokens) AS completion_tokens,
+                   SUM(cost_usd) AS cost_usd,
+                   AVG(prompt_tokens) AS avg_prompt_tokens
+            FROM (
+                SELECT sender, prompt_tokens, completion_tokens, cost_usd FROM llm_calls
+                UNION ALL
+                SELECT sender, prompt_tokens, completion_tokens, cost_usd FROM llm_call_emails
+            )
+            WHERE sender != ''
+            GROUP BY sender
+            ORDER BY cost_usd DESC
+            LIMIT ?
+        ''', (limit,))
+    
+    def task_rollup(self) -> List[Dict]:
+        """
+        Riepilogo per attività e modello
+        """
+        return self._query('''
+            SELECT task, model,
+                   COUNT(*) AS calls,
+                   SUM(emails_count) AS emails,
+                   SUM(prompt_tokens + completion_tokens) AS tokens,
+                   SUM(cost_usd) AS cost_usd,
+                   AVG(latency_ms) AS avg_latency_ms
+            FROM llm_calls
+            GROUP BY task, model
+            ORDER BY cost_usd DESC
+        ''')
+
+
+def print_report(ledger: LLMLedger):
+    """
+    Stampa totali e riepilogo per attività
+    """
+    summary = ledger.get_summary()
+    print("\n" + "="*80)
+    print("📒 REGISTRO CHIAMATE LLM")
+    print("="*80)
+    print(f"Chiamate: {summary['calls']} (errori: {summary['errors']}), email: {summary['emails']}")
+    print(f"Token: {summary['prompt_tokens']} prompt ({summary['cached_tokens']} in cache), "
+          f"{summary['completion_tokens']} risposta")
+    print(f"Costo stimato: ${summary['cost_usd']:.4f}")
+    print(f"Latenza media: {summary['avg_latency_ms']:.0f} ms, attesa media budget: {summary['avg_queued_ms']:.0f} ms")
+    
+    print(f"\n{'Attività':<18} {'Modello':<14} {'Chiamate':>9} {'Email':>7} {'Token':>10} {'Costo $':>10} {'Lat. ms':>8}")
+    for row in ledger.task_rollup():
+        print(f"{row['task']:<18} {row['model']:<14} {row['calls']:>9} {row['emails']:>7} {row['tokens']:>10} "
+              f"{row['cost_usd']:>10.4f} {row['avg_latency_ms'] or 0:>8.0f}")
+
+
+def print_hours(ledger: LLMLedger, hours: int):
+    """
+    Stampa il riepilogo orario
+    """
+    print(f"\n{'Ora':<17} {'Chiamate':>9} {'Errori':>7} {'Token':>10} {'Costo $':>10} {'Lat. ms':>8} {'Attesa ms':>10}")
+    for row in ledger.hourly_rollup(hours):
+        print(f"{row['hour']:<17} {row['calls']:>9} {row['errors']:>7} {row['tokens']:>10} {row['cost_usd']:>10.4f} "
+              f"{row['avg_latency_ms'] or 0:>8.0f} {row['avg_queued_ms'] or 0:>10.0f}")
+
+
+def print_senders(ledger: LLMLedger, limit: int):
+    """
+    Stampa i mittenti più costosi
+    """
+    print(f"\n{'Mittente':<40} {'Chiamate':>9} {'Prompt medio':>13} {'Costo $':>10}")
+    for row in ledger.sender_rollup(limit):
+        print(f"{row['sender'][:40]:<40} {row['calls']:>9} {row['avg_prompt_tokens']:>13.0f} {row['cost_usd']:>10.4f}")
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else 'report'
+    ledger = LLMLedger(LLM_LEDGER_DB or 'llm_ledger.db')
+    
+    if command == 'report':
+        print_report(ledger)
+    elif command == 'hours':
+        print_hours(ledger, int(sys.argv[2]) if len(sys.argv) > 2 else 24)
+    elif command == 'senders':
+        print_senders(ledger, int(sys.argv[2]) if len(sys.argv) > 2 else 20)
+    else:
+        print(__doc__.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    main()
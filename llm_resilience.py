@@ -0,0 +1,507 @@
+"""
+Resilienza delle chiamate OpenAI: retry con backoff esponenziale e jitter (rispettando
+Retry-After), circuit breaker e coda persistente delle analisi fallite
+
+Uso: python llm_resilience.py [stats] [emails.db]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from openai import APIConnectionError, APIStatusError
+from dotenv import load_dotenv
+
+# Carica variabili d'ambiente
+load_dotenv()
+
+
+# Retry di una singola chiamata: tentativi massimi e attese del backoff in secondi
+OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', 4))
+OPENAI_RETRY_BASE_DELAY = float(os.getenv('OPENAI_RETRY_BASE_DELAY', 1))
+OPENAI_RETRY_MAX_DELAY = float(os.getenv('OPENAI_RETRY_MAX_DELAY', 60))
+
+# Circuit breaker: errori consecutivi che lo aprono e secondi prima di una chiamata di prova
+OPENAI_BREAKER_FAILURES = int(os.getenv('OPENAI_BREAKER_FAILURES', 5))
+OPENAI_BREAKER_COOLDOWN = float(os.getenv('OPENAI_BREAKER_COOLDOWN', 60))
+
+# Chiamate interattive (swipe dalla web app): pochi retry brevi, nessuna attesa del circuit breaker
+OPENAI_INTERACTIVE_MAX_RETRIES = int(os.getenv('OPENAI_INTERACTIVE_MAX_RETRIES', 1))
+OPENAI_INTERACTIVE_MAX_DELAY = float(os.getenv('OPENAI_INTERACTIVE_MAX_DELAY', 5))
+
+# Secondi tra un controllo e l'altro mentre è in corso la chiamata di prova del circuit breaker
+BREAKER_POLL_SECONDS = 1.0
+
+# Coda delle analisi fallite (vuoto = disattivata), tentativi massimi per email
+# e minuti tra uno svuotamento automatico e il successivo nei monitor
+ANALYSIS_RETRY_DB = os.getenv('ANALYSIS_RETRY_DB', 'emails.db')
+ANALYSIS_RETRY_MAX_ATTEMPTS = int(os.getenv('ANALYSIS_RETRY_MAX_ATTEMPTS', 8))
+ANALYSIS_RETRY_DRAIN_MINUTES = int(os.getenv('ANALYSIS_RETRY_DRAIN_MINUTES', 5))
+
+# Attesa massima tra due tentativi della coda (minuti)
+RETRY_QUEUE_MAX_MINUTES = 360
+
+# Status HTTP per cui ha senso ripetere la richiesta
+RETRYABLE_STATUSES = (408, 409, 429)
+
+
+class CircuitOpenError(Exception):
+    """
+    Chiamata rifiutata perché il circuit breaker è aperto
+    """
+
+
+def error_status(error: Exception) -> Optional[int]:
+    """
+    Status HTTP di un errore OpenAI (None per errori di connessione o non HTTP)
+    """
+    return error.status_code if isinstance(error, APIStatusError) else None
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    True se l'errore indica un problema temporaneo del servizio (429, 5xx, timeout, connessione)
+    
+    Un 429 per credito esaurito (insufficient_quota) non è temporaneo.
+    """
+    if isinstance(error, APIConnectionError):
+        return True
+    status = error_status(error)
+    if status is None:
+        return False
+    if status == 429 and getattr(error, 'code', None) == 'insufficient_quota':
+        return False
+    return status in RETRYABLE_STATUSES or status >= 500
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """
+    Secondi di attesa indicati dal server negli header retry-after-ms o Retry-After
+    
+    Returns:
+        Secondi da attendere, None se il server non li indica
+    """
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    
+    try:
+        if headers.get('retry-after-ms'):
+            return max(float(headers['retry-after-ms']) / 1000, 0.0)
+    except ValueError:
+        pass
+    
+    value = headers.get('retry-after')
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        # Formato data HTTP (es. "Wed, 21 Oct 2015 07:28:00 GMT")
+        return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """
+    Interrompe le chiamate dopo troppi errori consecutivi del servizio
+    
+    Stati: closed (chiamate normali), open (chiamate rifiutate per cooldown secondi),
+    half_open (una sola chiamata di prova: se riesce il circuito si chiude).
+    """
+    
+    def __init__(self, failure_threshold: int = OPENAI_BREAKER_FAILURES, cooldown: float = OPENAI_BREAKER_COOLDOWN):
+        """
+        Inizializza il circuit breaker
+        
+        Args:
+            failure_threshold: Errori consecutivi che aprono il circuito
+            cooldown: Secondi di pausa prima della chiamata di prova
+        """
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.probe_in_flight = False
+        self._lock = threading.Lock()
+        
+        # Statistiche
+        self.times_opened = 0
+        self.rejected = 0
+    
+    @property
+    def state(self) -> str:
+        """
+        Stato corrente: closed, open o half_open
+        """
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at < self.cooldown:
+            return 'open'
+        return 'half_open'
+    
+    @property
+    def is_open(self) -> bool:
+        """
+        True durante il cooldown (nessuna chiamata consentita)
+        """
+        return self.state == 'open'
+    
+    def remaining(self) -> float:
+        """
+        Secondi alla prossima chiamata di prova (0 se il circuito non è aperto)
+        """
+        if self.opened_at is None:
+            return 0.0
+        return max(self.cooldown - (time.monotonic() - self.opened_at), 0.0)
+    
+    def allow(self) -> bool:
+        """
+        True se una chiamata può partire (in half_open solo la chiamata di prova)
+        """
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self.probe_in_flight:
+                self.probe_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+    
+    def record_success(self):
+        """
+        Il servizio ha risposto: chiude il circuito e azzera gli errori
+        """
+        with self._lock:
+            if self.opened_at is not None:
+                print("✅ OpenAI di nuovo raggiungibile: analisi riprese")
+            self.failures = 0
+            self.opened_at = None
+            self.probe_in_flight = False
+    
+    def record_failure(self):
+        """
+        Errore temporaneo del servizio: apre il circuito oltre la soglia
+        (o subito, se fallisce la chiamata di prova)
+        """
+        with self._lock:
+            self.failures += 1
+            if self.probe_in_flight or (self.opened_at is None and self.failures >= self.failure_threshold):
+                if self.opened_at is None:
+                    self.times_opened += 1
+                    print(f"🔌 OpenAI degradato ({self.failures} errori consecutivi): "
+                          f"analisi in pausa per {self.cooldown:.0f}s")
+                self.opened_at = time.monotonic()
+                self.probe_in_flight = False
+    
+    def get_stats(self) -> Dict:
+        """
+        Statistiche del circuit breaker
+        """
+        return {
+            'state': self.state,
+            'consecutive_failures': self.failures,
+            'times_opened': self.times_opened,
+            'rejected': self.rejected
+        }
+
+
+class RetryPolicy:
+    """
+    Esegue le chiamate con retry, backoff esponenziale con jitter e circuit breaker
+    """
+    
+    def __init__(self, max_retries: int = OPENAI_MAX_RETRIES, base_delay: float = OPENAI_RETRY_BASE_DELAY,
+                 max_delay: float = OPENAI_RETRY_MAX_DELAY, breaker: Optional[CircuitBreaker] = None,
+                 wait_when_open: bool = True):
+        """
+        Inizializza la policy
+        
+        Args:
+            max_retries: Tentativi aggiuntivi dopo il primo
+            base_delay: Attesa iniziale del backoff in secondi
+            max_delay: Attesa massima in secondi (un Retry-After più lungo non viene atteso:
+                la chiamata fallisce e l'email passa alla coda dei retry)
+            breaker: Circuit breaker condiviso (default: uno nuovo)
+            wait_when_open: True = con il circuito aperto le chiamate attendono la fine del cooldown
+                (analisi in pausa, senza risultati 'unknown'); False = falliscono subito con CircuitOpenError
+        """
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.wait_when_open = wait_when_open
+        self.retries = 0
+    
+    def delay(self, attempt: int, error: Exception) -> Optional[float]:
+        """
+        Attesa prima del tentativo successivo
+        
+        Args:
+            attempt: Tentativo appena fallito (1 = primo)
+            error: Errore del tentativo
+        
+        Returns:
+            Secondi da attendere, None se non va ripetuto
+        """
+        if not is_retryable(error) or attempt > self.max_retries:
+            return None
+        server_delay = retry_after(error)
+        if server_delay is not None:
+            return server_delay if server_delay <= self.max_delay else None
+        # Full jitter: attesa casuale fino al backoff esponenziale
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+    
+    def _breaker_wait(self) -> Optional[float]:
+        """
+        Secondi da attendere prima che la chiamata possa partire (None = può partire subito)
+        """
+        if self.breaker.allow():
+            return None
+        if not self.wait_when_open:
+            raise CircuitOpenError(f"circuit breaker aperto, nuovo tentativo tra {self.breaker.remaining():.0f}s")
+        # Cooldown scaduto ma chiamata di prova in corso: si ricontrolla a breve
+        return self.breaker.remaining() or BREAKER_POLL_SECONDS
+    
+    def _paused(self, error: Exception) -> bool:
+        """
+        True se la chiamata fallita va ripetuta dopo il cooldown invece di fallire
+        """
+        return self.wait_when_open and is_retryable(error) and self.breaker.state != 'closed'
+    
+    def _after_error(self, attempt: int, error: Exception) -> Optional[float]:
+        # Solo gli errori temporanei contano come servizio degradato
+        if is_retryable(error):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        wait = self.delay(attempt, error)
+        if wait is not None:
+            self.retries += 1
+        return wait
+    
+    def call(self, func: Callable[[int], Any]):
+        """
+        Esegue una chiamata sincrona con retry
+        
+        Args:
+            func: Funzione da eseguire, riceve il numero del tentativo (1 = primo)
+        
+        Returns:
+            Risultato della funzione
+        
+        Raises:
+            CircuitOpenError: Se il circuit breaker è aperto e wait_when_open è False
+            Exception: L'ultimo errore, se non recuperabile o a tentativi esauriti
+        """
+        attempt = 1
+        while True:
+            wait = self._breaker_wait()
+            if wait is not None:
+                time.sleep(wait)
+                continue
+            try:
+                result = func(attempt)
+            except Exception as error:
+                wait = self._after_error(attempt, error)
+                if wait is None:
+                    if not self._paused(error):
+                        raise
+                    # Servizio degradato: si riprova dopo il cooldown, senza limite di tentativi
+                    wait = 0
+                time.sleep(wait)
+                attempt += 1
+                continue
+            self.breaker.record_success()
+            return result
+    
+    async def acall(self, func: Callable[[int], Awaitable[Any]]):
+        """
+        Come call(), per le funzioni asincrone
+        """
+        attempt = 1
+        while True:
+            wait = self._breaker_wait()
+            if wait is not None:
+                await asyncio.sleep(wait)
+                continue
+            try:
+                result = await func(attempt)
+            except Exception as error:
+                wait = self._after_error(attempt, error)
+                if wait is None:
+                    if not self._paused(error):
+                        raise
+                    wait = 0
+                await asyncio.sleep(wait)
+                attempt += 1
+                continue
+            self.breaker.record_success()
+            return result
+    
+    def get_stats(self) -> Dict:
+        """
+        Statistiche dei retry e del circuit breaker
+        """
+        return {'retries': self.retries, **self.breaker.get_stats()}
+
+
+class AnalysisRetryQueue:
+    """
+    Coda SQLite delle email la cui analisi è fallita, da rianalizzare con backoff
+    """
+    
+    def __init__(self, db_path: str = ANALYSIS_RETRY_DB, max_attempts: int = ANALYSIS_RETRY_MAX_ATTEMPTS):
+        """
+        Inizializza la coda
+        
+        Args:
+            db_path: Database della coda (default: accanto alla tabella emails)
+            max_attempts: Analisi fallite dopo le quali l'email non viene più ritentata
+        """
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self._create_tables()
+    
+    def _create_tables(self):
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS analysis_retry_queue (
+                email_id TEXT PRIMARY KEY,
+                email_json TEXT NOT NULL,
+                attempts INTEGER DEFAULT 1,
+                last_error TEXT,
+                next_attempt_at REAL NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_retry_next_attempt
+            ON analysis_retry_queue(next_attempt_at)
+        ''')
+        conn.commit()
+        conn.close()
+    
+    def enqueue(self, email: Dict, error: str):
+        """
+        Accoda un'email fallita o, se già in coda, ne incrementa i tentativi
+        
+        Il prossimo tentativo è tra 2^(tentativi-1) minuti (massimo RETRY_QUEUE_MAX_MINUTES).
+        
+        Args:
+            email: Email nel formato di GmailExtractor (serve l'ID)
+            error: Messaggio dell'errore
+        """
+        email_id = email.get('id')
+        if not email_id:
+            return
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            cursor.execute('SELECT attempts FROM analysis_retry_queue WHERE email_id = ?', (email_id,))
+            row = cursor.fetchone()
+            attempts = row[0] + 1 if row else 1
+            minutes = min(2 ** (attempts - 1), RETRY_QUEUE_MAX_MINUTES)
+            cursor.execute('''
+                INSERT OR REPLACE INTO analysis_retry_queue
+                (email_id, email_json, attempts, last_error, next_attempt_at, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?,
+                        COALESCE((SELECT created_at FROM analysis_retry_queue WHERE email_id = ?), CURRENT_TIMESTAMP),
+                        CURRENT_TIMESTAMP)
+            ''', (email_id, json.dumps(email, default=str), attempts, error[:1000],
+                  time.time() + minutes * 60, email_id))
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            print(f"⚠️  Impossibile accodare l'email {email_id} per un nuovo tentativo: {e}")
+    
+    def due(self, limit: int = 100) -> List[Dict]:
+        """
+        Email da ritentare ora (più vecchie prima), esclusi i tentativi esauriti
+        
+        Args:
+            limit: Numero massimo di email
+        
+        Returns:
+            Email nel formato di GmailExtractor
+        """
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT email_json FROM analysis_retry_queue
+            WHERE next_attempt_at <= ? AND attempts < ?
+            ORDER BY next_attempt_at
+            LIMIT ?
+        ''', (time.time(), self.max_attempts, limit))
+        emails = [json.loads(row[0]) for row in cursor.fetchall()]
+        conn.close()
+        return emails
+    
+    def remove(self, email_ids: List[str]):
+        """
+        Rimuove dalla coda le email analizzate con successo
+        """
+        if not email_ids:
+            return
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.executemany('DELETE FROM analysis_retry_queue WHERE email_id = ?',
+                           [(email_id,) for email_id in email_ids])
+        conn.commit()
+        conn.close()
+    
+    def get_stats(self) -> Dict:
+        """
+        Statistiche della coda
+        
+        Returns:
+            Dizionario con email in attesa, da ritentare ora e con tentativi esauriti
+        """
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT
+                COALESCE(SUM(attempts < ?), 0),
+                COALESCE(SUM(attempts < ? AND next_attempt_at <= ?), 0),
+                COALESCE(SUM(attempts >= ?), 0)
+            FROM analysis_retry_queue
+        ''', (self.max_attempts, self.max_attempts, time.time(), self.max_attempts))
+        pending, due, exhausted = cursor.fetchone()
+        conn.close()
+        return {
+            'pending': pending,
+            'due': due,
+            'exhausted': exhausted
+        }
+
+
+def main():
+    """
+    Uso: python llm_resilience.py stats [emails.db]
+    """
+    if len(sys.argv) < 2 or sys.argv[1] != 'stats':
+        print(main.__doc__.strip())
+        return
+    
+    queue = AnalysisRetryQueue(sys.argv[2] if len(sys.argv) > 2 else ANALYSIS_RETRY_DB)
+    stats = queue.get_stats()
+    print(f"🔁 Analisi in coda: {stats['pending']} (da ritentare ora: {stats['due']})")
+    print(f"⛔ Tentativi esauriti: {stats['exhausted']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+"""
+Import offline di un export Google Takeout (.mbox)
+Carica l'intera mailbox senza passare dall'API Gmail, con gli stessi ID usati dal sync
+"""
+
+import os
+import re
+import sys
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from email import policy
+from email.parser import BytesHeaderParser
+from typing import Dict, Iterator, List, Optional, Tuple
+from dotenv import load_dotenv
+from message_parser import parse_raw_message
+from raw_archive import RawMessageArchive, takeout_message_id, decimal_to_gmail_id
+
+# Carica variabili d'ambiente
+load_dotenv()
+
+# Messaggi letti, parsati, analizzati e salvati per ogni blocco
+IMPORT_CHUNK_SIZE = int(os.getenv('MBOX_IMPORT_CHUNK_SIZE', 200))
+
+# Processi usati per il parsing MIME
+IMPORT_WORKERS = int(os.getenv('MBOX_IMPORT_WORKERS', os.cpu_count() or 4))
+
+# Label di sistema: nome in X-Gmail-Labels (Takeout) -> ID dell'API Gmail
+SYSTEM_LABELS = {
+    'inbox': 'INBOX',
+    'sent': 'SENT',
+    'important': 'IMPORTANT',
+    'starred': 'STARRED',
+    'unread': 'UNREAD',
+    'draft': 'DRAFT',
+    'drafts': 'DRAFT',
+    'spam': 'SPAM',
+    'trash': 'TRASH',
+    'chat': 'CHAT',
+    'category personal': 'CATEGORY_PERSONAL',
+    'category social': 'CATEGORY_SOCIAL',
+    'category promotions': 'CATEGORY_PROMOTIONS',
+    'category updates': 'CATEGORY_UPDATES',
+    'category forums': 'CATEGORY_FORUMS'
+}
+
+# Label che Takeout aggiunge ma che non esistono nell'API
+TAKEOUT_ONLY_LABELS = {'opened', 'archived'}
+
+# Messaggi esclusi anche da messages.list (spam, cestino, chat)
+EXCLUDED_LABELS = {'SPAM', 'TRASH', 'CHAT'}
+
+# Lunghezza dello snippet ricostruito dal corpo (Gmail non lo include nell'export)
+SNIPPET_LENGTH = 200
+
+
+def iter_mbox(mbox_path: str) -> Iterator[Tuple[str, bytes]]:
+    """
+    Legge un file mbox un messaggio alla volta, senza caricarlo in memoria
+    
+    Args:
+        mbox_path: Path del file .mbox
+    
+    Yields:
+        Tuple (riga "From " di separazione, byte RFC822 del messaggio)
+    """
+    from_line = None
+    lines = []
+    with open(mbox_path, 'rb') as f:
+        for line in f:
+            if line.startswith(b'From '):
+                if from_line is not None:
+                    yield from_line, b''.join(lines)
+                from_line = line.decode('utf-8', errors='ignore').rstrip('\r\n')
+                lines = []
+            elif from_line is not None:
+                lines.append(line)
+    if from_line is not None:
+        yield from_line, b''.join(lines)
+
+
+def takeout_labels_to_ids(value: str, label_map: Optional[Dict[str, str]] = None) -> List[str]:
+    """
+    Converte l'header X-Gmail-Labels negli ID di label dell'API Gmail
+    
+    Args:
+        value: Valore dell'header (nomi separati da virgola)
+        label_map: Nomi delle label utente -> ID (da GmailExtractor.get_labels)
+    
+    Returns:
+        Lista degli ID di label
+    """
+    label_map = label_map or {}
+    labels = []
+    for name in value.split(','):
+        name = name.strip().strip('"')
+        key = name.lower()
+        if not name or key in TAKEOUT_ONLY_LABELS:
+            continue
+        labels.append(SYSTEM_LABELS.get(key) or label_map.get(name) or name)
+    return labels
+
+
+def mbox_message_id(from_line: str, raw: bytes) -> str:
+    """
+    ID Gmail di un messaggio Takeout (hash del contenuto se la riga "From " non lo contiene)
+    """
+    return takeout_message_id(from_line) or hashlib.sha256(raw).hexdigest()
+
+
+def parse_takeout_message(item: Tuple[str, bytes, str, Dict[str, str]]) -> Optional[Dict]:
+    """
+    Parsa un messaggio Takeout nello stesso formato di GmailExtractor._parse_message
+    
+    Funzione di modulo perché deve essere eseguita nei processi del pool.
+    
+    Args:
+        item: Tuple (riga "From ", byte RFC822, account, mappa delle label utente)
+    
+    Returns:
+        Dizionario con i dati parsati del messaggio, None se il messaggio non è parsabile
+        (un messaggio malformato non deve interrompere l'import dell'intero export)
+    """
+    from_line, raw, account, label_map = item
+    try:
+        return _parse_takeout_message(from_line, raw, account, label_map)
+    except Exception as e:
+        print(f"⚠️  Parsing del messaggio {mbox_message_id(from_line, raw)} fallito: {e}")
+        return None
+
+
+def _parse_takeout_message(from_line: str, raw: bytes, account: str, label_map: Dict[str, str]) -> Dict:
+    """
+    Parsing vero e proprio di parse_takeout_message (solleva eccezione se il messaggio è malformato)
+    """
+    headers = BytesHeaderParser(policy=policy.default).parsebytes(raw)
+    parsed = parse_raw_message(raw)
+    
+    return {
+        'id': mbox_message_id(from_line, raw),
+        'thread_id': decimal_to_gmail_id(str(headers.get('X-GM-THRID') or '')) or '',
+        'subject': parsed['subject'],
+        'from': parsed['from'],
+        'to': parsed['to'],
+        'date': parsed['date'],
+        'body': parsed['body'],
+        'headers': parsed['headers'],
+        'snippet': re.sub(r'\s+', ' ', parsed['body']).strip()[:SNIPPET_LENGTH],
+        'labels': takeout_labels_to_ids(str(headers.get('X-Gmail-Labels') or ''), label_map),
+        'account': account
+    }
+
+
+class MboxImporter:
+    """
+    Importa un export Takeout nel database: parsing in parallelo, analisi AI e salvataggio
+    
+    Gli ID sono quelli dell'API Gmail (X-GM-MSGID in esadecimale), quindi il
+    sync incrementale successivo riconosce i messaggi già importati.
+    """
+    
+    def __init__(self, db, analyzer, account: str = '', label_map: Optional[Dict[str, str]] = None,
+                 workers: int = IMPORT_WORKERS, chunk_size: int = IMPORT_CHUNK_SIZE,
+                 archive: Optional[RawMessageArchive] = None):
+        """
+        Inizializza l'importer
+        
+        Args:
+            db: EmailDatabase in cui salvare le email
+            analyzer: EmailAnalyzer usato per l'analisi AI
+            account: Indirizzo Gmail dell'export (deve coincidere con quello del sync)
+            label_map: Nomi delle label utente -> ID dell'API Gmail
+            workers: Processi per il parsing MIME
+            chunk_size: Messaggi elaborati per blocco
+            archive: Archivio raw in cui conservare anche i messaggi originali (opzionale)
+        """
+        self.db = db
+        self.analyzer = analyzer
+        self.account = account
+        self.label_map = label_map or {}
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.archive = archive
+        self.stats = {'read': 0, 'skipped': 0, 'excluded': 0, 'failed': 0, 'saved': 0}
+    
+    def _iter_chunks(self, mbox_path: str, limit: Optional[int]) -> Iterator[List[Tuple[str, str, bytes]]]:
+        """
+        Raggruppa i messaggi del file in blocchi di (id, riga "From ", byte)
+        """
+        chunk = []
+        for from_line, raw in iter_mbox(mbox_path):
+            if limit is not None and self.stats['read'] >= limit:
+                break
+            self.stats['read'] += 1
+            chunk.append((mbox_message_id(from_line, raw), from_line, raw))
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    
+    def run(self, mbox_path: str, limit: Optional[int] = None) -> Dict:
+        """
+        Importa il file mbox
+        
+        Args:
+            mbox_path: Path del file .mbox di Takeout
+            limit: Numero massimo di messaggi da leggere (opzionale)
+        
+        Returns:
+            Statistiche: messaggi letti, già presenti, esclusi, non parsabili e salvati
+        """
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            for chunk in self._iter_chunks(mbox_path, limit):
+                # I messaggi già nel database non vengono né parsati né analizzati
+                existing = self.db.get_existing_email_ids([message_id for message_id, _, _ in chunk])
+                chunk = [item for item in chunk if item[0] not in existing]
+                self.stats['skipped'] += len(existing)
+                if not chunk:
+                    continue
+                
+                items = [(from_line, raw, self.account, self.label_map) for _, from_line, raw in chunk]
+                parsed = list(pool.map(parse_takeout_message, items,
+                                       chunksize=max(1, len(items) // (self.workers * 4))))
+                
+                # I messaggi non parsabili vengono saltati e contati
+                emails = [email for email in parsed if email is not None]
+                self.stats['failed'] += len(parsed) - len(emails)
+                
+                if self.archive is not None:
+                    for email, (_, _, raw) in zip(parsed, chunk):
+                        if email is not None:
+                            self.archive.put(email['id'], raw, email['thread_id'], email['labels'], email['snippet'])
+                
+                # Spam, cestino e chat non compaiono nel sync via API
+                included = [email for email in emails if not EXCLUDED_LABELS.intersection(email['labels'])]
+                self.stats['excluded'] += len(emails) - len(included)
+                if not included:
+                    continue
+                
+                analyzed = self.analyzer.analyze_batch(included)
+                self.stats['saved'] += self.db.save_batch(analyzed)
+                print(f"📥 Letti {self.stats['read']} | già presenti {self.stats['skipped']} | "
+                      f"esclusi {self.stats['excluded']} | non parsabili {self.stats['failed']} | "
+                      f"salvati {self.stats['saved']}")
+        
+        return self.stats
+
+
+def main():
+    """
+    Uso: python mbox_importer.py <file.mbox> [indirizzo@gmail.com] [limite]
+    """
+    from email_analyzer import EmailAnalyzer
+    from database import EmailDatabase
+    
+    if len(sys.argv) < 2:
+        print(main.__doc__.strip())
+        return
+    
+    api_key = os.getenv('OPENAI_API_KEY')
+    if not api_key:
+        raise ValueError("OPENAI_API_KEY non trovata nel file .env")
+    
+    mbox_path = sys.argv[1]
+    account = sys.argv[2] if len(sys.argv) > 2 else ''
+    limit = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    archive_dir = os.getenv('GMAIL_RAW_ARCHIVE_DIR')
+    
+    print("="*80)
+    print(f"📦 IMPORT TAKEOUT - {mbox_path}")
+    print("="*80)
+    if not account:
+        print("⚠️  Nessun account indicato: le email non saranno associate a un indirizzo Gmail")
+    
+    importer = MboxImporter(
+        EmailDatabase(),
+        EmailAnalyzer(api_key=api_key),
+        account=account,
+        archive=RawMessageArchive(archive_dir) if archive_dir else None
+    )
+    stats = importer.run(mbox_path, limit)
+    
+    print(f"\n✅ Import completato: {stats['saved']} email salvate "
+          f"({stats['skipped']} già presenti, {stats['excluded']} spam/cestino/chat)")
+    if stats['failed']:
+        print(f"⚠️  {stats['failed']} messaggi non parsabili saltati")
+
+
+if __name__ == '__main__':
+    main()
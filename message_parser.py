@@ -0,0 +1,272 @@
+"""
+Parsing dei messaggi Gmail (formato 'raw' e 'full') ed esecuzione in un pool di processi
+Il modulo non dipende dalle librerie Google, così i processi worker restano leggeri
+"""
+
+import os
+import base64
+from concurrent.futures import Future, ProcessPoolExecutor
+from email import policy
+from email.parser import BytesParser
+from typing import Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+
+# Carica variabili d'ambiente
+load_dotenv()
+
+
+# Processi per il parsing MIME (0 = parsing nel thread che scarica i messaggi)
+PARSE_WORKERS = int(os.getenv('GMAIL_PARSE_WORKERS', 0))
+
+# Messaggi inviati a un processo worker per ogni task
+PARSE_CHUNK_SIZE = int(os.getenv('GMAIL_PARSE_CHUNK_SIZE', 50))
+
+# Campi restituiti dai worker, in quest'ordine (tuple compatte invece di dizionari)
+PARSED_FIELDS = ('subject', 'from', 'to', 'date', 'body', 'headers')
+
+# Header conservati per la pre-classificazione (mailing list, messaggi automatici)
+CLASSIFICATION_HEADERS = ('list-unsubscribe', 'list-id', 'precedence', 'auto-submitted', 'reply-to')
+
+
+def parse_raw_message(raw: bytes) -> Dict:
+    """
+    Parsa un messaggio RFC822 con il parser della libreria standard
+    
+    Scorre l'intero albero MIME (anche multipart annidati) e salta gli
+    allegati senza decodificarli.
+    
+    Args:
+        raw: Byte del messaggio RFC822
+    
+    Returns:
+        Dizionario con subject, from, to, date, body e headers
+    """
+    message = BytesParser(policy=policy.default).parsebytes(raw)
+    
+    plain = None
+    html = None
+    for part in message.walk():
+        if part.is_multipart() or part.is_attachment():
+            continue
+        content_type = part.get_content_type()
+        if content_type == 'text/plain' and plain is None:
+            plain = _decode_part(part)
+            break
+        if content_type == 'text/html' and html is None:
+            html = _decode_part(part)
+    
+    return {
+        'subject': str(message.get('subject', '')),
+        'from': str(message.get('from', '')),
+        'to': str(message.get('to', '')),
+        'date': str(message.get('date', '')),
+        'body': plain if plain is not None else (html or ''),
+        'headers': {name: str(message[name]) for name in CLASSIFICATION_HEADERS if message[name] is not None}
+    }
+
+
+def _decode_part(part) -> str:
+    """
+    Decodifica il contenuto testuale di una parte MIME
+    """
+    try:
+        return part.get_content()
+    except (LookupError, UnicodeDecodeError):
+        # Charset sconosciuto o errato: decodifica tollerante
+        payload = part.get_payload(decode=True) or b''
+        return payload.decode('utf-8', errors='replace')
+
+
+def parse_full_payload(payload: Dict) -> Dict:
+    """
+    Estrae header principali e corpo da un payload in formato 'full'
+    
+    Args:
+        payload: Payload del messaggio
+    
+    Returns:
+        Dizionario con subject, from, to, date, body e headers
+    """
+    parsed = {'subject': '', 'from': '', 'to': '', 'date': '', 'headers': {}}
+    
+    # Estrai gli header principali
+    for header in payload.get('headers', []):
+        name = header['name'].lower()
+        if name in parsed and name != 'headers':
+            parsed[name] = header['value']
+        elif name in CLASSIFICATION_HEADERS:
+            parsed['headers'][name] = header['value']
+    
+    # Estrai il corpo del messaggio
+    parsed['body'] = get_payload_body(payload)
+    return parsed
+
+
+def get_payload_body(payload: Dict) -> str:
+    """
+    Estrae il corpo del messaggio dal payload
+    
+    Scorre tutte le parti, anche annidate (es. multipart/alternative dentro
+    multipart/mixed): preferisce text/plain, altrimenti text/html.
+    Gli allegati non vengono decodificati.
+    
+    Args:
+        payload: Payload del messaggio
+    
+    Returns:
+        Corpo del messaggio decodificato
+    """
+    if 'parts' not in payload:
+        # Messaggio semplice
+        if 'data' in payload.get('body', {}):
+            return decode_body_data(payload['body']['data'])
+        return ''
+    
+    html = None
+    stack = [payload]
+    
+    while stack:
+        part = stack.pop()
+        if 'parts' in part:
+            # Mantiene l'ordine originale delle parti
+            stack.extend(reversed(part['parts']))
+            continue
+        
+        body = part.get('body', {})
+        if part.get('filename') or 'data' not in body:
+            continue
+        
+        mime_type = part.get('mimeType', '')
+        if mime_type == 'text/plain':
+            return decode_body_data(body['data'])
+        if mime_type == 'text/html' and html is None:
+            html = decode_body_data(body['data'])
+    
+    return html or ''
+
+
+def decode_body_data(data: str) -> str:
+    """
+    Decodifica il campo body.data (base64url) di una parte
+    """
+    return base64.urlsafe_b64decode(data).decode('utf-8', errors='replace')
+
+
+def parse_gmail_message(message: Dict) -> Dict:
+    """
+    Parsa un messaggio dell'API Gmail in formato 'raw' oppure 'full'
+    
+    Args:
+        message: Messaggio restituito da messages.get
+    
+    Returns:
+        Dizionario con subject, from, to, date, body e headers
+    """
+    if 'raw' in message:
+        return parse_raw_message(base64.urlsafe_b64decode(message['raw']))
+    return parse_full_payload(message['payload'])
+
+
+def parse_message_chunk(messages: List[Dict]) -> List[Optional[Tuple[str, ...]]]:
+    """
+    Parsa un blocco di messaggi nel processo worker
+    
+    Ogni messaggio contiene solo 'raw' oppure 'payload': gli altri campi
+    restano nel processo principale.
+    
+    Args:
+        messages: Messaggi da parsare
+    
+    Returns:
+        Tuple con i campi di PARSED_FIELDS, nello stesso ordine (None se il parsing fallisce)
+    """
+    results = []
+    for message in messages:
+        try:
+            parsed = parse_gmail_message(message)
+            results.append(tuple(parsed[field] for field in PARSED_FIELDS))
+        except Exception as e:
+            print(f"⚠️  Parsing del messaggio fallito: {e}")
+            results.append(None)
+    return results
+
+
+class ParseJob:
+    """
+    Parsing in corso di una lista di messaggi, suddivisa in blocchi
+    """
+    
+    def __init__(self, futures: List[Future]):
+        self.futures = futures
+    
+    def result(self) -> List[Optional[Dict]]:
+        """
+        Attende i worker e restituisce i messaggi parsati nell'ordine di invio
+        
+        Returns:
+            Dizionari con subject, from, to, date, body e headers (None se il parsing è fallito)
+        """
+        parsed = []
+        for future in self.futures:
+            for fields in future.result():
+                parsed.append(dict(zip(PARSED_FIELDS, fields)) if fields is not None else None)
+        return parsed
+
+
+class ParsePool:
+    """
+    Pool di processi che decodifica i messaggi (base64, charset, MIME) su più core
+    
+    submit() ritorna subito: il chiamante può scaricare la pagina successiva
+    mentre i worker parsano quella corrente.
+    """
+    
+    def __init__(self, workers: int = PARSE_WORKERS, chunk_size: int = PARSE_CHUNK_SIZE):
+        """
+        Inizializza il pool (i processi partono al primo utilizzo)
+        
+        Args:
+            workers: Numero di processi worker
+            chunk_size: Messaggi per task inviato a un worker
+        """
+        self.workers = max(1, workers)
+        self.chunk_size = max(1, chunk_size)
+        self._executor = None
+    
+    def submit(self, messages: List[Dict]) -> ParseJob:
+        """
+        Invia una lista di messaggi ai worker
+        
+        Args:
+            messages: Messaggi dell'API Gmail (format 'raw' o 'full')
+        
+        Returns:
+            ParseJob da cui leggere i risultati
+        """
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        
+        # Ai worker arriva solo il contenuto da parsare
+        compact = [
+            {'raw': message['raw']} if 'raw' in message else {'payload': message['payload']}
+            for message in messages
+        ]
+        futures = [
+            self._executor.submit(parse_message_chunk, compact[start:start + self.chunk_size])
+            for start in range(0, len(compact), self.chunk_size)
+        ]
+        return ParseJob(futures)
+    
+    def parse(self, messages: List[Dict]) -> List[Optional[Dict]]:
+        """
+        Parsa una lista di messaggi attendendo il risultato
+        """
+        return self.submit(messages).result()
+    
+    def close(self):
+        """
+        Termina i processi worker
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
@@ -0,0 +1,458 @@
+"""
+Server locale che simula gli endpoint chat/completions, files e batches dell'API OpenAI
+Permette di provare EmailAnalyzer (anche la Batch API) senza costi né chiave reale
+
+Latenza (distribuzione configurabile), errori 429/5xx e risposte JSON sono
+deterministici a parità di MOCK_SEED e ordine di arrivo delle richieste
+
+Uso: python mock_openai_server.py [porta]
+poi OPENAI_BASE_URL=http://127.0.0.1:<porta>/v1 (oppure LLM_BACKEND=mock)
+"""
+
+import os
+import re
+import sys
+import json
+import math
+import time
+import random
+import threading
+import uuid
+from email.parser import BytesParser
+from email import policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+
+# Carica variabili d'ambiente
+load_dotenv()
+
+
+# Risposta JSON restituita per ogni analisi simulata
+CANNED_ANALYSIS = {
+    'notes': 'Mock analysis generated by the local test server.',
+    'email_type': 'marketing',
+    'campaign_type': 'promo',
+    'pricing_extract': '',
+    'target_audience': 'existing subscribers',
+    'product_mentioned': '',
+    'retention': '',
+    'funnel_stage': 'consideration'
+}
+
+# Quota di richieste di un batch che falliscono (0.0 - 1.0)
+MOCK_BATCH_ERROR_RATE = float(os.getenv('MOCK_BATCH_ERROR_RATE', 0))
+
+# Controlli di stato necessari prima che un batch risulti completato
+MOCK_BATCH_POLLS = int(os.getenv('MOCK_BATCH_POLLS', 2))
+
+# Risposta JSON restituita agli swipe simulati
+CANNED_SWIPE = {
+    'subject': 'Mock swipe subject',
+    'body': 'Mock swipe body generated by the local test server.',
+    'changes': [{'type': 'hook', 'original': '', 'new': 'Mock hook', 'reasoning': 'Mock reasoning'}],
+    'key_insights': 'Mock swipe strategy.'
+}
+
+# Risposte predefinite: la prima espressione regolare trovata nel prompt sceglie la risposta
+CANNED_RESPONSES = [
+    (r'expert email copywriter', CANNED_SWIPE),
+    (r'', CANNED_ANALYSIS)
+]
+
+# File JSON {"regex": {risposta}, ...} che sostituisce CANNED_RESPONSES (vuoto = risposte predefinite)
+MOCK_CANNED_FILE = os.getenv('MOCK_CANNED_FILE', '')
+
+# Latenza media simulata di ogni chiamata chat/completions, in secondi
+MOCK_CHAT_LATENCY = float(os.getenv('MOCK_CHAT_LATENCY', 0.2))
+
+# Distribuzione della latenza: fixed, uniform (±50%), exponential o lognormal (coda lunga)
+MOCK_LATENCY_DISTRIBUTION = os.getenv('MOCK_LATENCY_DISTRIBUTION', 'fixed').lower()
+
+# Dispersione della distribuzione lognormal (0.5 = p99 circa 3 volte la media, 1.0 = circa 6 volte)
+MOCK_LATENCY_SIGMA = float(os.getenv('MOCK_LATENCY_SIGMA', 0.5))
+
+# Quote di chiamate chat/completions che falliscono con 5xx e con 429 (0.0 - 1.0)
+MOCK_CHAT_ERROR_RATE = float(os.getenv('MOCK_CHAT_ERROR_RATE', 0))
+MOCK_RATE_LIMIT_RATE = float(os.getenv('MOCK_RATE_LIMIT_RATE', 0))
+
+# Secondi indicati nell'header Retry-After delle risposte 429
+MOCK_RETRY_AFTER = float(os.getenv('MOCK_RETRY_AFTER', 1))
+
+# Seme del generatore casuale (latenze ed errori riproducibili)
+MOCK_SEED = int(os.getenv('MOCK_SEED', 42))
+
+# ID delle email nei prompt impacchettati di EmailAnalyzer
+PACKED_ID_PATTERN = re.compile(r'^EMAIL ID: (.*)$', re.MULTILINE)
+
+
+class MockOpenAIState:
+    """
+    File e batch in memoria, condivisi tra le richieste
+    """
+    
+    def __init__(self, error_rate: float = MOCK_BATCH_ERROR_RATE, polls: int = MOCK_BATCH_POLLS,
+                 chat_latency: float = MOCK_CHAT_LATENCY, latency_distribution: str = MOCK_LATENCY_DISTRIBUTION,
+                 latency_sigma: float = MOCK_LATENCY_SIGMA, chat_error_rate: float = MOCK_CHAT_ERROR_RATE,
+                 rate_limit_rate: float = MOCK_RATE_LIMIT_RATE, retry_after: float = MOCK_RETRY_AFTER,
+                 canned: Optional[List[Tuple[str, Dict]]] = None, seed: int = MOCK_SEED):
+        """
+        Args:
+            error_rate: Quota di richieste fallite nei batch
+            polls: Controlli di stato prima che un batch risulti completato
+            chat_latency: Latenza media delle chiamate chat/completions in secondi
+            latency_distribution: fixed, uniform, exponential o lognormal
+            latency_sigma: Dispersione della distribuzione lognormal
+            chat_error_rate: Quota di chiamate chat/completions con errore 5xx
+            rate_limit_rate: Quota di chiamate chat/completions con errore 429
+            retry_after: Secondi dell'header Retry-After nelle risposte 429
+            canned: Coppie (regex, risposta JSON) (default: MOCK_CANNED_FILE o CANNED_RESPONSES)
+            seed: Seme del generatore casuale
+        """
+        self.files: Dict[str, Dict] = {}
+        self.batches: Dict[str, Dict] = {}
+        self.error_rate = error_rate
+        self.polls = polls
+        self.chat_latency = chat_latency
+        self.latency_distribution = latency_distribution
+        self.latency_sigma = latency_sigma
+        self.chat_error_rate = chat_error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.canned = [(re.compile(pattern), response) for pattern, response in (canned or load_canned())]
+        self.seed = seed
+        self.lock = threading.Lock()
+        
+        # Ogni chiamata e ogni batch usano un generatore derivato dal seme e dal loro numero d'ordine
+        self.chat_requests = 0
+        self.chat_statuses: Dict[int, int] = {}
+        self.completed_batches = 0
+    
+    def next_chat_outcome(self) -> Tuple[float, int]:
+        """
+        Latenza e status HTTP della prossima chiamata chat/completions
+        
+        Returns:
+            Tuple (secondi di attesa, status)
+        """
+        with self.lock:
+            self.chat_requests += 1
+            rng = random.Random(self.seed * 1_000_003 + self.chat_requests)
+        
+        mean = self.chat_latency
+        if self.latency_distribution == 'uniform':
+            latency = rng.uniform(mean * 0.5, mean * 1.5)
+        elif self.latency_distribution == 'exponential':
+            latency = rng.expovariate(1 / mean) if mean > 0 else 0.0
+        elif self.latency_distribution == 'lognormal':
+            # mu scelto perché la media resti chat_latency
+            latency = (rng.lognormvariate(math.log(mean) - self.latency_sigma ** 2 / 2, self.latency_sigma)
+                       if mean > 0 else 0.0)
+        else:
+            latency = mean
+        
+        draw = rng.random()
+        if draw < self.rate_limit_rate:
+            status = 429
+        elif draw < self.rate_limit_rate + self.chat_error_rate:
+            status = rng.choice((500, 502, 503))
+        else:
+            status = 200
+        
+        with self.lock:
+            self.chat_statuses[status] = self.chat_statuses.get(status, 0) + 1
+        return latency, status
+    
+    def canned_response(self, prompt: str) -> Dict:
+        """
+        Risposta JSON predefinita per il prompt
+        """
+        for pattern, response in self.canned:
+            if pattern.search(prompt):
+                return response
+        return CANNED_ANALYSIS
+    
+    def add_file(self, content: bytes, filename: str, purpose: str) -> Dict:
+        file_id = f"file-{uuid.uuid4().hex[:24]}"
+        self.files[file_id] = {
+            'id': file_id,
+            'object': 'file',
+            'bytes': len(content),
+            'created_at': int(time.time()),
+            'filename': filename,
+            'purpose': purpose,
+            'status': 'processed',
+            'content': content
+        }
+        return self.files[file_id]
+    
+    def create_batch(self, params: Dict) -> Optional[Dict]:
+        if params.get('input_file_id') not in self.files:
+            return None
+        batch_id = f"batch_{uuid.uuid4().hex[:24]}"
+        self.batches[batch_id] = {
+            'id': batch_id,
+            'object': 'batch',
+            'endpoint': params.get('endpoint', '/v1/chat/completions'),
+            'input_file_id': params['input_file_id'],
+            'completion_window': params.get('completion_window', '24h'),
+            'metadata': params.get('metadata'),
+            'status': 'validating',
+            'created_at': int(time.time()),
+            'output_file_id': None,
+            'error_file_id': None,
+            'request_counts': {'total': 0, 'completed': 0, 'failed': 0},
+            '_polls': 0
+        }
+        return self.batches[batch_id]
+    
+    def advance_batch(self, batch: Dict):
+        """
+        Porta avanti lo stato del batch a ogni controllo, fino al completamento
+        """
+        if batch['status'] not in ('validating', 'in_progress'):
+            return
+        batch['_polls'] += 1
+        if batch['_polls'] < self.polls:
+            batch['status'] = 'in_progress'
+            return
+        self._complete_batch(batch)
+    
+    def _complete_batch(self, batch: Dict):
+        lines = self.files[batch['input_file_id']]['content'].decode('utf-8').splitlines()
+        outputs = []
+        errors = []
+        
+        # Chiamato con self.lock già acquisito dall'handler. Sottratto invece che sommato:
+        # sequenze distinte da quelle delle chiamate chat/completions
+        self.completed_batches += 1
+        rng = random.Random(self.seed * 1_000_003 - self.completed_batches)
+        
+        for line in lines:
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            if rng.random() < self.error_rate:
+                errors.append({
+                    'id': f"batch_req_{uuid.uuid4().hex[:24]}",
+                    'custom_id': request['custom_id'],
+                    'response': {'status_code': 500, 'request_id': uuid.uuid4().hex,
+                                 'body': {'error': {'message': 'Mock server error', 'type': 'server_error'}}},
+                    'error': None
+                })
+                continue
+            outputs.append({
+                'id': f"batch_req_{uuid.uuid4().hex[:24]}",
+                'custom_id': request['custom_id'],
+                'response': {'status_code': 200, 'request_id': uuid.uuid4().hex,
+                             'body': chat_completion(request['body'], self)},
+                'error': None
+            })
+        
+        def to_jsonl(items):
+            return ''.join(json.dumps(item) + '\n' for item in items).encode('utf-8')
+        
+        batch['output_file_id'] = self.add_file(to_jsonl(outputs), 'batch_output.jsonl', 'batch_output')['id']
+        if errors:
+            batch['error_file_id'] = self.add_file(to_jsonl(errors), 'batch_errors.jsonl', 'batch_output')['id']
+        batch['request_counts'] = {'total': len(outputs) + len(errors), 'completed': len(outputs),
+                                   'failed': len(errors)}
+        batch['status'] = 'completed'
+        batch['completed_at'] = int(time.time())
+
+
+def load_canned(path: str = MOCK_CANNED_FILE) -> List[Tuple[str, Dict]]:
+    """
+    Risposte predefinite da file JSON {"regex": {risposta}} (CANNED_RESPONSES se non indicato)
+    """
+    if not path:
+        return CANNED_RESPONSES
+    with open(path, 'r', encoding='utf-8') as f:
+        return list(json.load(f).items())
+
+
+def chat_completion(body: Dict, state: Optional['MockOpenAIState'] = None) -> Dict:
+    """
+    Risposta chat.completions simulata con la risposta predefinita per il prompt
+    
+    Ai prompt impacchettati risponde con un elemento per ogni EMAIL ID.
+    """
+    prompt = ''.join(message.get('content') or '' for message in body.get('messages', []))
+    prompt_chars = len(prompt)
+    canned = state.canned_response(prompt) if state is not None else CANNED_ANALYSIS
+    packed_ids = PACKED_ID_PATTERN.findall(prompt)
+    if packed_ids:
+        content = json.dumps({'results': [{'id': email_id, **canned} for email_id in packed_ids]})
+    else:
+        content = json.dumps(canned)
+    prompt_tokens = prompt_chars // 4
+    completion_tokens = len(content) // 4
+    return {
+        'id': f"chatcmpl-{uuid.uuid4().hex[:24]}",
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': body.get('model', 'gpt-4o-mini'),
+        'choices': [{
+            'index': 0,
+            'message': {'role': 'assistant', 'content': content},
+            'finish_reason': 'stop'
+        }],
+        'usage': {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens
+        }
+    }
+
+
+def public_view(item: Dict) -> Dict:
+    """
+    Rimuove i campi interni prima di restituire un oggetto
+    """
+    return {key: value for key, value in item.items() if not key.startswith('_') and key != 'content'}
+
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    """
+    Gestisce gli endpoint /v1/chat/completions, /v1/files e /v1/batches
+    """
+    
+    state: MockOpenAIState = None
+    
+    def log_message(self, format, *args):
+        # Log silenzioso: il server è usato nei test
+        pass
+    
+    def _send_json(self, status: int, payload: Dict, headers: Optional[Dict[str, str]] = None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def _not_found(self):
+        self._send_json(404, {'error': {'message': f'Unknown path {self.path}', 'type': 'invalid_request_error'}})
+    
+    def _read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+    
+    def do_POST(self):
+        parts = self.path.split('?')[0].strip('/').split('/')
+        if parts == ['v1', 'chat', 'completions']:
+            # Fuori dal lock: le chiamate contemporanee si sovrappongono come sull'API reale
+            body = json.loads(self._read_body() or b'{}')
+            latency, status = self.state.next_chat_outcome()
+            time.sleep(latency)
+            if status == 429:
+                return self._send_json(429, {'error': {'message': 'Rate limit reached (mock)', 'type': 'requests',
+                                                       'code': 'rate_limit_exceeded'}},
+                                       {'Retry-After': f'{self.state.retry_after:g}'})
+            if status != 200:
+                return self._send_json(status, {'error': {'message': 'Mock server error', 'type': 'server_error'}})
+            return self._send_json(200, chat_completion(body, self.state))
+        
+        with self.state.lock:
+            if parts == ['v1', 'files']:
+                self._upload_file()
+            elif parts == ['v1', 'batches']:
+                batch = self.state.create_batch(json.loads(self._read_body() or b'{}'))
+                if batch is None:
+                    self._send_json(400, {'error': {'message': 'input_file_id not found',
+                                                    'type': 'invalid_request_error'}})
+                else:
+                    self._send_json(200, public_view(batch))
+            elif len(parts) == 4 and parts[:2] == ['v1', 'batches'] and parts[3] == 'cancel':
+                batch = self.state.batches.get(parts[2])
+                if batch is None:
+                    return self._not_found()
+                batch['status'] = 'cancelled'
+                self._send_json(200, public_view(batch))
+            else:
+                self._not_found()
+    
+    def do_GET(self):
+        parts = self.path.split('?')[0].strip('/').split('/')
+        with self.state.lock:
+            if len(parts) == 3 and parts[:2] == ['v1', 'batches']:
+                batch = self.state.batches.get(parts[2])
+                if batch is None:
+                    return self._not_found()
+                self.state.advance_batch(batch)
+                self._send_json(200, public_view(batch))
+            elif len(parts) == 3 and parts[:2] == ['v1', 'files']:
+                file = self.state.files.get(parts[2])
+                if file is None:
+                    return self._not_found()
+                self._send_json(200, public_view(file))
+            elif len(parts) == 4 and parts[:2] == ['v1', 'files'] and parts[3] == 'content':
+                file = self.state.files.get(parts[2])
+                if file is None:
+                    return self._not_found()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/octet-stream')
+                self.send_header('Content-Length', str(len(file['content'])))
+                self.end_headers()
+                self.wfile.write(file['content'])
+            else:
+                self._not_found()
+    
+    def _upload_file(self):
+        """
+        Legge l'upload multipart/form-data (campi 'file' e 'purpose')
+        """
+        header = f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode('utf-8')
+        form = BytesParser(policy=policy.default).parsebytes(header + self._read_body())
+        
+        content = b''
+        filename = 'upload.jsonl'
+        purpose = 'batch'
+        for part in form.iter_parts():
+            name = part.get_param('name', header='content-disposition')
+            if name == 'file':
+                content = part.get_payload(decode=True) or b''
+                filename = part.get_filename() or filename
+            elif name == 'purpose':
+                purpose = part.get_content().strip()
+        
+        self._send_json(200, public_view(self.state.add_file(content, filename, purpose)))
+
+
+def make_server(port: int = 0, state: Optional[MockOpenAIState] = None) -> ThreadingHTTPServer:
+    """
+    Crea il server (non ancora avviato)
+    
+    Args:
+        port: Porta su cui ascoltare (0 = porta libera scelta dal sistema)
+        state: Stato condiviso (default: nuovo stato con la configurazione da .env)
+    
+    Returns:
+        Server HTTP; l'URL base è http://127.0.0.1:<server.server_port>/v1
+    """
+    handler = type('Handler', (MockOpenAIHandler,), {'state': state or MockOpenAIState()})
+    return ThreadingHTTPServer(('127.0.0.1', port), handler)
+
+
+def start_server(port: int = 0, state: Optional[MockOpenAIState] = None) -> ThreadingHTTPServer:
+    """
+    Avvia il server in un thread in background (per i test)
+    """
+    server = make_server(port, state)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    server = make_server(port)
+    print(f"🧪 Mock OpenAI in ascolto su http://127.0.0.1:{port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
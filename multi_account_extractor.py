@@ -0,0 +1,114 @@
+"""
+Estrazione concorrente da più account Gmail configurati in AccountManager
+"""
+
+import queue
+import threading
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from gmail_extractor import GmailExtractor
+from account_manager import AccountManager
+
+
+class MultiAccountExtractor:
+    """
+    Estrae email da tutti gli account contemporaneamente
+    
+    Ogni account ha il proprio GmailExtractor (credenziali in memoria e
+    rate limiter dedicato) ed è letto da un thread separato. Le pagine
+    arrivano a un unico consumatore, che può salvarle in un solo database.
+    """
+    
+    def __init__(self, account_manager: Optional[AccountManager] = None,
+                 extractors: Optional[List[GmailExtractor]] = None, max_pending_pages: int = 4):
+        """
+        Inizializza gli estrattori di tutti gli account
+        
+        Args:
+            account_manager: AccountManager con gli account da usare
+            extractors: In alternativa, estrattori già autenticati
+            max_pending_pages: Pagine in attesa di elaborazione per account (limita la memoria)
+        """
+        self.extractors: Dict[str, GmailExtractor] = {}
+        self.max_pending_pages = max_pending_pages
+        
+        if extractors is None:
+            account_manager = account_manager or AccountManager()
+            extractors = []
+            for account in account_manager.get_all_accounts():
+                try:
+                    extractors.append(GmailExtractor.for_account(account, account_manager))
+                except Exception as e:
+                    print(f"⚠️  Account {account['name']} non disponibile: {e}")
+        
+        for extractor in extractors:
+            # Il profilo associa le email estratte all'indirizzo dell'account
+            profile = extractor.get_profile()
+            if not profile:
+                print(f"⚠️  Impossibile connettersi all'account {extractor.account_name}")
+                continue
+            self.extractors[profile['emailAddress']] = extractor
+            print(f"✅ Connesso a: {profile['emailAddress']} ({profile['messagesTotal']} messaggi)")
+    
+    def iter_email_pages(self, query: str = '', page_size: int = 200,
+                         page_tokens: Optional[Dict[str, str]] = None,
+                         skip_existing: Optional[Callable[[List[str]], set]] = None
+                         ) -> Iterator[Tuple[str, List[Dict], List[str], Optional[str]]]:
+        """
+        Estrae le email di tutti gli account in parallelo, una pagina alla volta
+        
+        Args:
+            query: Query di ricerca Gmail applicata a ogni account
+            page_size: Messaggi per pagina
+            page_tokens: Token da cui riprendere, per account (opzionale)
+            skip_existing: Funzione che, dati gli ID di una pagina, restituisce
+                quelli da non scaricare (es. già nel database)
+        
+        Yields:
+            Tuple (account, email della pagina, ID dei messaggi della pagina,
+            token della pagina successiva o None)
+        """
+        page_tokens = page_tokens or {}
+        pages = queue.Queue(maxsize=self.max_pending_pages * max(len(self.extractors), 1))
+        done = object()
+        
+        def new_ids_pages(account: str, extractor: GmailExtractor):
+            for messages, next_page_token in extractor.iter_message_pages(
+                    query=query, page_size=page_size, page_token=page_tokens.get(account)):
+                message_ids = [message['id'] for message in messages]
+                existing = skip_existing(message_ids) if skip_existing else set()
+                new_ids = [message_id for message_id in message_ids if message_id not in existing]
+                yield new_ids, (message_ids, next_page_token)
+        
+        def produce(account: str, extractor: GmailExtractor):
+            try:
+                # Con il pool di parsing la pagina successiva si scarica durante il parsing
+                for emails, (message_ids, next_page_token) in extractor.iter_details_pipelined(
+                        new_ids_pages(account, extractor)):
+                    pages.put((account, emails, message_ids, next_page_token))
+            except Exception as e:
+                print(f"\n❌ Errore durante l'estrazione da {account}: {e}")
+            finally:
+                pages.put(done)
+        
+        threads = [
+            threading.Thread(target=produce, args=(account, extractor), daemon=True)
+            for account, extractor in self.extractors.items()
+        ]
+        for thread in threads:
+            thread.start()
+        
+        remaining = len(threads)
+        while remaining:
+            item = pages.get()
+            if item is done:
+                remaining -= 1
+                continue
+            yield item
+    
+    def print_quota_stats(self):
+        """
+        Mostra l'utilizzo della quota Gmail per ogni account
+        """
+        for account, extractor in self.extractors.items():
+            print(f"   {account}:", end=' ')
+            extractor.print_quota_stats()
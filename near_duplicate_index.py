@@ -0,0 +1,268 @@
+"""
+Indice locality-sensitive (MinHash + LSH) dei corpi email
+Trova varianti dello stesso template (nome, data, link di tracking diversi)
+"""
+
+import os
+import re
+import sys
+import json
+import zlib
+import random
+import sqlite3
+from array import array
+from typing import Dict, List, Optional, Tuple
+from analysis_cache import normalize_text
+from text_normalizer import normalize_body
+from dotenv import load_dotenv
+
+# Carica variabili d'ambiente
+load_dotenv()
+
+
+# Database in cui salvare l'indice, accanto alla tabella emails (vuoto = indice disattivato)
+NEAR_DUPLICATE_DB = os.getenv('NEAR_DUPLICATE_DB', 'emails.db')
+
+# Similarità di Jaccard stimata oltre la quale due email sono varianti dello stesso template
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv('NEAR_DUPLICATE_THRESHOLD', 0.8))
+
+# Campi di classificazione riutilizzabili tra varianti dello stesso template
+STRUCTURAL_FIELDS = ('email_type', 'campaign_type', 'funnel_stage', 'target_audience')
+
+# Parametri MinHash/LSH: 128 permutazioni in 16 bande da 8 righe
+NUM_PERM = 128
+NUM_BANDS = 16
+SHINGLE_SIZE = 4
+
+# Corpi con meno shingle non danno una stima affidabile
+MIN_SHINGLES = 10
+
+# Caratteri del corpo considerati per la firma
+MAX_BODY_CHARS = 20000
+
+# Primo di Mersenne 2^61 - 1 per l'hashing universale
+MERSENNE_PRIME = (1 << 61) - 1
+
+NUMBER_PATTERN = re.compile(r'\d+')
+
+# Coefficienti (a, b) delle permutazioni: fissi, così le firme restano confrontabili tra esecuzioni
+_rng = random.Random(20240601)
+PERMUTATIONS = [(_rng.randrange(1, MERSENNE_PRIME), _rng.randrange(0, MERSENNE_PRIME)) for _ in range(NUM_PERM)]
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> set:
+    """
+    Insieme delle sequenze di `size` parole consecutive del testo normalizzato
+    
+    I numeri diventano '0' (date, importi personalizzati e ID cambiano tra gli invii).
+    
+    Args:
+        text: Corpo dell'email
+        size: Parole per shingle
+    
+    Returns:
+        Set di shingle
+    """
+    words = NUMBER_PATTERN.sub('0', normalize_text(text[:MAX_BODY_CHARS])).split()
+    if len(words) < size:
+        return {' '.join(words)} if words else set()
+    return {' '.join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def minhash(shingle_set: set) -> List[int]:
+    """
+    Firma MinHash: per ogni permutazione (a*x + b) mod p, il minimo sugli shingle
+    
+    Args:
+        shingle_set: Shingle del documento
+    
+    Returns:
+        Lista di NUM_PERM valori
+    """
+    hashes = [zlib.crc32(shingle.encode('utf-8')) for shingle in shingle_set]
+    return [min((a * h + b) % MERSENNE_PRIME for h in hashes) for a, b in PERMUTATIONS]
+
+
+def estimate_similarity(signature_a: List[int], signature_b: List[int]) -> float:
+    """
+    Stima la similarità di Jaccard come frazione di valori MinHash uguali
+    """
+    equal = sum(1 for a, b in zip(signature_a, signature_b) if a == b)
+    return equal / len(signature_a)
+
+
+def band_keys(signature: List[int], bands: int = NUM_BANDS) -> List[str]:
+    """
+    Chiavi LSH: hash di ogni banda di righe della firma
+    """
+    rows = len(signature) // bands
+    return [
+        format(zlib.crc32(array('q', signature[band * rows:(band + 1) * rows]).tobytes()), '08x')
+        for band in range(bands)
+    ]
+
+
+class NearDuplicateIndex:
+    """
+    Indice MinHash/LSH salvato in SQLite con i campi strutturali di ogni email analizzata
+    """
+    
+    def __init__(self, db_path: str = NEAR_DUPLICATE_DB, threshold: float = NEAR_DUPLICATE_THRESHOLD):
+        """
+        Inizializza l'indice
+        
+        Args:
+            db_path: Database SQLite (di default lo stesso delle email)
+            threshold: Similarità minima per considerare due email varianti dello stesso template
+        """
+        self.db_path = db_path
+        self.threshold = threshold
+        self.matches = 0
+        self._create_tables()
+    
+    def _create_tables(self):
+        """
+        Crea le tabelle delle firme e delle bande LSH se non esistono
+        """
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS email_minhash (
+                email_id TEXT PRIMARY KEY,
+                signature BLOB NOT NULL,
+                structural_fields TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS email_lsh_bands (
+                band INTEGER NOT NULL,
+                bucket TEXT NOT NULL,
+                email_id TEXT NOT NULL,
+                PRIMARY KEY (band, bucket, email_id)
+            )
+        ''')
+        conn.commit()
+        conn.close()
+    
+    @staticmethod
+    def signature(body: str) -> Optional[List[int]]:
+        """
+        Firma MinHash del corpo di un'email
+        
+        Args:
+            body: Testo normalizzato del corpo (text_normalizer.email_body_text)
+        
+        Returns:
+            Firma, None se il corpo è troppo corto per una stima affidabile
+        """
+        shingle_set = shingles(body or '')
+        if len(shingle_set) < MIN_SHINGLES:
+            return None
+        return minhash(shingle_set)
+    
+    def add(self, email_id: str, signature: List[int], analysis: Dict):
+        """
+        Aggiunge un'email analizzata all'indice
+        
+        Args:
+            email_id: ID dell'email
+            signature: Firma calcolata con signature()
+            analysis: Analisi del modello (ne vengono salvati i campi strutturali)
+        """
+        structural = {field: analysis.get(field, '') for field in STRUCTURAL_FIELDS}
+        try:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT OR REPLACE INTO email_minhash (email_id, signature, structural_fields)
+                VALUES (?, ?, ?)
+            ''', (email_id, array('q', signature).tobytes(), json.dumps(structural)))
+            cursor.executemany('''
+                INSERT OR IGNORE INTO email_lsh_bands (band, bucket, email_id) VALUES (?, ?, ?)
+            ''', [(band, bucket, email_id) for band, bucket in enumerate(band_keys(signature))])
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            print(f"⚠️  Errore nell'aggiornamento dell'indice near-duplicate: {e}")
+    
+    def query(self, signature: List[int]) -> Optional[Tuple[str, float, Dict]]:
+        """
+        Cerca l'email indicizzata più simile sopra la soglia
+        
+        Args:
+            signature: Firma dell'email da confrontare
+        
+        Returns:
+            Tuple (email_id, similarità stimata, campi strutturali), None se nessuna
+        """
+        try:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            cursor = conn.cursor()
+            conditions = ' OR '.join(['(band = ? AND bucket = ?)'] * NUM_BANDS)
+            params = [value for band, bucket in enumerate(band_keys(signature)) for value in (band, bucket)]
+            cursor.execute(f'''
+                SELECT m.email_id, m.signature, m.structural_fields FROM email_minhash m
+                WHERE m.email_id IN (SELECT email_id FROM email_lsh_bands WHERE {conditions})
+            ''', params)
+            candidates = cursor.fetchall()
+            conn.close()
+        except Exception as e:
+            print(f"⚠️  Errore nella ricerca near-duplicate: {e}")
+            return None
+        
+        best = None
+        for email_id, blob, structural in candidates:
+            similarity = estimate_similarity(signature, array('q', blob).tolist())
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (email_id, similarity, json.loads(structural))
+        
+        if best:
+            self.matches += 1
+        return best
+    
+    def rebuild_from_emails(self, emails_db_path: str = 'emails.db') -> int:
+        """
+        Indicizza le email già analizzate nel database
+        
+        Args:
+            emails_db_path: Database con la tabella emails
+        
+        Returns:
+            Numero di email indicizzate
+        """
+        conn = sqlite3.connect(emails_db_path)
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT email_id, email_body, {', '.join(STRUCTURAL_FIELDS)} FROM emails
+            WHERE email_type NOT IN ('', 'unknown')
+        ''')
+        rows = cursor.fetchall()
+        conn.close()
+        
+        indexed = 0
+        for row in rows:
+            signature = self.signature(normalize_body(row['email_body'] or ''))
+            if signature is not None:
+                self.add(row['email_id'], signature, dict(row))
+                indexed += 1
+        return indexed
+
+
+def main():
+    """
+    Uso: python near_duplicate_index.py rebuild [emails.db]
+    """
+    if len(sys.argv) < 2 or sys.argv[1] != 'rebuild':
+        print(main.__doc__.strip())
+        return
+    
+    emails_db_path = sys.argv[2] if len(sys.argv) > 2 else 'emails.db'
+    index = NearDuplicateIndex(NEAR_DUPLICATE_DB or emails_db_path)
+    count = index.rebuild_from_emails(emails_db_path)
+    print(f"✅ Indicizzate {count} email per la ricerca near-duplicate")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""
+Pre-classificazione deterministica delle email, prima dell'analisi AI
+Ricevute, reset password, inviti di calendario e conversazioni personali
+vengono riconosciuti da label, header e mittente senza chiamare OpenAI
+"""
+
+import os
+import re
+from collections import Counter
+from email.utils import parseaddr
+from typing import Dict, Optional
+from dotenv import load_dotenv
+
+# Carica variabili d'ambiente
+load_dotenv()
+
+
+# Pre-classificazione attiva prima dell'analisi AI
+PRE_CLASSIFY = os.getenv('ANALYSIS_PRE_CLASSIFY', 'true').lower() == 'true'
+
+# Valore di analysis_model per le email classificate con le regole
+RULES_MODEL = 'rules'
+
+# Label Gmail che indicano posta promozionale: sempre all'analisi AI
+MARKETING_LABELS = {'CATEGORY_PROMOTIONS'}
+
+# Header presenti nelle mailing list e nelle newsletter
+LIST_HEADERS = ('list-unsubscribe', 'list-id')
+
+NOREPLY_PATTERN = re.compile(r'^(no-?reply|do-?not-?reply|notifications?|alerts?|security|account|accounts|'
+                             r'billing|receipts?|orders?|invoice|mailer-daemon|postmaster)\b', re.IGNORECASE)
+
+SECURITY_PATTERN = re.compile(
+    r'password reset|reset your password|reset password|verification code|verify your (email|account)|'
+    r'confirm your (email|account)|security (alert|code)|sign-?in (attempt|alert)|new sign-?in|'
+    r'one-time (code|password)|two-factor|2fa|login code|passcode', re.IGNORECASE)
+
+RECEIPT_PATTERN = re.compile(
+    r'\b(receipt|invoice|order confirm(ation|ed)|your order|order #|order no|payment (received|confirmation)|'
+    r'has shipped|shipping confirmation|out for delivery|delivered|refund|subscription renew(al|ed))\b',
+    re.IGNORECASE)
+
+CALENDAR_SUBJECT_PATTERN = re.compile(r'^(updated invitation|invitation|accepted|declined|tentatively accepted|'
+                                      r'canceled event|cancelled event)( with note)?:', re.IGNORECASE)
+
+CALENDAR_BODY_PATTERN = re.compile(r'BEGIN:VCALENDAR|invite\.ics|Invitation from Google Calendar', re.IGNORECASE)
+
+REPLY_PATTERN = re.compile(r'^(re|fwd?|r|i|aw|sv)\s*:', re.IGNORECASE)
+
+AMOUNT_PATTERN = re.compile(r'(?:[$€£]\s?\d[\d.,]*|\d[\d.,]*\s?(?:USD|EUR|GBP|€))')
+
+
+def _analysis(notes: str, email_type: str, campaign_type: str, target_audience: str,
+              funnel_stage: str, pricing_extract: str = '') -> Dict:
+    """
+    Campi dell'analisi nello stesso schema restituito dal modello
+    """
+    return {
+        'notes': notes,
+        'email_type': email_type,
+        'campaign_type': campaign_type,
+        'pricing_extract': pricing_extract,
+        'target_audience': target_audience,
+        'product_mentioned': '',
+        'retention': '',
+        'funnel_stage': funnel_stage
+    }
+
+
+class PreClassifier:
+    """
+    Regole deterministiche per i casi certi; le email ambigue restano all'analisi AI
+    """
+    
+    def __init__(self):
+        """
+        Inizializza i contatori delle regole
+        """
+        self.rule_counts = Counter()
+        self.checked = 0
+    
+    @property
+    def saved_calls(self) -> int:
+        """
+        Chiamate al modello evitate dall'avvio
+        """
+        return sum(self.rule_counts.values())
+    
+    def classify(self, email: Dict) -> Optional[Dict]:
+        """
+        Classifica un'email con le regole, se il caso è certo
+        
+        Args:
+            email: Email nel formato di GmailExtractor (from, subject, body, labels, headers)
+        
+        Returns:
+            Campi dell'analisi, None se l'email va analizzata dal modello
+        """
+        self.checked += 1
+        rule = self._match_rule(email)
+        if rule is None:
+            return None
+        
+        self.rule_counts[rule] += 1
+        subject = email.get('subject', '')
+        body = email.get('body', '') or ''
+        
+        if rule == 'calendar':
+            return _analysis('Rule-based: calendar invitation or response.',
+                             'personal', 'personal', 'invited attendee', '')
+        if rule == 'security':
+            return _analysis('Rule-based: account security or verification message.',
+                             'transactional', 'transactional', 'account holder', 'retention')
+        if rule == 'receipt':
+            amount = AMOUNT_PATTERN.search(f"{subject} {body[:2000]}")
+            return _analysis('Rule-based: receipt, order or shipping notification.',
+                             'transactional', 'transactional', 'existing customers', 'conversion',
+                             amount.group(0).strip() if amount else '')
+        if rule == 'notification':
+            return _analysis('Rule-based: automated account notification.',
+                             'transactional', 'transactional', 'account holder', 'retention')
+        return _analysis('Rule-based: personal conversation.', 'personal', 'personal', 'individual recipient', '')
+    
+    def _match_rule(self, email: Dict) -> Optional[str]:
+        """
+        Nome della prima regola che riconosce l'email (None = caso ambiguo)
+        """
+        labels = set(email.get('labels') or [])
+        headers = {name.lower(): value for name, value in (email.get('headers') or {}).items()}
+        subject = email.get('subject', '') or ''
+        body = (email.get('body', '') or '')[:5000]
+        local_part = parseaddr(email.get('from', ''))[1].split('@')[0]
+        
+        # Senza header (email salvate prima) non si può escludere una mailing list
+        headers_known = 'headers' in email
+        is_list = not headers_known or any(name in headers for name in LIST_HEADERS)
+        is_automated = (bool(NOREPLY_PATTERN.match(local_part))
+                        or headers.get('auto-submitted', 'no').lower() != 'no'
+                        or headers.get('precedence', '').lower() in ('bulk', 'list', 'junk'))
+        
+        if CALENDAR_SUBJECT_PATTERN.match(subject) or CALENDAR_BODY_PATTERN.search(body):
+            return 'calendar'
+        
+        # Le promozioni restano al modello anche se citano ordini o codici
+        if labels & MARKETING_LABELS:
+            return None
+        
+        if SECURITY_PATTERN.search(subject):
+            return 'security'
+        if RECEIPT_PATTERN.search(subject) and not is_list:
+            return 'receipt'
+        if 'CATEGORY_UPDATES' in labels and is_automated and not is_list:
+            return 'notification'
+        if not is_list and not is_automated and (
+                'CATEGORY_PERSONAL' in labels or 'SENT' in labels or REPLY_PATTERN.match(subject)):
+            return 'personal'
+        return None
+    
+    def get_stats(self) -> Dict:
+        """
+        Statistiche della pre-classificazione
+        
+        Returns:
+            Dizionario con email controllate, chiamate risparmiate e conteggi per regola
+        """
+        return {
+            'checked': self.checked,
+            'saved_calls': self.saved_calls,
+            'rules': dict(self.rule_counts)
+        }
@@ -8,6 +8,8 @@ from gmail_extractor import GmailExtractor
 from email_analyzer import EmailAnalyzer
 from database import EmailDatabase
 from account_manager import AccountManager
+from multi_account_extractor import MultiAccountExtractor
+from analysis_queue import AnalysisWorker
 
 # Carica le variabili d'ambiente
 load_dotenv()
@@ -17,6 +19,15 @@ OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 if not OPENAI_API_KEY:
     raise ValueError("OPENAI_API_KEY non trovata. Crea un file .env con la tua chiave API.")
 
+# Email estratte, analizzate e salvate per ogni blocco (limita la memoria usata)
+CHUNK_SIZE = int(os.getenv('BACKFILL_CHUNK_SIZE', 200))
+
+# 'realtime' = analisi immediata di ogni blocco, 'batch' = Batch API OpenAI (metà costo, risultati entro 24h)
+ANALYSIS_MODE = os.getenv('BACKFILL_ANALYSIS_MODE', 'realtime').lower()
+
+# In modalità 'batch': email raccolte prima di inviare un batch a OpenAI
+BATCH_ANALYSIS_SIZE = int(os.getenv('BACKFILL_BATCH_ANALYSIS_SIZE', 5000))
+
 
 def main():
     """
@@ -29,6 +40,7 @@ def main():
     # Step 1: Seleziona l'account Gmail
     print("\n🔐 Step 1: Selezione Account Gmail...")
     account_mgr = AccountManager()
+    all_accounts = False
     
     accounts = account_mgr.get_all_accounts()
     if len(accounts) > 1:
@@ -36,9 +48,12 @@ def main():
         for i, acc in enumerate(accounts):
             active = "✓" if acc.get('active') else " "
             print(f"  [{i+1}] {active} {acc['name']} ({acc.get('email', 'N/A')})")
+        print("  [T]   Tutti gli account in parallelo")
         
         choice = input("\nScegli l'account (invio per usare l'attivo): ").strip()
-        if choice:
+        if choice.lower() == 't':
+            all_accounts = True
+        elif choice:
             try:
                 account_mgr.set_active_account(int(choice) - 1)
             except:
@@ -46,40 +61,124 @@ def main():
     
     # Step 2: Connessione a Gmail
     print("\n🔐 Step 2: Connessione a Gmail...")
-    extractor = GmailExtractor(account_manager=account_mgr)
+    if all_accounts:
+        # Ogni account ha credenziali in memoria e un proprio rate limiter
+        extractor = MultiAccountExtractor(account_mgr)
+    else:
+        extractor = MultiAccountExtractor(extractors=[GmailExtractor(account_manager=account_mgr)])
+    
+    if not extractor.extractors:
+        print("❌ Impossibile connettersi a Gmail")
+        return
     
-    profile = extractor.get_profile()
-    if profile:
-        print(f"✅ Connesso a: {profile['emailAddress']}")
-        print(f"📊 Totale messaggi nell'account: {profile['messagesTotal']}")
+    db = EmailDatabase()
     
-    # Chiedi conferma
-    print("\n" + "="*80)
-    risposta = input("Vuoi estrarre TUTTE le email per l'analisi? (s/n): ")
+    # Il backfill è identificato da account + query, per poterlo riprendere
+    query = ''
+    job_keys = {account: f"{account}|{query}" for account in extractor.extractors}
     
-    if risposta.lower() not in ['s', 'si', 'sì', 'y', 'yes']:
-        print("❌ Operazione annullata.")
-        return
+    page_tokens = {}
+    processed_counts = {account: 0 for account in extractor.extractors}
+    checkpoints = {account: db.get_backfill_checkpoint(job_key) for account, job_key in job_keys.items()}
+    interrupted = {
+        account: checkpoint for account, checkpoint in checkpoints.items()
+        if checkpoint and checkpoint['status'] == 'running' and checkpoint['page_token']
+    }
     
-    print("\n🔍 Step 3: Estrazione email da Gmail...")
-    emails = extractor.extract_all_emails()
-    print(f"✅ Estratte {len(emails)} email!")
+    # Chiedi conferma
+    print("\n" + "="*80)
+    if interrupted:
+        for account, checkpoint in interrupted.items():
+            print(f"⏸️  Backfill interrotto trovato per {account}: {checkpoint['processed_count']} messaggi "
+                  f"già processati (ultimo aggiornamento: {checkpoint['updated_at']})")
+        risposta = input("Vuoi riprendere dal punto in cui si era fermato? (s/n): ")
+        if risposta.lower() in ['s', 'si', 'sì', 'y', 'yes']:
+            for account, checkpoint in checkpoints.items():
+                if account in interrupted:
+                    page_tokens[account] = checkpoint['page_token']
+                    processed_counts[account] = checkpoint['processed_count']
+                elif checkpoint and checkpoint['status'] == 'completed':
+                    # Backfill già completato per questo account
+                    extractor.extractors.pop(account)
+        else:
+            for account in interrupted:
+                db.delete_backfill_checkpoint(job_keys[account])
+    
+    if not page_tokens:
+        risposta = input("Vuoi estrarre TUTTE le email per l'analisi? (s/n): ")
+        
+        if risposta.lower() not in ['s', 'si', 'sì', 'y', 'yes']:
+            print("❌ Operazione annullata.")
+            return
     
-    # Step 3: Analizza le email con OpenAI
-    print("\n🤖 Step 4: Analisi email con AI (OpenAI)...")
+    # Step 3-5: Estrazione, analisi e salvataggio a blocchi, mentre l'estrazione prosegue
+    print(f"\n🔍 Step 3-5: Estrazione, analisi AI e salvataggio a blocchi di {CHUNK_SIZE} email...")
     print("⏳ Questo processo può richiedere alcuni minuti...")
     
     analyzer = EmailAnalyzer(api_key=OPENAI_API_KEY)
-    analyzed_emails = analyzer.analyze_batch(emails)
-    
-    print(f"✅ Analizzate {len(analyzed_emails)} email!")
+    # In tempo reale le email passano dalla coda condivisa con i monitor: le live hanno la precedenza
+    worker = AnalysisWorker(analyzer, db)
+    if ANALYSIS_MODE == 'batch':
+        print(f"📤 Analisi con la Batch API di OpenAI, a gruppi di {BATCH_ANALYSIS_SIZE} email")
+    
+    extracted_count = 0
+    saved_count = 0
+    
+    # Batch inviati prima di un'interruzione: salvati ora, le pagine ripetute li saltano come già presenti
+    resumed_emails = analyzer.resume_offline_batches()
+    if resumed_emails:
+        saved_count += db.save_batch(resumed_emails)
+        print(f"💾 Salvate {saved_count} email dei batch ripresi")
+    
+    # Pagine estratte in attesa di analisi: (account, email, ID della pagina, token successivo)
+    pending_pages = []
+    
+    def process_pending_pages():
+        nonlocal saved_count
+        emails = [email for _, page_emails, _, _ in pending_pages for email in page_emails]
+        if emails:
+            if ANALYSIS_MODE == 'batch':
+                analyzed_emails = analyzer.analyze_batch_offline(emails)
+                saved_count += db.save_batch(analyzed_emails)
+            else:
+                worker.submit(emails)
+                saved_count = worker.saved_count
+            print(f"💾 Salvate finora: {saved_count}/{extracted_count}")
+            extractor.print_quota_stats()
+        
+        # Checkpoint dopo il salvataggio: un riavvio riparte da next_page_token
+        for account, _, message_ids, next_page_token in pending_pages:
+            processed_counts[account] += len(message_ids)
+            db.save_backfill_checkpoint(
+                job_keys[account],
+                next_page_token,
+                processed_counts[account],
+                message_ids[-1] if message_ids else '',
+                status='running' if next_page_token else 'completed'
+            )
+        pending_pages.clear()
+    
+    # Salta i messaggi già salvati (es. pagina interrotta a metà) prima di scaricarli
+    pages = extractor.iter_email_pages(
+        query=query,
+        page_size=CHUNK_SIZE,
+        page_tokens=page_tokens,
+        skip_existing=db.get_existing_email_ids
+    )
+    for chunk_num, (account, emails, message_ids, next_page_token) in enumerate(pages, 1):
+        if emails:
+            extracted_count += len(emails)
+            print(f"\n📦 Blocco {chunk_num} [{account}]: {len(emails)} email (totale estratte: {extracted_count})")
+        
+        pending_pages.append((account, emails, message_ids, next_page_token))
+        pending_emails = sum(len(page_emails) for _, page_emails, _, _ in pending_pages)
+        if ANALYSIS_MODE != 'batch' or pending_emails >= BATCH_ANALYSIS_SIZE:
+            process_pending_pages()
     
-    # Step 4: Salva nel database
-    print("\n💾 Step 5: Salvataggio nel database...")
-    db = EmailDatabase()
-    saved_count = db.save_batch(analyzed_emails)
+    process_pending_pages()
     
-    print(f"✅ Salvate {saved_count}/{len(analyzed_emails)} email nel database!")
+    print(f"\n✅ Estratte {extracted_count} email!")
+    print(f"✅ Salvate {saved_count}/{extracted_count} email nel database!")
     
     # Step 5: Mostra statistiche
     print("\n📊 Step 6: Statistiche")
@@ -0,0 +1,287 @@
+"""
+Rate limiter basato sulle quota unit dell'API Gmail e budget RPM/TPM per l'API OpenAI
+"""
+
+import os
+import time
+import asyncio
+import random
+import threading
+from typing import Callable, Dict, Optional
+from googleapiclient.errors import HttpError
+from dotenv import load_dotenv
+
+# Carica variabili d'ambiente
+load_dotenv()
+
+
+# Costo in quota unit di ogni metodo dell'API Gmail
+# https://developers.google.com/gmail/api/reference/quota
+QUOTA_COSTS = {
+    'messages.get': 5,
+    'messages.list': 5,
+    'history.list': 2,
+    'labels.list': 1,
+    'users.getProfile': 1
+}
+
+# Limite Gmail per utente: 250 quota unit al secondo
+GMAIL_QUOTA_UNITS_PER_SECOND = float(os.getenv('GMAIL_QUOTA_UNITS_PER_SECOND', 250))
+
+# Motivi di errore 403 che indicano un superamento del rate limit
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded')
+
+
+class QuotaRateLimiter:
+    """
+    Token bucket che conosce il costo di ogni metodo Gmail e adatta la velocità
+    quando Gmail risponde con errori di rate limit
+    """
+    
+    def __init__(self, units_per_second: float = GMAIL_QUOTA_UNITS_PER_SECOND,
+                 max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 64.0):
+        """
+        Inizializza il rate limiter
+        
+        Args:
+            units_per_second: Quota unit al secondo consentite (velocità massima)
+            max_retries: Tentativi massimi per una chiamata limitata o fallita (5xx)
+            base_delay: Attesa iniziale del backoff esponenziale in secondi
+            max_delay: Attesa massima del backoff in secondi
+        """
+        self.max_rate = units_per_second
+        self.min_rate = max(units_per_second / 20, 1.0)
+        self.rate = units_per_second
+        self.capacity = units_per_second
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        
+        self._tokens = units_per_second
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+        
+        # Statistiche
+        self._started_at = time.monotonic()
+        self.units_consumed = 0
+        self.calls = 0
+        self.rate_limited = 0
+        self.retries = 0
+    
+    def acquire(self, units: int):
+        """
+        Attende finché non sono disponibili `units` quota unit
+        
+        Args:
+            units: Quota unit richieste
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+                self._last_refill = now
+                
+                # Richieste più grandi del bucket (es. batch) passano a bucket pieno
+                needed = min(units, self.capacity)
+                if self._tokens >= needed:
+                    self._tokens -= units
+                    self.units_consumed += units
+                    self.calls += 1
+                    return
+                
+                wait = (needed - self._tokens) / self.rate
+            time.sleep(wait)
+    
+    def execute(self, request, method: str, units: Optional[int] = None):
+        """
+        Esegue una richiesta dell'API Gmail rispettando la quota
+        
+        Args:
+            request: HttpRequest di googleapiclient
+            method: Nome del metodo (es. 'messages.get') per calcolarne il costo
+            units: Costo esplicito in quota unit (opzionale)
+        
+        Returns:
+            Risposta della richiesta
+        """
+        return self.call(request.execute, units if units is not None else QUOTA_COSTS.get(method, 5))
+    
+    def call(self, func: Callable, units: int):
+        """
+        Esegue una funzione che consuma `units` quota unit, con retry e backoff
+        
+        Args:
+            func: Funzione da eseguire (senza argomenti)
+            units: Quota unit consumate da una chiamata
+        
+        Returns:
+            Risultato della funzione
+        
+        Raises:
+            HttpError: Se l'errore non è recuperabile o i tentativi sono esauriti
+        """
+        attempt = 0
+        while True:
+            self.acquire(units)
+            try:
+                result = func()
+                self.on_success()
+                return result
+            except HttpError as error:
+                if not self.is_retryable(error) or attempt >= self.max_retries:
+                    raise
+                if self.is_rate_limit_error(error):
+                    self.on_rate_limited()
+                self.backoff(attempt)
+                attempt += 1
+    
+    def backoff(self, attempt: int):
+        """
+        Attende con backoff esponenziale e jitter prima di un nuovo tentativo
+        
+        Args:
+            attempt: Numero del tentativo (0 = primo retry)
+        """
+        self.retries += 1
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        time.sleep(random.uniform(0, delay))
+    
+    def on_rate_limited(self):
+        """
+        Dimezza la velocità dopo una risposta di rate limit
+        """
+        with self._lock:
+            self.rate_limited += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = min(self._tokens, 0)
+    
+    def on_success(self):
+        """
+        Recupera gradualmente la velocità dopo una chiamata riuscita
+        """
+        with self._lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * 0.01)
+    
+    @staticmethod
+    def is_rate_limit_error(error: HttpError) -> bool:
+        """
+        Verifica se un HttpError è dovuto al superamento della quota (429/403)
+        
+        Args:
+            error: Errore restituito dall'API Gmail
+        """
+        status = error.resp.status
+        if status == 429:
+            return True
+        if status == 403:
+            content = error.content.decode('utf-8', errors='ignore') if isinstance(error.content, bytes) else str(error.content)
+            return any(reason in content for reason in RATE_LIMIT_REASONS)
+        return False
+    
+    @classmethod
+    def is_retryable(cls, error: HttpError) -> bool:
+        """
+        Verifica se un HttpError può essere ritentato (rate limit o errore 5xx)
+        
+        Args:
+            error: Errore restituito dall'API Gmail
+        """
+        return cls.is_rate_limit_error(error) or error.resp.status >= 500
+    
+    def get_stats(self) -> Dict:
+        """
+        Recupera le statistiche di utilizzo della quota
+        
+        Returns:
+            Dizionario con quota unit consumate, velocità ottenuta e attuale
+        """
+        elapsed = time.monotonic() - self._started_at
+        return {
+            'units_consumed': self.units_consumed,
+            'calls': self.calls,
+            'elapsed_seconds': round(elapsed, 1),
+            'units_per_second': round(self.units_consumed / elapsed, 1) if elapsed > 0 else 0.0,
+            'current_rate': round(self.rate, 1),
+            'max_rate': self.max_rate,
+            'rate_limited': self.rate_limited,
+            'retries': self.retries
+        }
+
+
+class AsyncRateBudget:
+    """
+    Budget di richieste e token al minuto per l'API OpenAI, condiviso tra coroutine
+    
+    Due token bucket (richieste e token) che si ricaricano in modo continuo:
+    una chiamata parte solo quando entrambi hanno capacità sufficiente.
+    """
+    
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        """
+        Inizializza il budget
+        
+        Args:
+            requests_per_minute: Richieste al minuto consentite (RPM)
+            tokens_per_minute: Token al minuto consentiti (TPM)
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = requests_per_minute
+        self._tokens = tokens_per_minute
+        self._last_refill = time.monotonic()
+        self._lock = None
+        self._lock_loop = None
+        
+        # Statistiche
+        self.waited_seconds = 0.0
+        self.tokens_used = 0
+    
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+        self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+    
+    async def acquire(self, tokens: int):
+        """
+        Attende finché una richiesta da `tokens` token rientra nel budget
+        
+        Args:
+            tokens: Token stimati della richiesta (prompt + risposta)
+        """
+        # Il lock è legato al loop in cui viene usato: ogni asyncio.run (un batch) ne crea uno nuovo.
+        # I bucket dipendono solo dal tempo e restano condivisi tra un batch e il successivo
+        loop = asyncio.get_running_loop()
+        if self._lock is None or self._lock_loop is not loop:
+            self._lock = asyncio.Lock()
+            self._lock_loop = loop
+        
+        async with self._lock:
+            # Richieste più grandi del bucket passano a bucket pieno
+            needed_tokens = min(tokens, self.tokens_per_minute)
+            while True:
+                self._refill()
+                if self._requests >= 1 and self._tokens >= needed_tokens:
+                    self._requests -= 1
+                    self._tokens -= tokens
+                    return
+                wait = max(
+                    (1 - self._requests) * 60 / self.requests_per_minute,
+                    (needed_tokens - self._tokens) * 60 / self.tokens_per_minute,
+                    0.01
+                )
+                self.waited_seconds += wait
+                await asyncio.sleep(wait)
+    
+    def record_usage(self, estimated_tokens: int, actual_tokens: int):
+        """
+        Corregge il budget con i token effettivamente usati dalla risposta
+        
+        Args:
+            estimated_tokens: Token prenotati con acquire()
+            actual_tokens: Token riportati da OpenAI (usage.total_tokens)
+        """
+        self.tokens_used += actual_tokens
+        self._tokens = min(self.tokens_per_minute, self._tokens + estimated_tokens - actual_tokens)
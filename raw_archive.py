@@ -0,0 +1,474 @@
+"""
+Archivio locale compresso dei messaggi RFC822 originali
+Permette di ri-parsare e ri-analizzare le email senza scaricarle di nuovo da Gmail
+"""
+
+import os
+import sys
+import json
+import zlib
+import sqlite3
+import hashlib
+import mailbox
+from email import policy
+from email.parser import BytesHeaderParser
+from typing import Dict, Iterator, List, Optional, Tuple
+from message_parser import parse_raw_message
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Estensione dei file per ogni codec di compressione
+CODEC_EXTENSIONS = {
+    'zstd': '.zst',
+    'zlib': '.zz'
+}
+
+
+class RawMessageArchive:
+    """
+    Archivio content-addressed dei messaggi raw, indicizzato per ID messaggio
+    
+    Ogni messaggio è salvato compresso in objects/<sha256[:2]>/<sha256>.<ext>;
+    un indice SQLite associa l'ID Gmail all'hash e ai metadati (thread, label).
+    Messaggi identici occupano spazio una sola volta.
+    """
+    
+    def __init__(self, root_dir: str = 'raw_archive', codec: Optional[str] = None, level: int = 3):
+        """
+        Inizializza l'archivio
+        
+        Args:
+            root_dir: Cartella dell'archivio
+            codec: 'zstd' o 'zlib' (default: zstd se installato, altrimenti zlib)
+            level: Livello di compressione
+        """
+        if codec is None:
+            codec = 'zstd' if zstandard else 'zlib'
+        if codec == 'zstd' and zstandard is None:
+            raise ValueError("Codec zstd richiesto ma il pacchetto 'zstandard' non è installato")
+        if codec not in CODEC_EXTENSIONS:
+            raise ValueError(f"Codec non supportato: {codec}")
+        
+        self.root_dir = root_dir
+        self.codec = codec
+        self.level = level
+        self.index_path = os.path.join(root_dir, 'index.db')
+        
+        os.makedirs(os.path.join(root_dir, 'objects'), exist_ok=True)
+        self._create_tables()
+    
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Apre una connessione all'indice (usata anche da più thread)
+        """
+        return sqlite3.connect(self.index_path, timeout=30)
+    
+    def _create_tables(self):
+        """
+        Crea l'indice dei messaggi se non esiste
+        """
+        conn = self._connect()
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS messages (
+                message_id TEXT PRIMARY KEY,
+                sha256 TEXT NOT NULL,
+                codec TEXT NOT NULL,
+                size INTEGER,
+                compressed_size INTEGER,
+                thread_id TEXT,
+                labels TEXT,
+                snippet TEXT,
+                stored_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_archive_sha256 ON messages(sha256)')
+        conn.commit()
+        conn.close()
+    
+    def _object_path(self, sha256: str, codec: str) -> str:
+        """
+        Path del file compresso per un hash
+        """
+        return os.path.join(self.root_dir, 'objects', sha256[:2], sha256 + CODEC_EXTENSIONS[codec])
+    
+    def _compress(self, raw: bytes) -> bytes:
+        if self.codec == 'zstd':
+            return zstandard.ZstdCompressor(level=self.level).compress(raw)
+        return zlib.compress(raw, self.level)
+    
+    @staticmethod
+    def _decompress(data: bytes, codec: str) -> bytes:
+        if codec == 'zstd':
+            if zstandard is None:
+                raise ValueError("Messaggio compresso con zstd ma il pacchetto 'zstandard' non è installato")
+            return zstandard.ZstdDecompressor().decompress(data)
+        return zlib.decompress(data)
+    
+    def put(self, message_id: str, raw: bytes, thread_id: str = '',
+            labels: Optional[List[str]] = None, snippet: str = '') -> str:
+        """
+        Salva un messaggio raw nell'archivio
+        
+        Args:
+            message_id: ID Gmail del messaggio
+            raw: Byte RFC822 del messaggio
+            thread_id: ID del thread
+            labels: Label Gmail del messaggio
+            snippet: Snippet Gmail del messaggio
+        
+        Returns:
+            Hash sha256 del contenuto
+        """
+        sha256 = hashlib.sha256(raw).hexdigest()
+        path = self._object_path(sha256, self.codec)
+        compressed_size = None
+        
+        if not os.path.exists(path):
+            data = self._compress(raw)
+            compressed_size = len(data)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Scrittura atomica: un file parziale non viene mai letto
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        else:
+            compressed_size = os.path.getsize(path)
+        
+        conn = self._connect()
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT OR REPLACE INTO messages (
+                message_id, sha256, codec, size, compressed_size, thread_id, labels, snippet
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (message_id, sha256, self.codec, len(raw), compressed_size,
+              thread_id, json.dumps(labels or []), snippet))
+        conn.commit()
+        conn.close()
+        return sha256
+    
+    def get(self, message_id: str) -> Optional[bytes]:
+        """
+        Legge un messaggio raw dall'archivio
+        
+        Args:
+            message_id: ID Gmail del messaggio
+        
+        Returns:
+            Byte RFC822 del messaggio, None se non archiviato
+        """
+        entry = self.get_metadata(message_id)
+        if not entry:
+            return None
+        return self._read_object(entry['sha256'], entry['codec'])
+    
+    def _read_object(self, sha256: str, codec: str) -> bytes:
+        with open(self._object_path(sha256, codec), 'rb') as f:
+            return self._decompress(f.read(), codec)
+    
+    def discard(self, message_id: str):
+        """
+        Rimuove un messaggio non leggibile, così il prossimo put() riscrive l'oggetto
+        
+        Args:
+            message_id: ID Gmail del messaggio
+        """
+        entry = self.get_metadata(message_id)
+        if not entry:
+            return
+        
+        # Un oggetto corrotto va eliminato: put() non sovrascrive i file già presenti
+        path = self._object_path(entry['sha256'], entry['codec'])
+        if os.path.exists(path):
+            os.remove(path)
+        
+        conn = self._connect()
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM messages WHERE message_id = ?', (message_id,))
+        conn.commit()
+        conn.close()
+    
+    def get_metadata(self, message_id: str) -> Optional[Dict]:
+        """
+        Recupera i metadati di un messaggio archiviato
+        
+        Args:
+            message_id: ID Gmail del messaggio
+        
+        Returns:
+            Dizionario con sha256, codec, dimensioni, thread_id, labels e snippet
+        """
+        conn = self._connect()
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM messages WHERE message_id = ?', (message_id,))
+        row = cursor.fetchone()
+        conn.close()
+        
+        if not row:
+            return None
+        entry = dict(row)
+        entry['labels'] = json.loads(entry.get('labels') or '[]')
+        return entry
+    
+    def get_existing_ids(self, message_ids: List[str]) -> set:
+        """
+        Restituisce gli ID già presenti nell'archivio
+        
+        Args:
+            message_ids: ID da controllare
+        
+        Returns:
+            Set degli ID archiviati
+        """
+        conn = self._connect()
+        cursor = conn.cursor()
+        existing = set()
+        for start in range(0, len(message_ids), 500):
+            chunk = message_ids[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            cursor.execute(f'SELECT message_id FROM messages WHERE message_id IN ({placeholders})', chunk)
+            existing.update(row[0] for row in cursor.fetchall())
+        conn.close()
+        return existing
+    
+    def iter_messages(self) -> Iterator[Tuple[Dict, bytes]]:
+        """
+        Scorre tutti i messaggi archiviati
+        
+        Yields:
+            Tuple (metadati, byte RFC822)
+        """
+        conn = self._connect()
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM messages ORDER BY message_id')
+        
+        for row in cursor:
+            entry = dict(row)
+            entry['labels'] = json.loads(entry.get('labels') or '[]')
+            yield entry, self._read_object(entry['sha256'], entry['codec'])
+        
+        conn.close()
+    
+    def iter_parsed(self) -> Iterator[Dict]:
+        """
+        Ri-parsa tutti i messaggi archiviati, senza chiamate a Gmail
+        
+        Yields:
+            Dizionari nello stesso formato di GmailExtractor._parse_message
+        """
+        for entry, raw in self.iter_messages():
+            parsed = parse_raw_message(raw)
+            parsed.update({
+                'id': entry['message_id'],
+                'thread_id': entry['thread_id'] or '',
+                'snippet': entry['snippet'] or '',
+                'labels': entry['labels']
+            })
+            yield parsed
+    
+    def get_stats(self) -> Dict:
+        """
+        Statistiche dell'archivio
+        
+        Returns:
+            Dizionario con numero di messaggi, oggetti unici e dimensioni
+        """
+        conn = self._connect()
+        cursor = conn.cursor()
+        cursor.execute('SELECT COUNT(*), COUNT(DISTINCT sha256), COALESCE(SUM(size), 0) FROM messages')
+        messages, objects, raw_bytes = cursor.fetchone()
+        cursor.execute('''
+            SELECT COALESCE(SUM(compressed_size), 0) FROM (
+                SELECT MAX(compressed_size) AS compressed_size FROM messages GROUP BY sha256
+            )
+        ''')
+        stored_bytes = cursor.fetchone()[0]
+        conn.close()
+        
+        return {
+            'messages': messages,
+            'objects': objects,
+            'raw_bytes': raw_bytes,
+            'stored_bytes': stored_bytes,
+            'ratio': round(raw_bytes / stored_bytes, 2) if stored_bytes else 0.0
+        }
+    
+    def export_mbox(self, mbox_path: str) -> int:
+        """
+        Esporta l'archivio in un file mbox nel formato di Google Takeout
+        
+        L'ID del messaggio va nella riga "From " e il thread in X-GM-THRID,
+        entrambi in decimale come in Takeout; le label in X-Gmail-Labels.
+        Così import_mbox (e l'importer Takeout) ricostruiscono gli stessi ID.
+        
+        Args:
+            mbox_path: Path del file mbox da creare
+        
+        Returns:
+            Numero di messaggi esportati
+        """
+        box = mailbox.mbox(mbox_path)
+        box.lock()
+        count = 0
+        try:
+            for entry, raw in self.iter_messages():
+                message = mailbox.mboxMessage(raw)
+                for header in ('X-GM-THRID', 'X-Gmail-Labels'):
+                    del message[header]
+                if entry['thread_id']:
+                    message['X-GM-THRID'] = gmail_id_to_decimal(entry['thread_id'])
+                message['X-Gmail-Labels'] = ','.join(entry['labels'])
+                message.set_from(f"{gmail_id_to_decimal(entry['message_id'])}@xxx", True)
+                box.add(message)
+                count += 1
+            box.flush()
+        finally:
+            box.unlock()
+            box.close()
+        return count
+    
+    def import_mbox(self, mbox_path: str) -> int:
+        """
+        Importa i messaggi di un file mbox (Takeout o export_mbox) nell'archivio
+        
+        L'ID del messaggio è ricavato dalla riga "From "; se non è nel formato
+        Takeout si usa l'hash del contenuto.
+        
+        Args:
+            mbox_path: Path del file mbox
+        
+        Returns:
+            Numero di messaggi importati
+        """
+        box = mailbox.mbox(mbox_path, create=False)
+        count = 0
+        try:
+            for key in box.iterkeys():
+                with box.get_file(key, True) as f:
+                    from_line = f.readline().decode('utf-8', errors='ignore')
+                    raw = f.read()
+                
+                headers = BytesHeaderParser(policy=policy.default).parsebytes(raw)
+                message_id = takeout_message_id(from_line) or hashlib.sha256(raw).hexdigest()
+                thread_id = decimal_to_gmail_id(str(headers.get('X-GM-THRID') or ''))
+                labels = [label.strip() for label in str(headers.get('X-Gmail-Labels') or '').split(',')
+                          if label.strip()]
+                
+                self.put(message_id, raw, thread_id or '', labels)
+                count += 1
+        finally:
+            box.close()
+        return count
+
+
+def decimal_to_gmail_id(value: str) -> Optional[str]:
+    """
+    Converte un ID Gmail decimale (X-GM-MSGID / X-GM-THRID) nel formato esadecimale dell'API
+    
+    Args:
+        value: ID decimale
+    
+    Returns:
+        ID esadecimale, None se il valore non è un numero
+    """
+    value = value.strip()
+    if not value.isdigit():
+        return None
+    return format(int(value), 'x')
+
+
+def gmail_id_to_decimal(value: str) -> str:
+    """
+    Converte un ID Gmail dell'API (esadecimale) nel formato decimale di Takeout
+    
+    Args:
+        value: ID esadecimale
+    
+    Returns:
+        ID decimale, oppure il valore originale se non è esadecimale
+    """
+    try:
+        return str(int(value, 16))
+    except ValueError:
+        return value
+
+
+def takeout_message_id(from_line: str) -> Optional[str]:
+    """
+    Ricava l'ID Gmail (esadecimale, come nell'API) dalla riga "From " di Google Takeout
+    
+    Takeout scrive "From <X-GM-MSGID decimale>@xxx <data>".
+    
+    Args:
+        from_line: Prima riga del messaggio nel file mbox
+    
+    Returns:
+        ID esadecimale del messaggio, None se la riga non ha questo formato
+    """
+    parts = from_line.split()
+    if len(parts) < 2 or parts[0] != 'From':
+        return None
+    return decimal_to_gmail_id(parts[1].split('@')[0])
+
+
+def reparse_into_database(archive: RawMessageArchive, db_path: str = 'emails.db',
+                          chunk_size: int = 500) -> int:
+    """
+    Ri-parsa i messaggi archiviati e aggiorna il corpo delle email nel database
+    
+    Args:
+        archive: Archivio dei messaggi raw
+        db_path: Path del database SQLite
+        chunk_size: Email aggiornate per transazione
+    
+    Returns:
+        Numero di email aggiornate
+    """
+    from database import EmailDatabase
+    
+    db = EmailDatabase(db_path)
+    updated = 0
+    bodies = {}
+    for parsed in archive.iter_parsed():
+        bodies[parsed['id']] = parsed['body']
+        if len(bodies) >= chunk_size:
+            updated += db.update_email_bodies(bodies)
+            bodies = {}
+    if bodies:
+        updated += db.update_email_bodies(bodies)
+    return updated
+
+
+def main():
+    """
+    Comandi: stats | export <file.mbox> | import <file.mbox> | reparse [emails.db]
+    """
+    archive = RawMessageArchive(os.getenv('GMAIL_RAW_ARCHIVE_DIR') or 'raw_archive')
+    command = sys.argv[1] if len(sys.argv) > 1 else 'stats'
+    
+    if command == 'export' and len(sys.argv) > 2:
+        count = archive.export_mbox(sys.argv[2])
+        print(f"✅ Esportati {count} messaggi in {sys.argv[2]}")
+    elif command == 'import' and len(sys.argv) > 2:
+        count = archive.import_mbox(sys.argv[2])
+        print(f"✅ Importati {count} messaggi da {sys.argv[2]}")
+    elif command == 'reparse':
+        db_path = sys.argv[2] if len(sys.argv) > 2 else 'emails.db'
+        count = reparse_into_database(archive, db_path)
+        print(f"✅ Aggiornate {count} email in {db_path} dall'archivio")
+    else:
+        stats = archive.get_stats()
+        print(f"📦 Archivio raw ({archive.codec}): {stats['messages']} messaggi, {stats['objects']} oggetti unici")
+        print(f"   {stats['raw_bytes'] / 1024 / 1024:.1f} MB originali -> "
+              f"{stats['stored_bytes'] / 1024 / 1024:.1f} MB su disco (x{stats['ratio']})")
+
+
+if __name__ == '__main__':
+    main()
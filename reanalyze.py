@@ -0,0 +1,171 @@
+"""
+Rianalisi selettiva delle email salvate
+Richiede al modello solo i campi la cui versione (FIELD_VERSIONS in email_analyzer.py)
+è cambiata dopo l'analisi salvata, con lo stesso percorso concorrente del backfill
+
+Uso: python reanalyze.py [--fields notes,email_type] [--sender dominio.com] [--since 2025-01-01]
+                         [--until 2025-12-31] [--model gpt-4o-mini] [--limit N] [--dry-run]
+"""
+
+import os
+import json
+import argparse
+from collections import Counter
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Optional
+from dotenv import load_dotenv
+from database import EmailDatabase
+from email_analyzer import EmailAnalyzer, ANALYSIS_FIELDS, FIELD_VERSIONS, PROMPT_VERSION
+
+# Carica variabili d'ambiente
+load_dotenv()
+
+# Email rianalizzate e salvate per ogni blocco (un'interruzione perde al massimo un blocco)
+REANALYZE_CHUNK_SIZE = int(os.getenv('REANALYZE_CHUNK_SIZE', 500))
+
+
+def parse_day(value: str) -> datetime:
+    """
+    Data YYYY-MM-DD come datetime UTC (per argparse)
+    """
+    return datetime.strptime(value, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+
+
+def email_datetime(date: str) -> Optional[datetime]:
+    """
+    Data di un'email salvata (header Date) come datetime, None se non leggibile
+    """
+    try:
+        parsed = parsedate_to_datetime(date)
+    except (TypeError, ValueError):
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def row_to_email(row: Dict) -> Dict:
+    """
+    Converte una riga della tabella emails nel formato di GmailExtractor,
+    con l'analisi corrente e i campi da rianalizzare
+    """
+    return {
+        'id': row['email_id'],
+        'thread_id': row.get('thread_id', ''),
+        'from': row.get('sender', ''),
+        'subject': row.get('subject', ''),
+        'body': row.get('email_body', ''),
+        'email_body_text': row.get('email_body_text'),
+        'snippet': row.get('snippet', ''),
+        'date': row.get('date', ''),
+        'labels': json.loads(row['labels']) if row.get('labels') else [],
+        'analysis': {field: row.get(field) or '' for field in ANALYSIS_FIELDS},
+        'analysis_fields': row.get('analysis_fields') or {},
+        'stale_fields': row['stale_fields']
+    }
+
+
+def select_emails(db: EmailDatabase, args) -> List[Dict]:
+    """
+    Email da rianalizzare secondo i filtri della riga di comando
+    """
+    # Il filtro per data è applicato dopo la query: il limite va applicato dopo il filtro
+    with_dates = args.since is not None or args.until is not None
+    rows = db.get_stale_analyses(FIELD_VERSIONS, args.fields, args.sender, args.model,
+                                 None if with_dates else args.limit)
+    if with_dates:
+        selected = []
+        for row in rows:
+            date = email_datetime(row.get('date', ''))
+            if date is None:
+                continue
+            if args.since is not None and date < args.since:
+                continue
+            # --until include l'intera giornata indicata
+            if args.until is not None and (date - args.until).days >= 1:
+                continue
+            selected.append(row)
+        rows = selected[:args.limit] if args.limit else selected
+    return [row_to_email(row) for row in rows if row.get('email_id')]
+
+
+def save_results(db: EmailDatabase, emails: List[Dict], results: List[Optional[Dict]]) -> int:
+    """
+    Salva i campi rianalizzati e le loro nuove versioni
+    
+    Returns:
+        Numero di email aggiornate
+    """
+    updated = 0
+    for email, values in zip(emails, results):
+        if values is None:
+            continue
+        model = values.pop('analysis_model')
+        field_versions = {**email['analysis_fields'], **{field: FIELD_VERSIONS[field] for field in values}}
+        if db.update_analysis_fields(email['id'], values, field_versions, PROMPT_VERSION, model):
+            updated += 1
+    return updated
+
+
+def main():
+    """
+    Rianalizza le email con campi obsoleti
+    """
+    parser = argparse.ArgumentParser(description='Rianalisi selettiva dei campi obsoleti delle email salvate')
+    parser.add_argument('--fields', type=lambda value: [field.strip() for field in value.split(',') if field.strip()],
+                        help='Campi da rianalizzare comunque, separati da virgola (default: solo quelli obsoleti)')
+    parser.add_argument('--sender', help='Solo i mittenti che contengono questo testo')
+    parser.add_argument('--since', type=parse_day, help='Solo email dal giorno indicato (YYYY-MM-DD)')
+    parser.add_argument('--until', type=parse_day, help='Solo email fino al giorno indicato (YYYY-MM-DD)')
+    parser.add_argument('--model', help='Solo analisi prodotte da questo modello (es. rules, gpt-4o-mini)')
+    parser.add_argument('--limit', type=int, help='Numero massimo di email')
+    parser.add_argument('--dry-run', action='store_true', help='Mostra cosa verrebbe rianalizzato senza chiamare il modello')
+    parser.add_argument('--db', default='emails.db', help='Database delle email')
+    args = parser.parse_args()
+    
+    unknown = [field for field in args.fields or [] if field not in ANALYSIS_FIELDS]
+    if unknown:
+        parser.error(f"campi sconosciuti: {', '.join(unknown)} (disponibili: {', '.join(ANALYSIS_FIELDS)})")
+    
+    db = EmailDatabase(args.db)
+    emails = select_emails(db, args)
+    
+    print("="*80)
+    print("🔄 RIANALISI SELETTIVA")
+    print("="*80)
+    print(f"📧 Email da rianalizzare: {len(emails)}")
+    if not emails:
+        print("✅ Tutte le analisi sono aggiornate")
+        return
+    
+    field_counts = Counter(field for email in emails for field in email['stale_fields'])
+    for field, count in field_counts.most_common():
+        print(f"   • {field}: {count} email (versione {FIELD_VERSIONS[field]})")
+    requested = sum(field_counts.values())
+    print(f"📉 Campi richiesti: {requested}/{len(emails) * len(ANALYSIS_FIELDS)} "
+          f"({requested / (len(emails) * len(ANALYSIS_FIELDS)) * 100:.0f}% di una rianalisi completa)")
+    
+    if args.dry_run:
+        return
+    
+    api_key = os.getenv('OPENAI_API_KEY')
+    if not api_key:
+        raise ValueError("OPENAI_API_KEY non trovata nel file .env")
+    analyzer = EmailAnalyzer(api_key=api_key)
+    
+    updated = 0
+    failed = 0
+    for start in range(0, len(emails), REANALYZE_CHUNK_SIZE):
+        chunk = emails[start:start + REANALYZE_CHUNK_SIZE]
+        results = analyzer.reanalyze_fields(chunk)
+        failed += results.count(None)
+        updated += save_results(db, chunk, results)
+        print(f"\n💾 Aggiornate {updated}/{len(emails)} email")
+    
+    print(f"\n✅ Rianalisi completata: {updated} email aggiornate, {failed} fallite")
+    usage = analyzer.usage_totals
+    print(f"🔢 Richieste: {usage['requests']}, token: {usage['prompt_tokens']} prompt + "
+          f"{usage['completion_tokens']} risposta")
+
+
+if __name__ == '__main__':
+    main()
@@ -2,10 +2,17 @@
 Generatore di email swipe con OpenAI (opzionale)
 """
 
-from openai import OpenAI
-from typing import Dict, List
+from typing import Dict, List, Optional
 import os
 import json
+from text_normalizer import normalize_body, truncate_to_tokens
+from llm_ledger import LLMLedger, LLM_LEDGER_DB
+from llm_resilience import RetryPolicy
+from llm_backend import LLMBackend, create_backend, model_for
+
+
+# Token dell'email originale inclusi nel prompt dello swipe
+SWIPE_BODY_TOKENS = 800
 
 
 class SwipeGenerator:
@@ -13,17 +20,25 @@ class SwipeGenerator:
     Genera email swipe usando OpenAI o simulazione
     """
     
-    def __init__(self, api_key: str = None, use_ai: bool = False):
+    def __init__(self, api_key: str = None, use_ai: bool = False, ledger: Optional[LLMLedger] = None,
+                 retry_policy: Optional[RetryPolicy] = None, backend: Optional[LLMBackend] = None):
         """
         Inizializza il generatore
         
         Args:
             api_key: Chiave API OpenAI (opzionale)
             use_ai: Se True, usa OpenAI. Se False, usa simulazione
+            ledger: Registro delle chiamate (default: LLM_LEDGER_DB)
+            retry_policy: Retry con backoff e circuit breaker (default: RetryPolicy())
+            backend: Backend dei modelli (default: LLM_BACKEND con ledger e retry_policy)
         """
-        self.use_ai = use_ai and api_key is not None
-        if self.use_ai:
-            self.client = OpenAI(api_key=api_key)
+        self.use_ai = use_ai and (api_key is not None or backend is not None)
+        self.model = model_for('swipe')
+        self.backend = backend
+        if self.use_ai and self.backend is None:
+            if ledger is None and LLM_LEDGER_DB:
+                ledger = LLMLedger(LLM_LEDGER_DB)
+            self.backend = create_backend(api_key, ledger=ledger, retry_policy=retry_policy)
     
     def generate_swipe(self, email_body: str, email_subject: str, 
                       product_name: str, product_brief: str = '') -> Dict:
@@ -49,11 +64,14 @@ class SwipeGenerator:
         """
         Genera swipe usando OpenAI
         """
+        # Testo visibile dell'email (senza markup e URL di tracking), limitato in token
+        body_text = truncate_to_tokens(normalize_body(email_body), SWIPE_BODY_TOKENS, self.model)
+        
         prompt = f"""You are an expert email copywriter and marketing strategist. I need you to adapt this marketing email for a different product.
 
 ORIGINAL EMAIL:
 Subject: {email_subject}
-Body: {email_body[:3000]}
+Body: {body_text}
 
 MY PRODUCT:
 Name: {product_name}
@@ -87,17 +105,19 @@ Return your response as a JSON object with this structure:
   "key_insights": "Brief explanation of the swipe strategy used"
 }}
 """
+
+        params = {
+            'model': self.model,
+            'messages': [
+                {"role": "system", "content": "You are an expert email copywriter and marketing strategist. Return only valid JSON."},
+                {"role": "user", "content": prompt}
+            ],
+            'temperature': 0.7,
+            'response_format': {"type": "json_object"}
+        }
         
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": "You are an expert email copywriter and marketing strategist. Return only valid JSON."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.7,
-                response_format={"type": "json_object"}
-            )
+            response = self.backend.complete(params, 'swipe')
             
             result_text = response.choices[0].message.content
             result = json.loads(result_text)
@@ -125,13 +145,16 @@ Return your response as a JSON object with this structure:
                 'changes': formatted_changes,
                 'key_insights': key_insights,
                 'method': 'ai',
-                'ai_provider': 'OpenAI GPT-4o'
+                'ai_provider': self.backend.provider_name(self.model)
             }
         
         except Exception as e:
-            print(f"Errore OpenAI: {e}")
-            # Fallback a simulazione
-            return self._generate_simulated(email_body, email_subject, product_name, product_brief)
+            print(f"⚠️  Errore OpenAI, swipe simulato: {e}")
+            # Fallback a simulazione, segnalato al chiamante
+            result = self._generate_simulated(email_body, email_subject, product_name, product_brief)
+            result['fallback'] = True
+            result['fallback_reason'] = str(e)
+            return result
     
     def _generate_simulated(self, email_body: str, email_subject: str,
                            product_name: str, product_brief: str) -> Dict:
@@ -0,0 +1,43 @@
+"""
+Configurazione comune dei test: i moduli del progetto sono nella cartella principale
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from email_analyzer import EmailAnalyzer
+from llm_backend import MockBackend
+from llm_resilience import RetryPolicy
+from mock_openai_server import MockOpenAIState
+
+
+@pytest.fixture
+def analyzer():
+    """
+    EmailAnalyzer sul backend mock, senza cache, indici, regole, coda dei retry e retry delle chiamate
+    """
+    backend = MockBackend(retry_policy=RetryPolicy(max_retries=0), state=MockOpenAIState(chat_latency=0.01))
+    analyzer = EmailAnalyzer('sk-mock', backend=backend, use_cache=False, use_near_duplicates=False,
+                             use_pre_classifier=False, use_retry_queue=False, tokens_per_minute=2000000)
+    yield analyzer
+    backend.close()
+
+
+def make_emails(prefix, count):
+    """
+    Email di prova nel formato di GmailExtractor
+    """
+    return [{'id': f'{prefix}{i}', 'from': 'news@shop.com', 'subject': f'Offerta {prefix}{i}',
+             'body': f'Sconto del {i}% su tutto il catalogo', 'date': ''} for i in range(count)]
+
+
+def exhaust_budget(budget):
+    """
+    Svuota il budget TPM: le richieste successive attendono la ricarica (e il lock del budget)
+    """
+    budget._tokens = 0
+    budget._last_refill = time.monotonic()
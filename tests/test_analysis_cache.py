@@ -0,0 +1,46 @@
+"""
+Test della cache delle analisi: chiave per contenuto normalizzato e riuso tra invii dello stesso template
+"""
+
+from analysis_cache import AnalysisCache, content_key
+from test_batch_offline import batch_state
+
+EMAIL = {'from': 'Shop <news@shop.com>', 'subject': 'Saldi di fine stagione',
+         'body': 'Fino al 50% di sconto: https://shop.com/saldi?utm_source=mail&uid=1'}
+
+
+def test_key_ignores_tracking_display_name_and_spacing():
+    variant = {'from': '"Shop Italia" <NEWS@shop.com>', 'subject': '  SALDI di fine   stagione',
+               'body': 'Fino al 50% di sconto: https://shop.com/saldi?utm_source=mail&uid=2#top'}
+    assert content_key(variant, 'gpt-4o-mini', 'v1') == content_key(EMAIL, 'gpt-4o-mini', 'v1')
+
+
+def test_key_changes_with_content_model_and_prompt():
+    key = content_key(EMAIL, 'gpt-4o-mini', 'v1')
+    assert content_key({**EMAIL, 'body': 'Fino al 60% di sconto'}, 'gpt-4o-mini', 'v1') != key
+    assert content_key({**EMAIL, 'body': 'https://shop.com/altro'}, 'gpt-4o-mini', 'v1') != key
+    assert content_key(EMAIL, 'gpt-4o', 'v1') != key
+    assert content_key(EMAIL, 'gpt-4o-mini', 'v2') != key
+
+
+def test_get_put_and_stats(tmp_path):
+    cache = AnalysisCache(str(tmp_path / 'cache.db'))
+    assert cache.get('k') is None
+    cache.put('k', {'email_type': 'marketing'}, 'gpt-4o-mini', 'v1')
+    assert cache.get('k') == {'email_type': 'marketing'}
+    assert cache.get_stats() == {'hits': 1, 'misses': 1, 'hit_rate': 50.0}
+    # Persistente tra istanze
+    assert AnalysisCache(str(tmp_path / 'cache.db')).get('k') == {'email_type': 'marketing'}
+
+
+def test_repeated_template_is_analyzed_once(analyzer, tmp_path):
+    analyzer.cache = AnalysisCache(str(tmp_path / 'cache.db'))
+    first = analyzer.analyze_batch([{**EMAIL, 'id': 'e1', 'date': ''}])
+    requests = batch_state(analyzer).chat_requests
+    
+    resent = {**EMAIL, 'id': 'e2', 'date': '', 'body': EMAIL['body'].replace('uid=1', 'uid=2')}
+    second = analyzer.analyze_batch([resent])
+    assert batch_state(analyzer).chat_requests == requests
+    assert second[0]['email_id'] == 'e2'
+    assert second[0]['email_type'] == first[0]['email_type']
+    assert analyzer.cache.hits == 1
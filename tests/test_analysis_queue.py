@@ -0,0 +1,211 @@
+"""
+Test della coda delle analisi: priorità, prese in carico, riavvio dei monitor e checkpoint
+"""
+
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+import pytest
+import analysis_queue
+from analysis_queue import AnalysisQueue, AnalysisWorker, priority_for
+
+OLD_DATE = format_datetime(datetime.now(timezone.utc) - timedelta(days=400))
+RECENT_DATE = format_datetime(datetime.now(timezone.utc) - timedelta(days=1))
+
+
+class FakeAnalyzer:
+    """
+    Analizzatore che registra l'ordine delle email analizzate
+    """
+    
+    def __init__(self, seconds_per_email=0.0):
+        self.seconds_per_email = seconds_per_email
+        self.batches = []
+    
+    def analyze_batch(self, emails):
+        time.sleep(self.seconds_per_email * len(emails))
+        self.batches.append([email['id'] for email in emails])
+        return [{'email_id': email['id'], 'email_type': 'marketing'} for email in emails]
+
+
+class FakeDatabase:
+    """
+    EmailDatabase in memoria; le email in `failing` non vengono salvate
+    """
+    
+    def __init__(self, failing=()):
+        self.saved = {}
+        self.failing = set(failing)
+        self.lock = threading.Lock()
+    
+    def save_batch(self, emails):
+        with self.lock:
+            saved = [email for email in emails if email['email_id'] not in self.failing]
+            self.saved.update((email['email_id'], email) for email in saved)
+            return len(saved)
+    
+    def get_existing_email_ids(self, email_ids=None):
+        with self.lock:
+            return {email_id for email_id in email_ids or self.saved if email_id in self.saved}
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return AnalysisQueue(str(tmp_path / 'queue.db'))
+
+
+def make_worker(queue, role, db=None, analyzer=None, lease_size=10):
+    return AnalysisWorker(analyzer or FakeAnalyzer(), db or FakeDatabase(), queue=queue,
+                          lease_size=lease_size, role=role)
+
+
+def test_priority_for_uses_email_date():
+    assert priority_for({'date': RECENT_DATE}) == 'recent'
+    assert priority_for({'date': OLD_DATE}) == 'backfill'
+    assert priority_for({'date': 'non una data'}) == 'backfill'
+    assert priority_for({}) == 'backfill'
+
+
+def test_lease_by_priority_then_age(queue):
+    queue.enqueue([{'id': 'b1', 'date': OLD_DATE}, {'id': 'b2', 'date': OLD_DATE}])
+    queue.enqueue([{'id': 'r1', 'date': RECENT_DATE}])
+    queue.enqueue([{'id': 'l1'}], 'live')
+    
+    assert [email['id'] for email in queue.lease('w', 10)] == ['l1', 'r1', 'b1', 'b2']
+    assert queue.lease('w', 10) == []
+
+
+def test_enqueue_keeps_highest_priority(queue):
+    queue.enqueue([{'id': 'a', 'date': OLD_DATE}])
+    queue.enqueue([{'id': 'a'}], 'live')
+    queue.enqueue([{'id': 'a', 'date': OLD_DATE}])
+    assert queue.get_stats()['live']['pending'] == 1
+    assert queue.get_stats()['backfill']['pending'] == 0
+
+
+def test_lease_max_priority_leaves_backfill(queue):
+    queue.enqueue([{'id': 'b', 'date': OLD_DATE}])
+    queue.enqueue([{'id': 'l'}], 'live')
+    assert [email['id'] for email in queue.lease('monitor', 10, 'live')] == ['l']
+    assert queue.lease('monitor', 10, 'live') == []
+
+
+def test_expired_lease_becomes_available(tmp_path):
+    queue = AnalysisQueue(str(tmp_path / 'queue.db'), lease_seconds=0.2)
+    queue.enqueue([{'id': 'a'}], 'live')
+    assert len(queue.lease('w1', 10)) == 1
+    assert queue.lease('w2', 10) == []
+    time.sleep(0.25)
+    assert [email['id'] for email in queue.lease('w2', 10)] == ['a']
+
+
+def test_backfill_yields_to_live_running_elsewhere(queue):
+    queue.enqueue([{'id': 'l'}], 'live', worker='monitor')
+    queue.enqueue([{'id': 'b', 'date': OLD_DATE}])
+    assert queue.should_yield('backfill')
+    assert not queue.should_yield('monitor')
+    # Un monitor che prende solo email live non aspetta il backfill
+    assert not queue.should_yield('other_monitor', 'live')
+
+
+def test_live_email_analyzed_during_backfill(queue):
+    db = FakeDatabase()
+    backfill = make_worker(queue, 'backfill', db, FakeAnalyzer(seconds_per_email=0.005))
+    monitor = make_worker(queue, 'monitor', db)
+    emails = [{'id': f'b{i}', 'date': OLD_DATE} for i in range(150)]
+    emails += [{'id': f'r{i}', 'date': RECENT_DATE} for i in range(10)]
+    
+    results = {}
+    thread = threading.Thread(target=lambda: results.setdefault('backfill', backfill.submit(emails)))
+    thread.start()
+    time.sleep(0.2)
+    start = time.monotonic()
+    live = monitor.analyze_now([{'id': 'L1'}, {'id': 'L2'}])
+    latency = time.monotonic() - start
+    thread.join()
+    
+    assert [email['email_id'] for email in live] == ['L1', 'L2']
+    assert latency < 0.5
+    # Le email recenti del backfill passano prima dello storico
+    assert all(email_id.startswith('r') for email_id in backfill.analyzer.batches[0])
+    assert len(results['backfill']) == 160
+    assert len(db.saved) == 162
+    assert all(stats['pending'] == 0 and stats['leased'] == 0 for stats in queue.get_stats().values())
+
+
+def test_restarted_monitor_recovers_its_own_leases(queue):
+    # Monitor interrotto dopo aver accodato le email live, con la presa in carico ancora valida
+    queue.enqueue([{'id': 'l1'}, {'id': 'l2'}], 'live', worker=make_worker(queue, 'monitor').worker_id)
+    queue.enqueue([{'id': 'b', 'date': OLD_DATE}])
+    
+    db = FakeDatabase()
+    restarted = make_worker(queue, 'monitor', db)
+    recovered = restarted.recover()
+    
+    assert sorted(email['email_id'] for email in recovered) == ['l1', 'l2']
+    # Il monitor non prende in carico il backfill
+    assert queue.get_stats()['backfill']['pending'] == 1
+
+
+def test_restarted_monitor_analyzes_resubmitted_emails(queue):
+    # Stesse email ripresentate dalla History API dopo il riavvio: sono ancora del monitor
+    monitor_id = make_worker(queue, 'monitor').worker_id
+    queue.enqueue([{'id': 'l1'}], 'live', worker=monitor_id)
+    
+    restarted = make_worker(queue, 'monitor')
+    assert [email['email_id'] for email in restarted.analyze_now([{'id': 'l1'}, {'id': 'l2'}])] == ['l1', 'l2']
+
+
+def test_analyze_now_skips_emails_leased_by_another_worker(queue):
+    queue.enqueue([{'id': 'x', 'date': OLD_DATE}])
+    queue.lease('backfill', 10)
+    monitor = make_worker(queue, 'monitor')
+    
+    assert [email['email_id'] for email in monitor.analyze_now([{'id': 'x'}, {'id': 'y'}])] == ['y']
+    # L'email in analisi altrove è ancora in coda: il checkpoint può avanzare
+    assert monitor.unsaved(['x', 'y']) == []
+
+
+def test_close_releases_leases(queue):
+    monitor = make_worker(queue, 'monitor')
+    queue.enqueue([{'id': 'l'}], 'live', worker=monitor.worker_id)
+    monitor.close()
+    assert [email['id'] for email in queue.lease('other', 10)] == ['l']
+
+
+def test_unsaved_email_stays_queued_and_blocks_checkpoint(queue):
+    db = FakeDatabase(failing={'bad'})
+    monitor = make_worker(queue, 'monitor', db)
+    monitor.analyze_now([{'id': 'ok'}, {'id': 'bad'}])
+    
+    assert queue.queued_ids(['ok', 'bad']) == {'bad'}
+    assert monitor.unsaved(['ok', 'bad']) == []
+    # Un'email né salvata né in coda (es. dettagli non scaricati) blocca il checkpoint
+    assert monitor.unsaved(['ok', 'missing']) == ['missing']
+
+
+def test_id_lookups_beyond_sqlite_parameter_limit(queue, monkeypatch):
+    connect = sqlite3.connect
+    
+    def limited_connect(*args, **kwargs):
+        # Limite predefinito delle versioni di SQLite precedenti alla 3.32
+        conn = connect(*args, **kwargs)
+        conn.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 999)
+        return conn
+    
+    monkeypatch.setattr(analysis_queue.sqlite3, 'connect', limited_connect)
+    email_ids = [f'e{i}' for i in range(1200)]
+    queue.enqueue([{'id': email_id} for email_id in email_ids[::2]], 'backfill', worker='w')
+    assert queue.queued_ids(email_ids) == set(email_ids[::2])
+    assert queue.leased_ids('w', email_ids) == set(email_ids[::2])
+
+
+def test_worker_without_queue_analyzes_directly():
+    db = FakeDatabase()
+    worker = AnalysisWorker(FakeAnalyzer(), db, use_queue=False)
+    assert len(worker.submit([{'id': 'a'}])) == 1
+    assert len(worker.analyze_now([{'id': 'b'}])) == 1
+    assert worker.run() == []
+    assert worker.unsaved(['a', 'b', 'c']) == ['c']
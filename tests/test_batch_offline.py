@@ -0,0 +1,47 @@
+"""
+Test dell'analisi con la Batch API sul server mock: invio, raccolta e ripresa dopo un'interruzione
+"""
+
+import os
+import pytest
+from conftest import make_emails
+
+
+def batch_state(analyzer):
+    """
+    Stato del server mock del backend (file e batch creati)
+    """
+    return analyzer.backend.server.RequestHandlerClass.state
+
+
+def test_batch_round_trip(analyzer, tmp_path):
+    emails = make_emails('b', 3)
+    results = analyzer.analyze_batch_offline(emails, batch_dir=str(tmp_path), poll_interval=0)
+    
+    assert [result['email_id'] for result in results] == ['b0', 'b1', 'b2']
+    assert not any('error' in result for result in results)
+    assert all(result['email_type'] for result in results)
+    assert len(batch_state(analyzer).batches) == 1
+    # Raccolto il batch resta solo il file JSONL inviato
+    assert [name.endswith('.jsonl') for name in os.listdir(tmp_path)] == [True]
+
+
+def test_interrupted_batch_is_collected_not_resubmitted(analyzer, tmp_path, monkeypatch):
+    wait_for_batch = analyzer.wait_for_batch
+    
+    def interrupted(batch_id, poll_interval):
+        raise KeyboardInterrupt
+    
+    monkeypatch.setattr(analyzer, 'wait_for_batch', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        analyzer.analyze_batch_offline(make_emails('r', 2), batch_dir=str(tmp_path), poll_interval=0)
+    
+    # Al riavvio il batch già inviato viene atteso e raccolto
+    monkeypatch.setattr(analyzer, 'wait_for_batch', wait_for_batch)
+    results = analyzer.resume_offline_batches(batch_dir=str(tmp_path), poll_interval=0)
+    assert [result['email_id'] for result in results] == ['r0', 'r1']
+    assert not any('error' in result for result in results)
+    assert len(batch_state(analyzer).batches) == 1
+    
+    assert analyzer.resume_offline_batches(batch_dir=str(tmp_path), poll_interval=0) == []
+    assert analyzer.resume_offline_batches(batch_dir=str(tmp_path / 'assente')) == []
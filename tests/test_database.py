@@ -0,0 +1,24 @@
+"""
+Test dei checkpoint salvati in EmailDatabase
+"""
+
+from database import EmailDatabase
+
+
+def test_backfill_checkpoint_round_trip(tmp_path):
+    db = EmailDatabase(str(tmp_path / 'emails.db'))
+    assert db.get_backfill_checkpoint('me@example.com|') is None
+    
+    db.save_backfill_checkpoint('me@example.com|', 'token-1', 200, 'm200')
+    db.save_backfill_checkpoint('me@example.com|', 'token-2', 400, 'm400')
+    checkpoint = db.get_backfill_checkpoint('me@example.com|')
+    assert (checkpoint['page_token'], checkpoint['processed_count'], checkpoint['last_message_id'],
+            checkpoint['status']) == ('token-2', 400, 'm400', 'running')
+    
+    db.save_backfill_checkpoint('me@example.com|', None, 450, 'm450', status='completed')
+    assert db.get_backfill_checkpoint('me@example.com|')['status'] == 'completed'
+    # Ogni query ha il proprio checkpoint
+    assert db.get_backfill_checkpoint('me@example.com|from:shop') is None
+    
+    db.delete_backfill_checkpoint('me@example.com|')
+    assert db.get_backfill_checkpoint('me@example.com|') is None
@@ -0,0 +1,16 @@
+"""
+Test dell'analisi concorrente sul backend mock: più batch con lo stesso analizzatore
+"""
+
+from conftest import exhaust_budget, make_emails
+
+
+def test_analyze_batch_twice_on_same_analyzer(analyzer):
+    # Ogni analyze_batch usa un nuovo event loop: il budget condiviso non deve legarsi al primo.
+    # Il budget TPM vuoto obbliga le richieste ad attendere il lock (qualche centesimo di secondo ciascuna)
+    for prefix in ('a', 'b', 'c'):
+        exhaust_budget(analyzer.budget)
+        results = analyzer.analyze_batch(make_emails(prefix, 6))
+        assert [result for result in results if 'error' in result] == []
+        assert all(result['analysis_model'] for result in results)
+
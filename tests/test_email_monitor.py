@@ -0,0 +1,76 @@
+"""
+Test del ciclo del monitor: il checkpoint della History API avanza solo per email salvate o in coda
+"""
+
+import os
+from analysis_queue import AnalysisQueue, AnalysisWorker
+from test_analysis_queue import FakeAnalyzer, FakeDatabase
+
+os.environ.setdefault('OPENAI_API_KEY', 'sk-test')
+from email_monitor import EmailMonitor
+
+
+class FakeHistorySync:
+    def __init__(self, message_ids):
+        self.message_ids = message_ids
+        self.committed = False
+    
+    def get_new_message_ids(self):
+        return self.message_ids
+    
+    def commit(self):
+        self.committed = True
+
+
+class FakeExtractor:
+    """
+    Restituisce i dettagli solo delle email in `available`; quelle in `unavailable` non esistono più su Gmail
+    """
+    
+    def __init__(self, available, unavailable=()):
+        self.available = available
+        self.unavailable_ids = set(unavailable)
+    
+    def get_messages_details(self, message_ids):
+        return [{'id': message_id, 'from': 'a@b.com', 'subject': 'Ciao'}
+                for message_id in message_ids if message_id in self.available]
+
+
+def make_monitor(tmp_path, message_ids, available, db=None, unavailable=()):
+    monitor = EmailMonitor.__new__(EmailMonitor)
+    monitor.db = db or FakeDatabase()
+    monitor.worker = AnalysisWorker(FakeAnalyzer(), monitor.db, queue=AnalysisQueue(str(tmp_path / 'queue.db')),
+                                    role='email_monitor')
+    monitor.history_sync = FakeHistorySync(message_ids)
+    monitor.extractor = FakeExtractor(available, unavailable)
+    monitor.last_check = None
+    return monitor
+
+
+def test_checkpoint_committed_when_all_saved(tmp_path):
+    monitor = make_monitor(tmp_path, ['a', 'b'], {'a', 'b'})
+    monitor.check_for_new_emails()
+    assert monitor.history_sync.committed
+    assert set(monitor.db.saved) == {'a', 'b'}
+
+
+def test_checkpoint_not_committed_for_email_not_downloaded(tmp_path):
+    # 'b' non scaricata: né salvata né in coda, il prossimo controllo deve ripresentarla
+    monitor = make_monitor(tmp_path, ['a', 'b'], {'a'})
+    monitor.check_for_new_emails()
+    assert not monitor.history_sync.committed
+
+
+def test_checkpoint_committed_when_email_deleted_from_gmail(tmp_path):
+    # 'b' eliminata prima del download (404): non tornerà mai, non deve bloccare il checkpoint
+    monitor = make_monitor(tmp_path, ['a', 'b'], {'a'}, unavailable={'b'})
+    monitor.check_for_new_emails()
+    assert monitor.history_sync.committed
+
+
+def test_checkpoint_committed_when_unsaved_email_stays_queued(tmp_path):
+    # 'b' non salvata resta in coda e sarà ripresa dal monitor: il checkpoint può avanzare
+    monitor = make_monitor(tmp_path, ['a', 'b'], {'a', 'b'}, FakeDatabase(failing={'b'}))
+    monitor.check_for_new_emails()
+    assert monitor.history_sync.committed
+    assert monitor.worker.queue.queued_ids(['a', 'b']) == {'b'}
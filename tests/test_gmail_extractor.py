@@ -0,0 +1,358 @@
+"""
+Test di GmailExtractor senza rete: batch request, pool di thread e di parsing, archivio raw
+"""
+
+import re
+import time
+import base64
+import pickle
+import threading
+from datetime import datetime, timedelta
+import httplib2
+import pytest
+from google.auth.credentials import AnonymousCredentials, Credentials
+from googleapiclient.errors import HttpError
+import gmail_extractor
+from gmail_extractor import GmailExtractor, build_gmail_service
+from rate_limiter import QuotaRateLimiter
+from raw_archive import RawMessageArchive
+
+
+def http_error(status):
+    return HttpError(httplib2.Response({'status': status}), b'{}')
+
+
+class FakeRequest:
+    def __init__(self, func, message_id=None):
+        self.func = func
+        self.message_id = message_id
+    
+    def execute(self, http=None):
+        return self.func()
+
+
+class FakeBatch:
+    """
+    Batch request che esegue le richieste in ordine e chiama la callback per ognuna
+    """
+    
+    def __init__(self, gmail, callback):
+        self.gmail = gmail
+        self.callback = callback
+        self.requests = []
+    
+    def add(self, request, request_id):
+        self.requests.append((request, request_id))
+    
+    def execute(self, http=None):
+        self.gmail.batches.append([request.message_id for request, _ in self.requests])
+        if self.gmail.batch_errors:
+            raise http_error(self.gmail.batch_errors.pop(0))
+        for request, request_id in self.requests:
+            try:
+                response = request.execute()
+            except HttpError as error:
+                self.callback(request_id, None, error)
+            else:
+                self.callback(request_id, response, None)
+
+
+class FakeGmail:
+    """
+    Servizio Gmail in memoria: mailbox è una lista di (ID, timestamp) dal più recente,
+    item_errors associa a un ID gli status HTTP dei primi tentativi, batch_errors e list_errors
+    gli status delle prime batch request e delle prime chiamate messages.list
+    """
+    
+    def __init__(self, mailbox=(), item_errors=None, batch_errors=(), list_errors=()):
+        self.mailbox = list(mailbox)
+        self.item_errors = {message_id: list(statuses) for message_id, statuses in (item_errors or {}).items()}
+        self.batch_errors = list(batch_errors)
+        self.list_errors = list(list_errors)
+        self.batches = []
+        self.list_queries = []
+    
+    def users(self):
+        return self
+    
+    def messages(self):
+        return self
+    
+    def get(self, userId, id, format):
+        return FakeRequest(lambda: self._get(id), id)
+    
+    def _get(self, message_id):
+        statuses = self.item_errors.get(message_id)
+        if statuses:
+            raise http_error(statuses.pop(0))
+        return raw_message(message_id)
+    
+    def new_batch_http_request(self, callback):
+        return FakeBatch(self, callback)
+    
+    def list(self, userId, maxResults, q='', pageToken=None):
+        return FakeRequest(lambda: self._list(maxResults, q or '', int(pageToken or 0)))
+    
+    def list_next(self, request, response):
+        if 'nextPageToken' not in response:
+            return None
+        return FakeRequest(lambda: self._next_page(response))
+    
+    def _list(self, max_results, query, offset):
+        self.list_queries.append(query)
+        if self.list_errors:
+            raise http_error(self.list_errors.pop(0))
+        after = re.search(r'after:(\d+)', query)
+        before = re.search(r'before:(\d+)', query)
+        matching = [message_id for message_id, timestamp in self.mailbox
+                    if (not after or timestamp >= int(after.group(1)))
+                    and (not before or timestamp < int(before.group(1)))]
+        response = {'messages': [{'id': message_id} for message_id in matching[offset:offset + max_results]],
+                    'resultSizeEstimate': len(matching)}
+        if offset + max_results < len(matching):
+            response['nextPageToken'] = str(offset + max_results)
+        response['_request'] = (max_results, query)
+        return response
+    
+    def _next_page(self, response):
+        max_results, query = response['_request']
+        return self._list(max_results, query, int(response['nextPageToken']))
+
+
+class FakeParsePool:
+    def __init__(self):
+        self.closed = False
+    
+    def close(self):
+        self.closed = True
+
+
+def make_extractor(**attributes):
+    """
+    GmailExtractor senza autenticazione, con i soli attributi usati dai test
+    """
+    extractor = GmailExtractor.__new__(GmailExtractor)
+    extractor.fetch_workers = 4
+    extractor._executor = None
+    extractor._thread_local = threading.local()
+    extractor.parse_pool = FakeParsePool()
+    extractor.archive = None
+    extractor._ensure_fresh_token = lambda: None
+    extractor._get_message_detail_threaded = lambda message_id: {'id': message_id}
+    extractor.creds = None
+    extractor.fetch_format = 'full'
+    extractor.rate_limiter = QuotaRateLimiter(units_per_second=100000, max_retries=2, base_delay=0.001)
+    extractor.unavailable_ids = set()
+    for name, value in attributes.items():
+        setattr(extractor, name, value)
+    return extractor
+
+
+def test_changing_workers_keeps_parse_pool_open():
+    extractor = make_extractor()
+    assert extractor.get_messages_details_concurrent(['a', 'b'], max_workers=2) == [{'id': 'a'}, {'id': 'b'}]
+    assert extractor.get_messages_details_concurrent(['c'], max_workers=3) == [{'id': 'c'}]
+    assert extractor.fetch_workers == 3
+    assert not extractor.parse_pool.closed
+    
+    extractor.close()
+    assert extractor.parse_pool.closed
+    assert extractor._executor is None
+
+
+def raw_message(message_id):
+    raw = f"From: a@example.com\r\nTo: b@example.com\r\nSubject: Oggetto {message_id}\r\n\r\nCorpo\r\n".encode()
+    return {'id': message_id, 'threadId': 't', 'labelIds': ['INBOX'], 'snippet': 'Corpo',
+            'raw': base64.urlsafe_b64encode(raw).decode()}
+
+
+def test_unreadable_archive_entry_is_fetched_again(tmp_path):
+    archive = RawMessageArchive(str(tmp_path), codec='zlib')
+    fetched = []
+    
+    def fetch_message(message_id, service=None):
+        fetched.append(message_id)
+        return raw_message(message_id)
+    
+    extractor = make_extractor(archive=archive, parse_pool=None, fetch_mode='sequential',
+                               account_email='me@example.com', _fetch_message=fetch_message)
+    assert [email['id'] for email in extractor.get_messages_details(['a', 'b'])] == ['a', 'b']
+    assert fetched == ['a', 'b']
+    
+    # Oggetto di 'a' corrotto sul disco: viene scaricato di nuovo invece di essere perso
+    with open(archive._object_path(archive.get_metadata('a')['sha256'], 'zlib'), 'wb') as f:
+        f.write(b'corrotto')
+    details = extractor.get_messages_details(['a', 'b'])
+    assert [email['subject'] for email in details] == ['Oggetto a', 'Oggetto b']
+    assert fetched == ['a', 'b', 'a']
+    
+    # L'oggetto è stato riscritto: la lettura successiva non passa da Gmail
+    assert [email['id'] for email in extractor.get_messages_details(['a', 'b'])] == ['a', 'b']
+    assert fetched == ['a', 'b', 'a']
+
+
+def test_batch_fetch_keeps_order_across_parallel_chunks():
+    gmail = FakeGmail()
+    extractor = make_extractor(service=gmail)
+    message_ids = [f'm{i}' for i in range(250)]
+    
+    messages = extractor._fetch_messages_batch(message_ids, batch_size=100, max_parallel_batches=3)
+    assert [message['id'] for message in messages] == message_ids
+    assert sorted(len(batch) for batch in gmail.batches) == [50, 100, 100]
+
+
+def test_batch_fetch_retries_rate_limited_items():
+    gmail = FakeGmail(item_errors={'b': [429], 'c': [503, 500]})
+    extractor = make_extractor(service=gmail)
+    
+    messages = extractor._fetch_messages_batch(['a', 'b', 'c'], batch_size=100, max_parallel_batches=1)
+    assert [message['id'] for message in messages] == ['a', 'b', 'c']
+    # Solo gli elementi falliti tornano nella batch successiva
+    assert gmail.batches == [['a', 'b', 'c'], ['b', 'c'], ['c']]
+    assert extractor.rate_limiter.rate_limited == 1
+
+
+def test_batch_fetch_records_permanently_missing_messages():
+    gmail = FakeGmail(item_errors={'b': [404], 'c': [429, 429, 429]})
+    extractor = make_extractor(service=gmail)
+    
+    messages = extractor._fetch_messages_batch(['a', 'b', 'c'], batch_size=100, max_parallel_batches=1)
+    assert messages[0]['id'] == 'a' and messages[1:] == [None, None]
+    # Solo il 404 è definitivo: il messaggio limitato dalla quota va ripreso al prossimo controllo
+    assert extractor.unavailable_ids == {'b'}
+
+
+def test_batch_fetch_retries_failed_envelope():
+    gmail = FakeGmail(batch_errors=[503])
+    extractor = make_extractor(service=gmail)
+    messages = extractor._fetch_messages_batch(['a', 'b'], batch_size=100, max_parallel_batches=1)
+    assert [message['id'] for message in messages] == ['a', 'b']
+    assert len(gmail.batches) == 2
+
+
+def test_batch_fetch_raises_when_envelope_keeps_failing():
+    gmail = FakeGmail(batch_errors=[503, 503, 503])
+    extractor = make_extractor(service=gmail)
+    with pytest.raises(HttpError):
+        extractor._fetch_messages_batch(['a', 'b'], batch_size=100, max_parallel_batches=1)
+    assert len(gmail.batches) == 3
+
+
+def test_strict_listing_raises_instead_of_partial_list():
+    gmail = FakeGmail(mailbox=[('a', 3), ('b', 2), ('c', 1)], list_errors=[404])
+    extractor = make_extractor(service=gmail)
+    assert extractor.get_messages() == []
+    
+    gmail.list_errors = [404]
+    with pytest.raises(HttpError):
+        extractor.get_messages(strict=True)
+    assert [message['id'] for message in extractor.get_messages(strict=True)] == ['a', 'b', 'c']
+
+
+def test_email_pages_are_fetched_lazily_and_resumable():
+    gmail = FakeGmail(mailbox=[(message_id, 0) for message_id in 'abcde'])
+    extractor = make_extractor(service=gmail, parse_pool=None, fetch_mode='sequential', account_email='me@example.com')
+    
+    emails = extractor.iter_emails(page_size=2)
+    assert next(emails)['subject'] == 'Oggetto a'
+    # Solo la prima pagina è stata elencata
+    assert len(gmail.list_queries) == 1
+    assert [email['id'] for email in emails] == ['b', 'c', 'd', 'e']
+    
+    pages = list(extractor.iter_email_pages(page_size=2, page_token='2'))
+    assert [([email['id'] for email in page], token) for page, token in pages] == [(['c', 'd'], '4'), (['e'], None)]
+    assert [email['id'] for email in extractor.iter_emails(max_results=3, page_size=2)] == ['a', 'b', 'c']
+
+
+class ExpiredCredentials(Credentials):
+    """
+    Credenziali scadute con refresh token: refresh() conta le chiamate
+    """
+    
+    def __init__(self):
+        super().__init__()
+        self.token = 'vecchio'
+        self.refresh_token = 'refresh'
+        self.refreshes = 0
+        self._expired = True
+    
+    @property
+    def expired(self):
+        return self._expired
+    
+    @property
+    def valid(self):
+        return not self._expired
+    
+    def __getstate__(self):
+        # Come le credenziali OAuth reali: il worker del refresh (con lock) non si serializza
+        state = self.__dict__.copy()
+        state.pop('_refresh_worker', None)
+        return state
+    
+    def refresh(self, request):
+        time.sleep(0.05)
+        self.refreshes += 1
+        self.token = 'nuovo'
+        self._expired = False
+
+
+def test_discovery_document_is_loaded_once(monkeypatch):
+    calls = []
+    get_static_doc = gmail_extractor.discovery_cache.get_static_doc
+    monkeypatch.setattr(gmail_extractor.discovery_cache, 'get_static_doc',
+                        lambda *args: calls.append(args) or get_static_doc(*args))
+    gmail_extractor._gmail_discovery_document.cache_clear()
+    
+    services = [build_gmail_service(AnonymousCredentials()) for _ in range(3)]
+    assert len(calls) == 1
+    assert all(hasattr(service.users(), 'messages') for service in services)
+
+
+def test_expired_token_is_refreshed_once_on_first_call(tmp_path):
+    token_file = tmp_path / 'token.pickle'
+    with open(token_file, 'wb') as f:
+        pickle.dump(ExpiredCredentials(), f)
+    
+    extractor = GmailExtractor(token_file=str(token_file), parse_workers=0)
+    # Nessun refresh durante l'avvio
+    assert extractor.creds.refreshes == 0
+    assert 'build_service' in extractor.startup_timings
+    
+    threads = [threading.Thread(target=extractor._ensure_fresh_token) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert extractor.creds.refreshes == 1
+    with open(token_file, 'rb') as f:
+        assert pickle.load(f).token == 'nuovo'
+
+
+def sharded_mailbox():
+    """
+    25 messaggi concentrati nei primi due giorni di gennaio 2020 e 5 distribuiti a febbraio, dal più recente
+    """
+    dense = [(f'd{i}', int((datetime(2020, 1, 1) + timedelta(hours=i)).timestamp())) for i in range(25)]
+    sparse = [(f's{i}', int((datetime(2020, 2, 1) + timedelta(days=5 * i)).timestamp())) for i in range(5)]
+    return sorted(dense + sparse, key=lambda item: item[1], reverse=True)
+
+
+def test_dense_shards_are_split_and_merged_in_order():
+    mailbox = sharded_mailbox()
+    gmail = FakeGmail(mailbox=mailbox)
+    extractor = make_extractor(service=gmail, _thread_service=lambda: gmail)
+    
+    messages = extractor.get_messages_sharded(datetime(2020, 1, 1), datetime(2020, 3, 1), max_workers=2,
+                                              target_shard_size=10)
+    assert [message['id'] for message in messages] == [message_id for message_id, _ in mailbox]
+    # La finestra densa è stata divisa: più listing dei due shard iniziali
+    assert len([query for query in gmail.list_queries if query.startswith('after:')]) > 4
+
+
+def test_shard_listing_error_is_not_an_empty_window():
+    gmail = FakeGmail(mailbox=sharded_mailbox(), list_errors=[500, 500, 500])
+    extractor = make_extractor(service=gmail, _thread_service=lambda: gmail)
+    with pytest.raises(HttpError):
+        extractor.get_messages_sharded(datetime(2020, 1, 1), datetime(2020, 3, 1), max_workers=1,
+                                       target_shard_size=10)
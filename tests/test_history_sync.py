@@ -0,0 +1,105 @@
+"""
+Test della sincronizzazione incrementale: checkpoint historyId e risincronizzazione completa
+"""
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+from database import EmailDatabase
+from history_sync import HistorySync
+
+ACCOUNT = 'me@example.com'
+
+
+class FakeExtractor:
+    """
+    GmailExtractor con mailbox e History API simulate
+    """
+    
+    def __init__(self, mailbox, history_id='100', changes=None, list_error=False):
+        self.mailbox = mailbox
+        self.history_id = history_id
+        self.changes = changes
+        self.list_error = list_error
+        self.history_requests = []
+    
+    def get_profile(self):
+        return {'emailAddress': ACCOUNT, 'historyId': self.history_id}
+    
+    def get_messages(self, max_results=None, strict=False):
+        if self.list_error:
+            if strict:
+                raise HttpError(httplib2.Response({'status': 500}), b'{}')
+            return []
+        # messages.list: più recenti per primi
+        return [{'id': message_id} for message_id in reversed(self.mailbox)][:max_results]
+    
+    def get_history_changes(self, start_history_id):
+        self.history_requests.append(start_history_id)
+        return self.changes
+
+
+@pytest.fixture
+def db(tmp_path):
+    return EmailDatabase(str(tmp_path / 'emails.db'))
+
+
+def test_initial_sync_lists_mailbox_and_commits_checkpoint(db):
+    db.save_email({'email_id': 'm1', 'subject': 'già salvata'})
+    sync = HistorySync(FakeExtractor(['m1', 'm2', 'm3']), db, resync_max_results=10)
+    
+    # Dal più vecchio al più recente, senza le email già nel database
+    assert sync.get_new_message_ids() == ['m2', 'm3']
+    assert db.get_history_id(ACCOUNT) is None
+    sync.commit()
+    assert db.get_history_id(ACCOUNT) == '100'
+
+
+def test_checkpoint_not_saved_without_commit(db):
+    db.save_history_id(ACCOUNT, '100')
+    extractor = FakeExtractor([], changes={'message_ids': ['n1'], 'history_id': '120', 'expired': False})
+    sync = HistorySync(extractor, db)
+    
+    assert sync.get_new_message_ids() == ['n1']
+    # Ciclo fallito: il controllo successivo riparte dallo stesso checkpoint
+    assert sync.get_new_message_ids() == ['n1']
+    assert extractor.history_requests == ['100', '100']
+    
+    sync.commit()
+    assert db.get_history_id(ACCOUNT) == '120'
+    sync.get_new_message_ids()
+    assert extractor.history_requests[-1] == '120'
+
+
+def test_expired_checkpoint_falls_back_to_full_resync(db):
+    db.save_history_id(ACCOUNT, '5')
+    extractor = FakeExtractor(['m1', 'm2'], history_id='300', changes={'expired': True})
+    sync = HistorySync(extractor, db)
+    
+    assert sync.get_new_message_ids() == ['m1', 'm2']
+    sync.commit()
+    assert db.get_history_id(ACCOUNT) == '300'
+
+
+def test_history_error_returns_none(db):
+    db.save_history_id(ACCOUNT, '100')
+    sync = HistorySync(FakeExtractor([], changes=None), db)
+    assert sync.get_new_message_ids() is None
+    sync.commit()
+    assert db.get_history_id(ACCOUNT) == '100'
+
+
+def test_failed_listing_during_resync_keeps_checkpoint(db):
+    db.save_history_id(ACCOUNT, '5')
+    extractor = FakeExtractor(['m1'], history_id='300', changes={'expired': True}, list_error=True)
+    sync = HistorySync(extractor, db)
+    
+    assert sync.get_new_message_ids() is None
+    sync.commit()
+    assert db.get_history_id(ACCOUNT) == '5'
+    
+    # Il ciclo successivo riprova la risincronizzazione
+    extractor.list_error = False
+    assert sync.get_new_message_ids() == ['m1']
+    sync.commit()
+    assert db.get_history_id(ACCOUNT) == '300'
@@ -0,0 +1,66 @@
+"""
+Test dei backend dei modelli e del server mock: interfaccia, modello per attività e batch riproducibili
+"""
+
+import json
+import pytest
+from llm_backend import LLMBackend, create_backend, model_for
+from llm_resilience import RetryPolicy
+from mock_openai_server import MockOpenAIState
+
+
+def test_backend_must_provide_clients():
+    class Incomplete(LLMBackend):
+        def create_function(self):
+            return lambda **params: None
+    
+    with pytest.raises(TypeError):
+        LLMBackend()
+    with pytest.raises(TypeError):
+        Incomplete()
+    with pytest.raises(ValueError):
+        create_backend('sk-test', name='sconosciuto')
+
+
+def test_task_aliases_share_the_analysis_model():
+    assert model_for('analysis_packed') == model_for('analysis_batch') == model_for('analysis')
+    with pytest.raises(KeyError):
+        model_for('sconosciuta')
+
+
+def test_mock_backend_completes():
+    backend = create_backend(name='mock', retry_policy=RetryPolicy(max_retries=0))
+    try:
+        response = backend.complete({'messages': [{'role': 'user', 'content': 'Analizza'}]}, 'analysis')
+        assert json.loads(response.choices[0].message.content)['email_type']
+        assert response.model == model_for('analysis')
+        assert backend.provider_name('gpt-4o') == 'Mock GPT-4o'
+    finally:
+        backend.close()
+
+
+def failed_requests(seed, batches=2):
+    """
+    custom_id delle richieste fallite in batch successivi sullo stesso file
+    """
+    state = MockOpenAIState(error_rate=0.5, polls=1, seed=seed)
+    lines = ''.join(json.dumps({'custom_id': f'e{i}', 'body': {'model': 'gpt-4o-mini', 'messages': []}}) + '\n'
+                    for i in range(40))
+    input_file = state.add_file(lines.encode('utf-8'), 'input.jsonl', 'batch')
+    
+    failed = []
+    for _ in range(batches):
+        batch = state.create_batch({'input_file_id': input_file['id']})
+        state.advance_batch(batch)
+        errors = state.files[batch['error_file_id']]['content'].decode('utf-8').splitlines()
+        failed.append([json.loads(line)['custom_id'] for line in errors])
+    return failed
+
+
+def test_batch_errors_follow_the_seed():
+    first, second = failed_requests(seed=7)
+    assert first and len(first) < 40
+    # Stesso seme: stesse richieste fallite; batch successivi: sequenze diverse
+    assert failed_requests(seed=7) == [first, second]
+    assert first != second
+    assert failed_requests(seed=8)[0] != first
@@ -0,0 +1,62 @@
+"""
+Test del registro delle chiamate: stima dei costi, registrazione degli errori e riepiloghi
+"""
+
+import pytest
+from llm_ledger import LLMLedger, estimate_cost, usage_fields
+
+
+class Usage:
+    def __init__(self, prompt_tokens, completion_tokens, cached_tokens=0):
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.total_tokens = prompt_tokens + completion_tokens
+        self.prompt_tokens_details = type('Details', (), {'cached_tokens': cached_tokens})()
+
+
+class Response:
+    def __init__(self, usage):
+        self.usage = usage
+
+
+def test_estimate_cost():
+    # gpt-4o-mini: 0.15$ input, 0.075$ input in cache, 0.60$ output per milione di token
+    assert estimate_cost('gpt-4o-mini', 1_000_000, 1_000_000) == pytest.approx(0.75)
+    assert estimate_cost('gpt-4o-mini', 1_000_000, 0, cached_tokens=500_000) == pytest.approx(0.1125)
+    assert estimate_cost('gpt-4o-mini', 1_000_000, 1_000_000, batch=True) == pytest.approx(0.375)
+    # Versione datata: prezzo del modello base più specifico (non quello di gpt-4o)
+    assert estimate_cost('gpt-4o-mini-2024-07-18', 1_000_000, 0) == pytest.approx(0.15)
+    assert estimate_cost('gpt-4o-2024-08-06', 1_000_000, 0) == pytest.approx(2.50)
+    assert estimate_cost('modello-sconosciuto', 1_000_000, 1_000_000) == 0.0
+
+
+def test_usage_fields_from_sdk_and_json():
+    assert usage_fields(Usage(100, 20, 64)) == (100, 20, 64)
+    assert usage_fields({'prompt_tokens': 100, 'completion_tokens': 20,
+                         'prompt_tokens_details': {'cached_tokens': 64}}) == (100, 20, 64)
+    assert usage_fields({'prompt_tokens': 100}) == (100, 0, 0)
+    assert usage_fields(None) == (0, 0, 0)
+
+
+def test_calls_and_failures_are_recorded(tmp_path):
+    ledger = LLMLedger(str(tmp_path / 'ledger.db'))
+    email = {'id': 'e1', 'from': 'Shop <News@Shop.com>'}
+    ledger.call(lambda **params: Response(Usage(1000, 200)), {'model': 'gpt-4o-mini'}, 'analysis', email)
+    
+    def failing(**params):
+        raise RuntimeError('errore 503')
+    
+    with pytest.raises(RuntimeError):
+        ledger.call(failing, {'model': 'gpt-4o-mini'}, 'analysis', email, attempt=2)
+    ledger.record('swipe', 'gpt-4o', Usage(500, 500), 1.0)
+    
+    summary = ledger.get_summary()
+    assert (summary['calls'], summary['errors'], summary['prompt_tokens']) == (3, 1, 1500)
+    assert summary['cost_usd'] == pytest.approx(estimate_cost('gpt-4o-mini', 1000, 200) + estimate_cost('gpt-4o', 500, 500))
+    
+    senders = ledger.sender_rollup()
+    assert [(row['sender'], row['calls']) for row in senders] == [('news@shop.com', 2)]
+    tasks = {row['task']: row for row in ledger.task_rollup()}
+    assert tasks['analysis']['calls'] == 2
+    assert tasks['swipe']['cost_usd'] == pytest.approx(estimate_cost('gpt-4o', 500, 500))
+    assert sum(row['calls'] for row in ledger.hourly_rollup(1)) == 3
@@ -0,0 +1,172 @@
+"""
+Test della resilienza delle chiamate: retry, circuit breaker e coda delle analisi fallite
+"""
+
+import time
+import asyncio
+import httpx
+import pytest
+from openai import APIStatusError
+import llm_resilience
+from llm_resilience import (AnalysisRetryQueue, CircuitBreaker, CircuitOpenError, RetryPolicy,
+                            is_retryable, retry_after)
+from conftest import make_emails
+
+
+def status_error(status, headers=None, code=None):
+    """
+    Errore HTTP dell'API OpenAI con status, header e codice indicati
+    """
+    response = httpx.Response(status, headers=headers, request=httpx.Request('POST', 'http://mock/v1'))
+    return APIStatusError(f"errore {status}", response=response, body={'code': code} if code else None)
+
+
+def failing(errors, result='ok'):
+    """
+    Funzione che solleva gli errori indicati, uno per tentativo, poi restituisce result
+    """
+    attempts = []
+    
+    def func(attempt):
+        attempts.append(attempt)
+        if len(attempts) <= len(errors):
+            raise errors[len(attempts) - 1]
+        return result
+    
+    return func, attempts
+
+
+def test_is_retryable():
+    assert is_retryable(status_error(429))
+    assert is_retryable(status_error(503))
+    assert not is_retryable(status_error(400))
+    assert not is_retryable(status_error(429, code='insufficient_quota'))
+    assert not is_retryable(ValueError('json non valido'))
+
+
+def test_retry_after_headers():
+    assert retry_after(status_error(429, {'retry-after-ms': '1500'})) == 1.5
+    assert retry_after(status_error(429, {'retry-after': '3'})) == 3.0
+    assert retry_after(status_error(429)) is None
+
+
+def test_breaker_states():
+    breaker = CircuitBreaker(failure_threshold=2, cooldown=0.1)
+    breaker.record_failure()
+    assert breaker.state == 'closed'
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    assert not breaker.allow()
+    
+    time.sleep(0.12)
+    assert breaker.state == 'half_open'
+    # Una sola chiamata di prova alla volta
+    assert breaker.allow()
+    assert not breaker.allow()
+    # La prova fallita riapre subito il circuito
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    
+    time.sleep(0.12)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed'
+    assert breaker.get_stats()['times_opened'] == 1
+
+
+def test_retry_until_success():
+    policy = RetryPolicy(max_retries=3, base_delay=0.01)
+    func, attempts = failing([status_error(503), status_error(429, {'retry-after': '0'})])
+    assert policy.call(func) == 'ok'
+    assert attempts == [1, 2, 3]
+    assert policy.retries == 2
+
+
+def test_permanent_error_is_not_retried():
+    policy = RetryPolicy(max_retries=3, base_delay=0.01)
+    func, attempts = failing([status_error(400)])
+    with pytest.raises(APIStatusError):
+        policy.call(func)
+    assert attempts == [1]
+
+
+def test_retry_after_longer_than_max_delay_fails():
+    policy = RetryPolicy(max_retries=3, max_delay=1)
+    func, attempts = failing([status_error(429, {'retry-after': '30'})])
+    with pytest.raises(APIStatusError):
+        policy.call(func)
+    assert attempts == [1]
+
+
+def test_open_breaker_pauses_calls_until_cooldown():
+    # Il servizio è giù per due tentativi: la chiamata aspetta invece di fallire
+    policy = RetryPolicy(max_retries=0, breaker=CircuitBreaker(failure_threshold=1, cooldown=0.1))
+    func, attempts = failing([status_error(503), status_error(503)])
+    start = time.monotonic()
+    assert policy.call(func) == 'ok'
+    assert len(attempts) == 3
+    assert time.monotonic() - start >= 0.2
+    assert policy.breaker.state == 'closed'
+
+
+def test_open_breaker_pauses_concurrent_async_calls():
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=0.1)
+    policy = RetryPolicy(max_retries=0, breaker=breaker)
+    breaker.record_failure()
+    calls = []
+    
+    async def func(attempt):
+        calls.append(time.monotonic())
+        return 'ok'
+    
+    async def run():
+        return await asyncio.gather(*(policy.acall(func) for _ in range(5)))
+    
+    start = time.monotonic()
+    assert asyncio.run(run()) == ['ok'] * 5
+    assert all(called - start >= 0.09 for called in calls)
+
+
+def test_interactive_policy_fails_fast_when_open():
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=60)
+    policy = RetryPolicy(max_retries=1, breaker=breaker, wait_when_open=False)
+    breaker.record_failure()
+    func, attempts = failing([])
+    with pytest.raises(CircuitOpenError):
+        policy.call(func)
+    assert attempts == []
+
+
+def test_analysis_pauses_instead_of_saving_unknown(analyzer):
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=0.2)
+    analyzer.backend.retry_policy.breaker = breaker
+    breaker.record_failure()
+    
+    start = time.monotonic()
+    results = analyzer.analyze_batch(make_emails('p', 4))
+    assert time.monotonic() - start >= 0.15
+    assert [result['email_id'] for result in results] == ['p0', 'p1', 'p2', 'p3']
+    assert not any('error' in result for result in results)
+
+
+def test_retry_queue_backoff_and_removal(tmp_path, monkeypatch):
+    queue = AnalysisRetryQueue(str(tmp_path / 'retry.db'), max_attempts=2)
+    now = [1000.0]
+    monkeypatch.setattr(llm_resilience.time, 'time', lambda: now[0])
+    
+    queue.enqueue({'id': 'a', 'subject': 'A'}, 'errore 503')
+    queue.enqueue({'id': 'b'}, 'errore 503')
+    queue.enqueue({}, 'senza ID')
+    assert queue.due() == []
+    assert queue.get_stats() == {'pending': 2, 'due': 0, 'exhausted': 0}
+    
+    # Primo tentativo dopo un minuto
+    now[0] += 61
+    assert [email['id'] for email in queue.due()] == ['a', 'b']
+    queue.remove(['b'])
+    
+    # Secondo fallimento: tentativi esauriti, l'email non viene più ritentata
+    queue.enqueue({'id': 'a', 'subject': 'A'}, 'errore 503')
+    now[0] += 3600
+    assert queue.due() == []
+    assert queue.get_stats() == {'pending': 0, 'due': 0, 'exhausted': 1}
@@ -0,0 +1,68 @@
+"""
+Test dell'import da Google Takeout: ID Gmail, label e messaggi malformati
+"""
+
+from mbox_importer import MboxImporter, parse_takeout_message, takeout_labels_to_ids
+from test_analysis_queue import FakeAnalyzer, FakeDatabase
+
+ACCOUNT = 'me@example.com'
+
+
+def takeout_message(msgid, thrid, labels, subject, sender='Shop <news@shop.com>'):
+    """
+    Messaggio mbox come lo scrive Takeout: riga "From <X-GM-MSGID>@xxx" e header X-GM-*
+    """
+    return (f"From {msgid}@xxx Mon Jan 06 10:00:00 +0000 2025\r\n"
+            f"X-GM-THRID: {thrid}\r\n"
+            f"X-Gmail-Labels: {labels}\r\n"
+            f"From: {sender}\r\n"
+            f"To: {ACCOUNT}\r\n"
+            f"Subject: {subject}\r\n"
+            f"Date: Mon, 06 Jan 2025 10:00:00 +0000\r\n"
+            f"Content-Type: text/plain; charset=utf-8\r\n"
+            f"\r\n"
+            f"Corpo di {subject}\r\n").encode()
+
+
+def write_mbox(path, messages):
+    path.write_bytes(b''.join(messages))
+    return str(path)
+
+
+def test_takeout_ids_and_labels_match_the_api():
+    raw = takeout_message(1234567890123, 255, 'Inbox,Opened,Category Promotions,"Newsletter"', 'Saldi')
+    from_line, _, message = raw.partition(b'\r\n')
+    email = parse_takeout_message((from_line.decode(), message, ACCOUNT, {'Newsletter': 'Label_7'}))
+    
+    # X-GM-MSGID e X-GM-THRID decimali -> ID esadecimali dell'API
+    assert email['id'] == format(1234567890123, 'x')
+    assert email['thread_id'] == 'ff'
+    assert email['labels'] == ['INBOX', 'CATEGORY_PROMOTIONS', 'Label_7']
+    assert email['subject'] == 'Saldi'
+    assert email['snippet'] == 'Corpo di Saldi'
+    assert email['account'] == ACCOUNT
+
+
+def test_takeout_only_labels_are_dropped():
+    assert takeout_labels_to_ids('Archived,Opened,Starred,Clienti') == ['STARRED', 'Clienti']
+
+
+def test_import_skips_existing_excluded_and_malformed(tmp_path):
+    malformed = b'From 3@xxx Mon Jan 06 10:00:00 +0000 2025\r\nFrom: "\\\\" <\r\n\r\ncorpo\r\n'
+    mbox_path = write_mbox(tmp_path / 'takeout.mbox', [
+        takeout_message(1, 10, 'Inbox', 'già salvata'),
+        takeout_message(2, 20, 'Inbox', 'nuova'),
+        malformed,
+        takeout_message(4, 40, 'Spam', 'spam'),
+        takeout_message(5, 50, 'Category Updates', 'ultima')
+    ])
+    db = FakeDatabase()
+    db.save_batch([{'email_id': '1'}])
+    analyzer = FakeAnalyzer()
+    
+    stats = MboxImporter(db, analyzer, ACCOUNT, workers=1, chunk_size=10).run(mbox_path)
+    
+    # Il messaggio malformato non interrompe l'import del resto dell'export
+    assert stats == {'read': 5, 'skipped': 1, 'excluded': 1, 'failed': 1, 'saved': 2}
+    assert analyzer.batches == [['2', '5']]
+    assert set(db.saved) == {'1', '2', '5'}
@@ -0,0 +1,72 @@
+"""
+Test del parser MIME dei messaggi in formato 'raw' e 'full'
+"""
+
+import base64
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from message_parser import parse_full_payload, parse_message_chunk, parse_raw_message, PARSED_FIELDS
+
+
+def nested_message() -> bytes:
+    """
+    multipart/mixed con un allegato prima di un multipart/alternative (html prima del testo)
+    """
+    alternative = MIMEMultipart('alternative')
+    alternative.attach(MIMEText('<p>Versione html</p>', 'html'))
+    alternative.attach(MIMEText('Versione testo è qui', 'plain', 'utf-8'))
+    message = MIMEMultipart('mixed')
+    message['Subject'] = 'Offerta'
+    message['From'] = 'Shop <news@shop.com>'
+    message['To'] = 'me@example.com'
+    message['List-Unsubscribe'] = '<mailto:unsubscribe@shop.com>'
+    message.attach(MIMEApplication(b'%PDF-1.4 non decodificato', Name='listino.txt'))
+    message.attach(alternative)
+    return message.as_bytes()
+
+
+def b64(data: str) -> str:
+    return base64.urlsafe_b64encode(data.encode()).decode()
+
+
+def test_raw_parser_walks_nested_parts_and_skips_attachments():
+    parsed = parse_raw_message(nested_message())
+    assert parsed['subject'] == 'Offerta'
+    assert parsed['from'] == 'Shop <news@shop.com>'
+    assert parsed['body'].strip() == 'Versione testo è qui'
+    assert parsed['headers'] == {'list-unsubscribe': '<mailto:unsubscribe@shop.com>'}
+
+
+def test_raw_parser_falls_back_to_html_and_tolerates_bad_charset():
+    html_only = MIMEText('<b>Solo html</b>', 'html').as_bytes()
+    assert parse_raw_message(html_only)['body'].strip() == '<b>Solo html</b>'
+    
+    bad_charset = b"Subject: x\r\nContent-Type: text/plain; charset=inesistente\r\n\r\nCiao \xe8\r\n"
+    assert parse_raw_message(bad_charset)['body'].startswith('Ciao')
+
+
+def test_full_payload_nested_parts():
+    payload = {
+        'headers': [{'name': 'Subject', 'value': 'Offerta'}, {'name': 'Precedence', 'value': 'bulk'}],
+        'mimeType': 'multipart/mixed',
+        'parts': [
+            {'mimeType': 'application/pdf', 'filename': 'listino.pdf', 'body': {'data': b64('pdf')}},
+            {'mimeType': 'multipart/alternative', 'parts': [
+                {'mimeType': 'text/html', 'body': {'data': b64('<p>html</p>')}},
+                {'mimeType': 'text/plain', 'body': {'data': b64('testo')}}
+            ]}
+        ]
+    }
+    parsed = parse_full_payload(payload)
+    assert parsed['subject'] == 'Offerta'
+    assert parsed['body'] == 'testo'
+    assert parsed['headers'] == {'precedence': 'bulk'}
+
+
+def test_parse_chunk_keeps_order_and_marks_failures():
+    raw = {'raw': base64.urlsafe_b64encode(nested_message()).decode()}
+    results = parse_message_chunk([raw, {'payload': None}, {'payload': {'body': {'data': b64('semplice')}}}])
+    assert dict(zip(PARSED_FIELDS, results[0]))['subject'] == 'Offerta'
+    assert results[1] is None
+    assert dict(zip(PARSED_FIELDS, results[2]))['body'] == 'semplice'
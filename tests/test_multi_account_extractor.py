@@ -0,0 +1,67 @@
+"""
+Test dell'estrazione da più account: ripresa da checkpoint e pagine per account
+"""
+
+import threading
+from multi_account_extractor import MultiAccountExtractor
+from test_gmail_extractor import FakeGmail, make_extractor
+
+
+class BarrierGmail(FakeGmail):
+    """
+    La prima pagina di ogni account attende quella degli altri: passa solo se gli account sono letti in parallelo
+    """
+    
+    def __init__(self, barrier, **options):
+        super().__init__(**options)
+        self.barrier = barrier
+    
+    def _list(self, max_results, query, offset):
+        if offset == 0:
+            self.barrier.wait(timeout=5)
+        return super()._list(max_results, query, offset)
+
+
+def make_account(address, message_ids, gmail_class=FakeGmail, profile=True, **gmail_options):
+    gmail = gmail_class(mailbox=[(message_id, 0) for message_id in message_ids], **gmail_options)
+    return make_extractor(service=gmail, parse_pool=None, fetch_mode='sequential', account_email=address,
+                          account_name=address,
+                          get_profile=lambda: profile and {'emailAddress': address, 'messagesTotal': len(message_ids)})
+
+
+def test_resume_from_page_token_skips_saved_messages():
+    extractor = MultiAccountExtractor(extractors=[make_account('me@example.com', ['a', 'b', 'c', 'd', 'e'])])
+    
+    # Il checkpoint indica la pagina che inizia da 'c'; 'c' era già stata salvata prima dell'interruzione
+    pages = list(extractor.iter_email_pages(page_size=2, page_tokens={'me@example.com': '2'},
+                                            skip_existing=lambda message_ids: {'c'} & set(message_ids)))
+    assert [(account, [email['id'] for email in emails], message_ids, token)
+            for account, emails, message_ids, token in pages] == [
+        ('me@example.com', ['d'], ['c', 'd'], '4'),
+        ('me@example.com', ['e'], ['e'], None)
+    ]
+
+
+def test_accounts_are_read_concurrently():
+    barrier = threading.Barrier(2)
+    extractor = MultiAccountExtractor(extractors=[
+        make_account('a@example.com', ['a1', 'a2', 'a3'], BarrierGmail, barrier=barrier),
+        make_account('b@example.com', ['b1', 'b2'], BarrierGmail, barrier=barrier)
+    ])
+    
+    emails = {}
+    for account, page_emails, _, _ in extractor.iter_email_pages(page_size=2):
+        emails.setdefault(account, []).extend(email['id'] for email in page_emails)
+        assert all(email['account'] == account for email in page_emails)
+    assert emails == {'a@example.com': ['a1', 'a2', 'a3'], 'b@example.com': ['b1', 'b2']}
+
+
+def test_failing_account_does_not_stop_the_others():
+    extractor = MultiAccountExtractor(extractors=[
+        make_account('a@example.com', ['a1'], list_errors=[400]),
+        make_account('b@example.com', ['b1']),
+        make_account('offline@example.com', ['c1'], profile=False)
+    ])
+    assert list(extractor.extractors) == ['a@example.com', 'b@example.com']
+    pages = [(account, [email['id'] for email in emails]) for account, emails, _, _ in extractor.iter_email_pages()]
+    assert pages == [('b@example.com', ['b1'])]
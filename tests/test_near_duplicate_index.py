@@ -0,0 +1,55 @@
+"""
+Test dell'indice near-duplicate MinHash/LSH
+"""
+
+import email_analyzer
+from near_duplicate_index import NearDuplicateIndex, STRUCTURAL_FIELDS, estimate_similarity, shingles
+
+TEMPLATE = ("Ciao {name}, solo per oggi il {discount}% di sconto su tutta la collezione autunno. "
+            "Spedizione gratuita sopra i 50 euro e reso facile entro trenta giorni. "
+            "Scopri i nuovi arrivi prima che finiscano e approfitta del codice riservato agli iscritti.")
+OTHER = ("Il tuo abbonamento è stato rinnovato. Trovi la ricevuta nella sezione fatture del profilo "
+         "insieme allo storico dei pagamenti e alle impostazioni del metodo di pagamento predefinito.")
+ANALYSIS = {'email_type': 'marketing', 'campaign_type': 'promo', 'funnel_stage': 'conversion',
+            'target_audience': 'clienti', 'notes': 'non strutturale'}
+
+
+def test_numbers_do_not_change_shingles():
+    assert shingles(TEMPLATE.format(name='Anna', discount=20)) == shingles(TEMPLATE.format(name='Anna', discount=35))
+
+
+def test_template_variant_matches_structural_fields(tmp_path):
+    index = NearDuplicateIndex(str(tmp_path / 'emails.db'), threshold=0.6)
+    original = index.signature(TEMPLATE.format(name='Anna', discount=20))
+    index.add('e1', original, ANALYSIS)
+    index.add('e2', index.signature(OTHER), {'email_type': 'transactional'})
+    
+    variant = index.signature(TEMPLATE.format(name='Marco', discount=35))
+    assert estimate_similarity(original, variant) >= 0.6
+    email_id, similarity, structural = index.query(variant)
+    assert email_id == 'e1'
+    assert similarity >= 0.6
+    assert structural == {field: ANALYSIS[field] for field in structural}
+    assert 'notes' not in structural
+    assert index.matches == 1
+
+
+def test_unrelated_email_and_short_body(tmp_path):
+    index = NearDuplicateIndex(str(tmp_path / 'emails.db'))
+    index.add('e1', index.signature(TEMPLATE.format(name='Anna', discount=20)), ANALYSIS)
+    assert index.query(index.signature(OTHER)) is None
+    # Corpo troppo corto per una firma affidabile
+    assert index.signature('Grazie!') is None
+
+
+def test_variant_prompt_follows_field_descriptions(analyzer, monkeypatch):
+    monkeypatch.setitem(email_analyzer.ANALYSIS_FIELD_DESCRIPTIONS, 'retention', 'Retention strategy, if any')
+    prompt = analyzer._create_specific_prompt({'from': 'news@shop.com', 'subject': 'Saldi', 'body': OTHER}, ANALYSIS)
+    
+    assert '"retention": "Retention strategy, if any"' in prompt
+    for field in email_analyzer.SPECIFIC_FIELDS:
+        assert f'"{field}": ' in prompt
+    # I campi strutturali vengono dal template, non sono richiesti al modello
+    for field in STRUCTURAL_FIELDS:
+        assert f'{field}: {ANALYSIS[field]}' in prompt
+        assert f'"{field}": ' not in prompt
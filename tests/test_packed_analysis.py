@@ -0,0 +1,65 @@
+"""
+Test dell'analisi impacchettata: validazione della risposta, analisi singola di riserva e registro per mittente
+"""
+
+import json
+from email_analyzer import ANALYSIS_FIELDS
+from llm_ledger import LLMLedger
+from test_batch_offline import batch_state
+from conftest import make_emails
+
+ANALYSIS = {field: 'valore' for field in ANALYSIS_FIELDS}
+
+
+def packed(*items):
+    return json.dumps({'results': [{**ANALYSIS, **item} for item in items]})
+
+
+def test_packed_response_validation(analyzer):
+    emails = make_emails('v', 4)
+    content = packed(
+        {'id': 'v0'},
+        {'id': 'v1'}, {'id': 'v1'},        # duplicato: nessuna delle due copie è affidabile
+        {'id': 'v2', 'email_type': ' '},   # email_type vuoto
+        {'id': 'altro'}                    # ID non richiesto
+    )
+    analyses = analyzer._parse_packed_response(content, emails)
+    assert analyses == [ANALYSIS, None, None, None]
+    
+    assert analyzer._parse_packed_response('non json', emails) == [None] * 4
+    assert analyzer._parse_packed_response('{"risultati": []}', emails) == [None] * 4
+    assert analyzer._parse_packed_response(json.dumps([{**ANALYSIS, 'id': 'v3', 'notes': 3}]), emails) == [None] * 4
+
+
+def test_invalid_items_fall_back_to_single_requests(analyzer, monkeypatch):
+    analyzer.pack_token_budget = 100000
+    parse = analyzer._parse_packed_response
+    # Il modello omette l'ultima email del pacchetto
+    monkeypatch.setattr(analyzer, '_parse_packed_response',
+                        lambda content, emails: parse(content, emails)[:-1] + [None])
+    
+    results = analyzer.analyze_batch(make_emails('f', 5))
+    assert [result['email_id'] for result in results] == ['f0', 'f1', 'f2', 'f3', 'f4']
+    assert not any('error' in result for result in results)
+    # Una richiesta per il pacchetto, una per l'email non validata
+    assert batch_state(analyzer).chat_requests == 2
+
+
+def test_packed_request_is_split_across_senders(analyzer, tmp_path):
+    ledger = LLMLedger(str(tmp_path / 'ledger.db'))
+    analyzer.backend.ledger = ledger
+    analyzer.pack_token_budget = 100000
+    emails = make_emails('s', 4)
+    for email in emails[2:]:
+        email['from'] = 'Altro <promo@altro.it>'
+    
+    analyzer.analyze_batch(emails)
+    summary = ledger.get_summary()
+    assert (summary['calls'], summary['emails']) == (1, 4)
+    
+    senders = {row['sender']: row for row in ledger.sender_rollup()}
+    assert set(senders) == {'news@shop.com', 'promo@altro.it'}
+    for row in senders.values():
+        assert row['calls'] == 2
+        assert abs(row['prompt_tokens'] - summary['prompt_tokens'] / 2) < 1e-6
+        assert abs(row['cost_usd'] - summary['cost_usd'] / 2) < 1e-9
@@ -0,0 +1,53 @@
+"""
+Test della pre-classificazione con regole: casi certi risolti senza modello, casi ambigui al modello
+"""
+
+from pre_classifier import PreClassifier, RULES_MODEL
+from test_batch_offline import batch_state
+
+
+def email(subject, sender='Shop <orders@shop.com>', labels=(), headers=None, body=''):
+    return {'id': subject, 'from': sender, 'subject': subject, 'body': body, 'date': '',
+            'labels': list(labels), 'headers': headers or {}}
+
+
+def test_certain_cases_are_classified():
+    classifier = PreClassifier()
+    receipt = classifier.classify(email('Your order #123 has shipped', body='Totale: €49,90'))
+    assert receipt['email_type'] == 'transactional'
+    assert receipt['pricing_extract'] == '€49,90'
+    
+    assert classifier.classify(email('Reset your password', sender='security@bank.com'))['funnel_stage'] == 'retention'
+    assert classifier.classify(email('Invitation: Call @ lun 10:00', sender='Anna <anna@example.com>'))['email_type'] == 'personal'
+    assert classifier.classify(email('Re: cena sabato', sender='Anna <anna@example.com>'))['notes'] == 'Rule-based: personal conversation.'
+    assert classifier.classify(email('Nuovo accesso', sender='no-reply@service.com',
+                                     labels=['CATEGORY_UPDATES']))['campaign_type'] == 'transactional'
+    assert classifier.get_stats() == {
+        'checked': 5, 'saved_calls': 5,
+        'rules': {'receipt': 1, 'security': 1, 'calendar': 1, 'personal': 1, 'notification': 1}
+    }
+
+
+def test_ambiguous_cases_go_to_the_model():
+    classifier = PreClassifier()
+    # Le promozioni restano al modello anche se citano un ordine
+    assert classifier.classify(email('Your order ships free this weekend', labels=['CATEGORY_PROMOTIONS'])) is None
+    # Newsletter: un "Re:" o una ricevuta in una mailing list non sono certi
+    newsletter = {'List-Unsubscribe': '<mailto:unsubscribe@shop.com>'}
+    assert classifier.classify(email('Re: le novità di ottobre', sender='Anna <anna@shop.com>', headers=newsletter)) is None
+    assert classifier.classify(email('Your receipt from our store', headers=newsletter)) is None
+    # Email salvate senza header: potrebbero essere mailing list
+    legacy = email('Re: cena sabato', sender='Anna <anna@example.com>')
+    del legacy['headers']
+    assert classifier.classify(legacy) is None
+    assert classifier.get_stats()['saved_calls'] == 0
+
+
+def test_rule_classified_emails_skip_the_model(analyzer):
+    analyzer.pre_classifier = PreClassifier()
+    emails = [email('Your order #9 has shipped'), email('Saldi di ottobre', labels=['CATEGORY_PROMOTIONS'])]
+    results = analyzer.analyze_batch(emails)
+    
+    assert results[0]['analysis_model'] == RULES_MODEL
+    assert results[1]['analysis_model'] != RULES_MODEL
+    assert batch_state(analyzer).chat_requests == 1
@@ -0,0 +1,42 @@
+"""
+Test del budget RPM/TPM asincrono
+"""
+
+import asyncio
+import time
+from rate_limiter import AsyncRateBudget
+
+
+async def acquire_all(budget, count, tokens=1):
+    await asyncio.gather(*(budget.acquire(tokens) for _ in range(count)))
+
+
+def test_budget_waits_when_tokens_run_out():
+    # 600 token al minuto = 10 al secondo: le 5 richieste oltre la capacità attendono circa mezzo secondo
+    budget = AsyncRateBudget(requests_per_minute=100000, tokens_per_minute=600)
+    start = time.monotonic()
+    asyncio.run(acquire_all(budget, 605))
+    assert 0.3 < time.monotonic() - start < 2
+    assert budget.waited_seconds > 0
+
+
+def test_budget_usable_from_several_event_loops():
+    # Ogni batch dell'analizzatore usa un nuovo asyncio.run: il lock non deve restare legato al primo loop
+    budget = AsyncRateBudget(requests_per_minute=100000, tokens_per_minute=600)
+    asyncio.run(acquire_all(budget, 602))
+    asyncio.run(acquire_all(budget, 3))
+    asyncio.run(acquire_all(budget, 3))
+
+
+def test_budget_passes_requests_larger_than_bucket():
+    budget = AsyncRateBudget(requests_per_minute=100000, tokens_per_minute=600)
+    asyncio.run(acquire_all(budget, 1, tokens=5000))
+    assert budget.waited_seconds == 0
+
+
+def test_record_usage_returns_unused_tokens():
+    budget = AsyncRateBudget(requests_per_minute=60, tokens_per_minute=1000)
+    asyncio.run(acquire_all(budget, 1, tokens=500))
+    budget.record_usage(500, 100)
+    assert budget.tokens_used == 100
+    assert budget._tokens >= 900
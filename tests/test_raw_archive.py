@@ -0,0 +1,47 @@
+"""
+Test dell'archivio raw: round-trip, deduplicazione e voci non leggibili
+"""
+
+import os
+from raw_archive import RawMessageArchive
+
+RAW = b"From: a@example.com\r\nTo: b@example.com\r\nSubject: Ciao\r\n\r\nCorpo del messaggio\r\n"
+
+
+def test_round_trip_and_metadata(tmp_path):
+    archive = RawMessageArchive(str(tmp_path), codec='zlib')
+    archive.put('m1', RAW, 't1', ['INBOX'], 'Corpo')
+    
+    assert archive.get('m1') == RAW
+    assert archive.get('missing') is None
+    entry = archive.get_metadata('m1')
+    assert entry['thread_id'] == 't1'
+    assert entry['labels'] == ['INBOX']
+    assert entry['size'] == len(RAW)
+    assert archive.get_existing_ids(['m1', 'missing']) == {'m1'}
+
+
+def test_identical_messages_share_one_object(tmp_path):
+    archive = RawMessageArchive(str(tmp_path), codec='zlib')
+    assert archive.put('m1', RAW) == archive.put('m2', RAW)
+    objects = [name for _, _, files in os.walk(tmp_path / 'objects') for name in files]
+    assert len(objects) == 1
+    assert archive.get('m2') == RAW
+
+
+def test_discard_lets_put_rewrite_corrupt_object(tmp_path):
+    archive = RawMessageArchive(str(tmp_path), codec='zlib')
+    sha256 = archive.put('m1', RAW)
+    path = archive._object_path(sha256, 'zlib')
+    with open(path, 'wb') as f:
+        f.write(b'corrotto')
+    
+    # Senza discard() il file corrotto resterebbe: put() non sovrascrive
+    archive.put('m1', RAW)
+    with open(path, 'rb') as f:
+        assert f.read() == b'corrotto'
+    
+    archive.discard('m1')
+    assert archive.get_existing_ids(['m1']) == set()
+    archive.put('m1', RAW)
+    assert archive.get('m1') == RAW
@@ -0,0 +1,33 @@
+"""
+Test della rianalisi selettiva a blocchi con lo stesso analizzatore
+"""
+
+from argparse import Namespace
+from conftest import exhaust_budget, make_emails
+from database import EmailDatabase
+from email_analyzer import FIELD_VERSIONS
+from reanalyze import select_emails, save_results
+
+
+def test_reanalyze_several_chunks(analyzer, tmp_path):
+    db = EmailDatabase(str(tmp_path / 'emails.db'))
+    for email in make_emails('r', 12):
+        db.save_email({'email_id': email['id'], 'sender': email['from'], 'subject': email['subject'],
+                       'email_body': email['body'], 'email_type': 'marketing', 'notes': 'vecchia nota',
+                       'analysis_fields': {**FIELD_VERSIONS, 'notes': 0}})
+    
+    args = Namespace(fields=None, sender=None, model=None, limit=None, since=None, until=None)
+    emails = select_emails(db, args)
+    assert len(emails) == 12 and all(email['stale_fields'] == ['notes'] for email in emails)
+    
+    # Tre blocchi, ognuno con un nuovo asyncio.run e il budget TPM esaurito
+    updated = 0
+    for start in range(0, len(emails), 5):
+        chunk = emails[start:start + 5]
+        exhaust_budget(analyzer.budget)
+        results = analyzer.reanalyze_fields(chunk)
+        assert None not in results
+        updated += save_results(db, chunk, results)
+    
+    assert updated == 12
+    assert select_emails(db, args) == []
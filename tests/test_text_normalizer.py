@@ -0,0 +1,74 @@
+"""
+Test della normalizzazione dei corpi email e del troncamento a budget di token
+"""
+
+import sys
+import types
+import pytest
+import text_normalizer
+from text_normalizer import count_tokens, normalize_body, truncate_to_tokens
+
+
+class TenCharEncoding:
+    """
+    Tokenizer di prova: un token ogni 10 caratteri
+    """
+    
+    def encode(self, text, disallowed_special=()):
+        return [text[i:i + 10] for i in range(0, len(text), 10)]
+    
+    def decode(self, tokens):
+        return ''.join(tokens)
+
+
+def fake_tiktoken(encoding_for_model):
+    module = types.ModuleType('tiktoken')
+    module.encoding_for_model = encoding_for_model
+    module.get_encoding = encoding_for_model
+    return module
+
+
+@pytest.fixture
+def tokenizer(monkeypatch):
+    """
+    Installa un tiktoken finto; restituisce una funzione per sceglierne il comportamento
+    """
+    def install(encoding_for_model):
+        monkeypatch.setitem(sys.modules, 'tiktoken', fake_tiktoken(encoding_for_model))
+        text_normalizer._get_encoding.cache_clear()
+    yield install
+    text_normalizer._get_encoding.cache_clear()
+
+
+def test_normalize_body_strips_html_and_tracking_urls():
+    html = ('<html><head><style>p {color: red}</style></head><body>'
+            '<div style="display:none">preheader​​</div>'
+            '<p>Ciao   Mario</p><p>Vai a https://track.shop.com/c?id=123</p></body></html>')
+    assert normalize_body(html) == 'Ciao Mario\n\nVai a [link: track.shop.com]'
+
+
+def test_normalize_body_is_not_cached():
+    # Un lru_cache sul corpo intero tratterrebbe in memoria i corpi HTML per tutta la vita del processo
+    assert not hasattr(normalize_body, 'cache_info')
+
+
+def test_truncate_keeps_text_under_budget_longer_than_prefix(tokenizer):
+    tokenizer(lambda model: TenCharEncoding())
+    # 180 token in 1800 caratteri: oltre gli 8 caratteri per token del primo blocco, ma nel budget
+    text = 'x' * 1800
+    assert truncate_to_tokens(text, 200) == text
+
+
+def test_truncate_cuts_at_token_budget(tokenizer):
+    tokenizer(lambda model: TenCharEncoding())
+    assert truncate_to_tokens('x' * 3000, 200) == 'x' * 2000
+    assert truncate_to_tokens('x' * 50, 200) == 'x' * 50
+
+
+def test_tokenizer_download_failure_falls_back_to_estimate(tokenizer):
+    def offline(model):
+        raise ConnectionError('rete non disponibile')
+    tokenizer(offline)
+    
+    assert count_tokens('x' * 400) == 100
+    assert truncate_to_tokens('x' * 1000, 100) == 'x' * 400
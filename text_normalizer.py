@@ -0,0 +1,276 @@
+"""
+Conversione HTML -> testo e troncamento a budget di token dei corpi email
+Il testo normalizzato è quello usato da ricerca, analisi AI e generazione degli swipe
+"""
+
+import os
+import re
+import sys
+import sqlite3
+from functools import lru_cache
+from html import unescape
+from html.parser import HTMLParser
+from typing import Optional
+from urllib.parse import urlparse
+from dotenv import load_dotenv
+
+# Carica variabili d'ambiente
+load_dotenv()
+
+
+# Token del corpo inclusi nei prompt di analisi
+ANALYSIS_BODY_TOKENS = int(os.getenv('ANALYSIS_BODY_TOKENS', 1000))
+
+# Encoding tiktoken usato se il modello non è riconosciuto
+DEFAULT_ENCODING = 'o200k_base'
+
+# Tag il cui contenuto non è testo visibile
+SKIPPED_TAGS = {'style', 'script', 'head', 'title', 'noscript', 'template', 'svg'}
+
+# Tag che iniziano una nuova riga
+BLOCK_TAGS = {'p', 'div', 'br', 'tr', 'li', 'ul', 'ol', 'table', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+              'blockquote', 'section', 'article', 'header', 'footer', 'hr', 'center'}
+
+# Tag senza chiusura
+VOID_TAGS = {'br', 'hr', 'img', 'meta', 'link', 'input', 'col', 'area', 'base', 'wbr', 'source'}
+
+# Stili usati per nascondere il preheader e altri blocchi invisibili
+HIDDEN_STYLE_PATTERN = re.compile(
+    r'display\s*:\s*none|visibility\s*:\s*hidden|mso-hide\s*:\s*all|max-height\s*:\s*0|'
+    r'font-size\s*:\s*0|opacity\s*:\s*0(?![.\d]*[1-9])', re.IGNORECASE)
+
+# Caratteri invisibili usati come riempimento del preheader
+PADDING_CHARS_PATTERN = re.compile('[\u034f\u00ad\u200b\u200c\u200d\u2007\u2060\ufeff]')
+
+HTML_PATTERN = re.compile(r'<(html|body|div|table|p|br|span|a)\b', re.IGNORECASE)
+URL_PATTERN = re.compile(r'https?://[^\s<>"\'\)\]]+')
+SPACES_PATTERN = re.compile('[ \t\r\f\v\u00a0]+')
+BLANK_LINES_PATTERN = re.compile(r'\n\s*\n+')
+
+
+class _TextExtractor(HTMLParser):
+    """
+    Raccoglie il testo visibile di un documento HTML
+    """
+    
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        # Pila dei tag aperti: True se il tag nasconde il suo contenuto
+        self.stack = []
+        self.hidden_depth = 0
+    
+    def handle_starttag(self, tag, attrs):
+        if tag in VOID_TAGS:
+            if tag in ('br', 'hr') and not self.hidden_depth:
+                self.parts.append('\n')
+            return
+        
+        attributes = dict(attrs)
+        hidden = (tag in SKIPPED_TAGS
+                  or 'hidden' in attributes
+                  or bool(HIDDEN_STYLE_PATTERN.search(attributes.get('style') or '')))
+        self.stack.append((tag, hidden))
+        if hidden:
+            self.hidden_depth += 1
+        elif tag in BLOCK_TAGS and not self.hidden_depth:
+            self.parts.append('\n')
+    
+    def handle_endtag(self, tag):
+        # HTML delle email spesso malformato: chiude fino al tag corrispondente, se aperto
+        if not any(open_tag == tag for open_tag, _ in self.stack):
+            return
+        while self.stack:
+            open_tag, hidden = self.stack.pop()
+            if hidden:
+                self.hidden_depth -= 1
+            if open_tag == tag:
+                break
+        if tag in BLOCK_TAGS and not self.hidden_depth:
+            self.parts.append('\n')
+    
+    def handle_data(self, data):
+        if not self.hidden_depth:
+            self.parts.append(data)
+
+
+def looks_like_html(text: str) -> bool:
+    """
+    True se il testo contiene markup HTML
+    """
+    return bool(HTML_PATTERN.search(text[:5000]))
+
+
+def collapse_url(match) -> str:
+    """
+    Sostituisce un URL (spesso di tracking) con il solo dominio
+    """
+    host = urlparse(match.group(0)).netloc
+    return f"[link: {host}]" if host else ''
+
+
+def html_to_text(html: str) -> str:
+    """
+    Estrae il testo visibile da un corpo HTML
+    
+    Scarta style, script e blocchi nascosti (preheader), mantiene il
+    testo dei link senza i loro URL.
+    
+    Args:
+        html: Corpo HTML
+    
+    Returns:
+        Testo con un a capo per ogni blocco
+    """
+    extractor = _TextExtractor()
+    try:
+        extractor.feed(html)
+        extractor.close()
+    except Exception:
+        # HTML non parsabile: rimuove i tag con una regex
+        return unescape(re.sub(r'<[^>]+>', ' ', html))
+    return ''.join(extractor.parts)
+
+
+def normalize_body(body: str) -> str:
+    """
+    Testo pulito di un corpo email (HTML o testo semplice)
+    
+    Converte l'HTML in testo, rimuove i caratteri di riempimento invisibili,
+    riduce gli URL al dominio e compatta spazi e righe vuote.
+    
+    Args:
+        body: Corpo dell'email
+    
+    Returns:
+        Testo normalizzato
+    """
+    if not body:
+        return ''
+    text = html_to_text(body) if looks_like_html(body) else body
+    text = PADDING_CHARS_PATTERN.sub('', text)
+    text = URL_PATTERN.sub(collapse_url, text)
+    text = SPACES_PATTERN.sub(' ', text)
+    text = '\n'.join(line.strip() for line in text.split('\n'))
+    return BLANK_LINES_PATTERN.sub('\n\n', text).strip()
+
+
+def email_body_text(email: dict) -> str:
+    """
+    Testo normalizzato di un'email, calcolato una volta e salvato nel dizionario
+    
+    Accetta sia il formato di GmailExtractor (body) sia quello del database
+    (email_body, email_body_text).
+    """
+    if email.get('email_body_text') is None:
+        email['email_body_text'] = normalize_body(email.get('body', email.get('email_body', '')) or '')
+    return email['email_body_text']
+
+
+@lru_cache(maxsize=8)
+def _get_encoding(model: str):
+    """
+    Encoding tiktoken del modello (None se tiktoken non è installato o non può caricare l'encoding)
+    """
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding(DEFAULT_ENCODING)
+    except Exception as e:
+        # Al primo uso tiktoken scarica il file BPE: senza rete (es. backend mock) si usa la stima
+        print(f"⚠️  Tokenizer tiktoken non disponibile ({e}): stima a 4 caratteri per token")
+        return None
+
+
+def count_tokens(text: str, model: str = 'gpt-4o-mini') -> int:
+    """
+    Token del testo per il modello (stima a 4 caratteri per token senza tiktoken)
+    """
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int = ANALYSIS_BODY_TOKENS, model: str = 'gpt-4o-mini') -> str:
+    """
+    Tronca il testo a un numero massimo di token
+    
+    Args:
+        text: Testo da troncare
+        max_tokens: Budget di token
+        model: Modello di cui usare il tokenizer
+    
+    Returns:
+        Testo troncato (intero se rientra nel budget)
+    """
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return text[:max_tokens * 4]
+    # Un testo lungo si codifica prima in parte: se già questa sfora il budget non serve il resto
+    prefix = text[:max_tokens * 8]
+    tokens = encoding.encode(prefix, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        if len(prefix) == len(text):
+            return text
+        tokens = encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+    return encoding.decode(tokens[:max_tokens])
+
+
+def prompt_body(email: dict, max_tokens: int = ANALYSIS_BODY_TOKENS, model: str = 'gpt-4o-mini') -> str:
+    """
+    Corpo da inserire in un prompt: testo normalizzato troncato al budget di token
+    """
+    return truncate_to_tokens(email_body_text(email), max_tokens, model)
+
+
+def backfill_body_text(db_path: str = 'emails.db', limit: Optional[int] = None) -> int:
+    """
+    Calcola email_body_text per le email salvate prima della sua introduzione
+    
+    Args:
+        db_path: Database delle email
+        limit: Numero massimo di email da aggiornare (None = tutte)
+    
+    Returns:
+        Numero di email aggiornate
+    """
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    query = 'SELECT email_id, email_body FROM emails WHERE email_body_text IS NULL'
+    if limit:
+        query += f' LIMIT {int(limit)}'
+    cursor.execute(query)
+    rows = cursor.fetchall()
+    cursor.executemany('UPDATE emails SET email_body_text = ? WHERE email_id = ?',
+                       [(normalize_body(body or ''), email_id) for email_id, body in rows])
+    conn.commit()
+    conn.close()
+    return len(rows)
+
+
+def main():
+    """
+    Uso: python text_normalizer.py backfill [emails.db]
+    """
+    if len(sys.argv) < 2 or sys.argv[1] != 'backfill':
+        print(main.__doc__.strip())
+        return
+    
+    from database import EmailDatabase
+    db_path = sys.argv[2] if len(sys.argv) > 2 else 'emails.db'
+    # Crea la colonna email_body_text se il database non è ancora migrato
+    EmailDatabase(db_path)
+    count = backfill_body_text(db_path)
+    print(f"✅ Testo normalizzato calcolato per {count} email")
+
+
+if __name__ == '__main__':
+    main()